@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LmsApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LMS_API'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from LMS_Core.models import Books, Authors, BookLending
+from .replicas import reading_from_replica
+
+
+def detail_cache_key(model, pk) -> str:
+    return f'lms:detail:{model._meta.label_lower}:{pk}'
+
+
+def validators_cache_key(model, pk) -> str:
+    return f'lms:validators:{model._meta.label_lower}:{pk}'
+
+
+def _hold_key(key: str) -> str:
+    return f'{key}:hold'
+
+
+def _unheld(entries: dict) -> dict:
+    """
+    :param entries: {cache key: value} about to be cached
+    :return: the entries to cache; what was read from a replica is dropped for the keys
+        evicted less than LMS_REPLICA_STICKY_SECONDS ago, as the replica may not have the write yet
+    """
+    if not entries or not reading_from_replica():
+        return entries
+    held = cache.get_many([_hold_key(key) for key in entries])
+    return {key: value for key, value in entries.items() if _hold_key(key) not in held}
+
+
+async def _aunheld(entries: dict) -> dict:
+    """
+    Async counterpart of _unheld()
+    """
+    if not entries or not reading_from_replica():
+        return entries
+    held = await cache.aget_many([_hold_key(key) for key in entries])
+    return {key: value for key, value in entries.items() if _hold_key(key) not in held}
+
+
+def get_cached_detail(model, pk):
+    """
+    :param model: model class of the detail endpoint
+    :param pk:
+    :return: the cached response data, or None
+    """
+    return cache.get(detail_cache_key(model, pk))
+
+
+async def aget_cached_detail(model, pk):
+    """
+    Async counterpart of get_cached_detail()
+    """
+    return await cache.aget(detail_cache_key(model, pk))
+
+
+def set_cached_detail(model, pk, data):
+    cache.set_many(_unheld({detail_cache_key(model, pk): dict(data)}), timeout=settings.LMS_DETAIL_CACHE_TTL)
+
+
+async def aset_cached_detail(model, pk, data):
+    await cache.aset_many(await _aunheld({detail_cache_key(model, pk): dict(data)}), timeout=settings.LMS_DETAIL_CACHE_TTL)
+
+
+def get_cached_details(model, pks) -> dict:
+    """
+    :param model: model class of the detail endpoint
+    :param pks:
+    :return: {pk: cached response data} of the pks found in the cache, from one cache round trip
+    """
+    keys = {detail_cache_key(model, pk): pk for pk in pks}
+    return {keys[key]: data for key, data in cache.get_many(keys).items()}
+
+
+def set_cached_details(model, data_by_pk: dict):
+    cache.set_many(
+        _unheld({detail_cache_key(model, pk): dict(data) for pk, data in data_by_pk.items()}),
+        timeout=settings.LMS_DETAIL_CACHE_TTL
+    )
+
+
+def get_cached_validators(model, pk):
+    """
+    :param model:
+    :param pk:
+    :return: the cached (etag, last_modified) of the detail endpoint, or None
+    """
+    return cache.get(validators_cache_key(model, pk))
+
+
+async def aget_cached_validators(model, pk):
+    """
+    Async counterpart of get_cached_validators()
+    """
+    return await cache.aget(validators_cache_key(model, pk))
+
+
+def set_cached_validators(model, pk, validators: tuple):
+    cache.set_many(_unheld({validators_cache_key(model, pk): validators}), timeout=settings.LMS_DETAIL_CACHE_TTL)
+
+
+async def aset_cached_validators(model, pk, validators: tuple):
+    await cache.aset_many(await _aunheld({validators_cache_key(model, pk): validators}), timeout=settings.LMS_DETAIL_CACHE_TTL)
+
+
+def _evict(model, pks):
+    """
+    Delete the cached details and validators now and once more after commit,
+    so a read racing the write can not leave a pre-commit copy behind. With
+    replicas, the keys are also held against reads from a lagging replica.
+    """
+    keys = [key for pk in pks for key in (detail_cache_key(model, pk), validators_cache_key(model, pk))]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+    if settings.LMS_DATABASE_REPLICAS:
+        holds = dict.fromkeys(map(_hold_key, keys), True)
+        transaction.on_commit(lambda: cache.set_many(holds, timeout=settings.LMS_REPLICA_STICKY_SECONDS))
+
+
+def invalidate_books(book_ids, include_lendings: bool = True):
+    """
+    Evict the books and every cached author embedding them
+    :param book_ids:
+    :param include_lendings: also evict the lendings embedding the books; not needed
+        when only the availability changed, since lendings do not show it
+    """
+    book_ids = list(book_ids)
+    if not book_ids:
+        return
+    _evict(Books, book_ids)
+    _evict(Authors, set(Authors.books.through.objects.filter(books_id__in=book_ids).values_list('authors_id', flat=True)))
+    if include_lendings:
+        _evict(BookLending, set(
+            BookLending.book.through.objects.filter(books_id__in=book_ids).values_list('booklending_id', flat=True)
+        ))
+
+
+def invalidate_authors(author_ids):
+    """
+    Evict the authors and every cached book embedding them
+    :param author_ids:
+    """
+    author_ids = list(author_ids)
+    if not author_ids:
+        return
+    _evict(Authors, author_ids)
+    _evict(Books, set(Authors.books.through.objects.filter(authors_id__in=author_ids).values_list('books_id', flat=True)))
+
+
+def invalidate_lendings(lend_ids):
+    _evict(BookLending, lend_ids)
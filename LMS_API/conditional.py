@@ -0,0 +1,176 @@
+import datetime
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .cache import aget_cached_validators, aset_cached_validators, get_cached_validators, set_cached_validators
+from .pagination import acount_version, count_version, page_queryset
+
+
+def _etag(*parts) -> str:
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def conditional_view(validators_func):
+    """
+    Like django.views.decorators.http.condition, with the ETag and Last-Modified
+    computed together, once per request. If-None-Match/If-Modified-Since are
+    answered with a 304 before the view runs.
+    :param validators_func: (request, *args, **kwargs) -> (etag, last_modified), or None to skip
+    """
+    def get_validators(request, *args, **kwargs):
+        if not hasattr(request, '_lms_validators'):
+            validators = None
+            if request.method in ('GET', 'HEAD'):
+                validators = validators_func(request, *args, **kwargs)
+            request._lms_validators = validators or (None, None)
+        return request._lms_validators
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: get_validators(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: get_validators(request, *args, **kwargs)[1],
+    )
+
+
+def async_conditional_view(validators_func):
+    """
+    conditional_view() for async views
+    :param validators_func: async (request, *args, **kwargs) -> (etag, last_modified), or None to skip
+    """
+    def decorator(func):
+        @wraps(func)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = None, None
+            if request.method in ('GET', 'HEAD'):
+                etag, last_modified = await validators_func(request, *args, **kwargs) or (None, None)
+            etag = quote_etag(etag) if etag is not None else None
+            if last_modified:
+                if not timezone.is_aware(last_modified):
+                    last_modified = timezone.make_aware(last_modified, datetime.timezone.utc)
+                last_modified = int(last_modified.timestamp())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await func(request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+def _detail_row(model, relation: str, pk):
+    """
+    :return: queryset of the (updated_at, related_updated_at, related_count, related_id_sum) row of the object
+    """
+    return model.objects.filter(id=pk).annotate(
+        related_updated_at=Max(f'{relation}__updated_at'),
+        related_count=Count(relation),
+        related_id_sum=Sum(f'{relation}__id'),
+    ).values_list('updated_at', 'related_updated_at', 'related_count', 'related_id_sum')
+
+
+def _detail_result(model, pk, row):
+    """
+    :return: (etag, last_modified) from the _detail_row() row; None if there is no object
+    """
+    if row is None:
+        return None
+    updated_at, related_updated_at, related_count, related_id_sum = row
+    last_modified = max(updated_at, related_updated_at) if related_updated_at else updated_at
+    return (
+        _etag(model._meta.label_lower, pk, updated_at.isoformat(), related_updated_at, related_count, related_id_sum),
+        last_modified
+    )
+
+
+def detail_validators(model, relation: str):
+    """
+    Validators of a detail endpoint, from the object's updated_at and the
+    updated_at, count and ids of its embedded relation, in one query. They are
+    cached next to the detail response and evicted with it.
+    :param model:
+    :param relation: name of the relation the detail serializer embeds
+    """
+    def validators(request, **kwargs):
+        pk = next(iter(kwargs.values()))
+        cached = get_cached_validators(model, pk)
+        if cached is not None:
+            return cached
+        result = _detail_result(model, pk, _detail_row(model, relation, pk).first())
+        if result is not None:
+            set_cached_validators(model, pk, result)
+        return result
+    return validators
+
+
+def adetail_validators(model, relation: str):
+    """
+    detail_validators() for async views, through the async ORM
+    :param model:
+    :param relation:
+    """
+    async def validators(request, **kwargs):
+        pk = next(iter(kwargs.values()))
+        cached = await aget_cached_validators(model, pk)
+        if cached is not None:
+            return cached
+        result = _detail_result(model, pk, await _detail_row(model, relation, pk).afirst())
+        if result is not None:
+            await aset_cached_validators(model, pk, result)
+        return result
+    return validators
+
+
+_PAGE_AGGREGATES = {'last_modified': Max('updated_at'), 'rows': Count('id'), 'id_sum': Sum('id')}
+
+
+def _list_result(request, version: int, page: dict):
+    etag = _etag(request.get_full_path(), version, page['rows'], page['id_sum'], page['last_modified'])
+    return etag, page['last_modified']
+
+
+def list_validators(model, ordering: str):
+    """
+    Validators of a paginated list endpoint, from the max updated_at, row count
+    and id sum of the page's rows plus the model's count version, so created or
+    deleted rows elsewhere still change data.count. Nested expansions are not
+    covered, so requests using ?expand= are left unconditional.
+    :param model:
+    :param ordering:
+    """
+    def validators(request, **kwargs):
+        if request.GET.get('expand'):
+            return None
+        queryset = page_queryset(request, model.objects.all(), ordering)
+        if queryset is None:
+            return None
+        page = queryset.aggregate(**_PAGE_AGGREGATES)
+        return _list_result(request, count_version(model), page)
+    return validators
+
+
+def alist_validators(model, ordering: str):
+    """
+    list_validators() for async views, through the async ORM
+    :param model:
+    :param ordering:
+    """
+    async def validators(request, **kwargs):
+        if request.GET.get('expand'):
+            return None
+        queryset = page_queryset(request, model.objects.all(), ordering)
+        if queryset is None:
+            return None
+        page = await queryset.aaggregate(**_PAGE_AGGREGATES)
+        return _list_result(request, await acount_version(model), page)
+    return validators
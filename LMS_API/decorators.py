@@ -0,0 +1,51 @@
+from functools import wraps
+
+from django.http import HttpResponse
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+def async_api_view(http_method_names: list):
+    """
+    Async counterpart of rest_framework.decorators.api_view for read-only views.
+    The request goes through the same parsing, content negotiation and exception
+    handler, so responses keep the envelope of the sync views. The response is
+    rendered inside the coroutine and handed back as a plain HttpResponse;
+    otherwise the ASGI handler would render it through a sync_to_async hop.
+    :param http_method_names: allowed methods, e.g. ['GET']
+    """
+    allowed_methods = [method.lower() for method in http_method_names]
+    if 'get' in allowed_methods and 'head' not in allowed_methods:
+        allowed_methods.append('head')
+
+    def decorator(func):
+        view_class = type(func.__name__, (APIView,), {'http_method_names': allowed_methods + ['options']})
+
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            api_view = view_class()
+            api_view.args, api_view.kwargs = args, kwargs
+            api_view.headers = api_view.default_response_headers
+            request = api_view.initialize_request(request, *args, **kwargs)
+            api_view.request = request
+            try:
+                api_view.initial(request, *args, **kwargs)
+                method = request.method.lower()
+                if method == 'options':
+                    response = api_view.options(request, *args, **kwargs)
+                elif method in allowed_methods:
+                    response = await func(request, *args, **kwargs)
+                else:
+                    raise MethodNotAllowed(request.method)
+            except Exception as exc:
+                response = api_view.handle_exception(exc)
+            response = api_view.finalize_response(request, response, *args, **kwargs)
+            if not isinstance(response, Response):
+                return response
+            response.render()
+            return HttpResponse(response.content, status=response.status_code, headers=dict(response.items()))
+
+        view.csrf_exempt = True
+        return view
+    return decorator
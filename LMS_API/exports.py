@@ -0,0 +1,91 @@
+import csv
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class Echo:
+    """
+    File-like object whose write() hands the written value back, so csv.writer
+    can be used to produce one encoded line at a time
+    """
+
+    def write(self, value):
+        return value
+
+
+def iterate_in_chunks(queryset, chunk_size: int = None):
+    """
+    Yield lists of rows from a values()/values_list() queryset by walking the
+    primary key (keyset batching), so memory stays flat at any table size on
+    every backend, including drivers that buffer whole result sets client-side.
+    :param queryset: values() queryset that includes 'id'
+    :param chunk_size: rows fetched per query
+    :return: generator of row lists
+    """
+    chunk_size = chunk_size or settings.LMS_EXPORT_CHUNK_SIZE
+    last_id = None
+    while True:
+        chunk_queryset = queryset.order_by('id')
+        if last_id is not None:
+            chunk_queryset = chunk_queryset.filter(id__gt=last_id)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]['id']
+
+
+_encoder = JSONEncoder()
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if hasattr(value, 'isoformat'):
+        return _encoder.default(value)
+    return value
+
+
+def csv_lines(fields: list, rows):
+    """
+    :param fields: column names, written as the header line
+    :param rows: iterable of dicts keyed by the column names
+    :return: generator of CSV lines
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[field]) for field in fields])
+
+
+def ndjson_lines(fields: list, rows):
+    """
+    :param fields: keys written for every row
+    :param rows: iterable of dicts keyed by the field names
+    :return: generator of NDJSON lines
+    """
+    for row in rows:
+        yield json.dumps({field: row[field] for field in fields}, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def streaming_export_response(output: str, filename: str, fields: list, rows) -> StreamingHttpResponse:
+    """
+    :param output: csv or ndjson
+    :param filename: download name without extension
+    :param fields: exported columns
+    :param rows: iterable of dicts, consumed lazily while the response is sent
+    :return:
+    """
+    if output == 'ndjson':
+        response = StreamingHttpResponse(ndjson_lines(fields, rows), content_type='application/x-ndjson')
+    else:
+        response = StreamingHttpResponse(csv_lines(fields, rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
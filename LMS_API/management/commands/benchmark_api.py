@@ -0,0 +1,291 @@
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from LMS_API import urls as api_urls
+from LMS_Core.models import Books, Authors, BookLending, Borrower
+
+
+def sample_ids(queryset, count: int, rng: random.Random) -> list:
+    """
+    Pick about `count` distinct ids spread over the table with one index seek
+    each, instead of ORDER BY RANDOM() over millions of rows
+    :param queryset:
+    :param count:
+    :param rng:
+    :return:
+    """
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    ids = set()
+    for _ in range(count):
+        pivot = rng.randint(bounds['low'], bounds['high'])
+        found = queryset.filter(id__gte=pivot).order_by('id').values_list('id', flat=True).first()
+        if found is not None:
+            ids.add(found)
+    return sorted(ids)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class RouteRequests:
+    """
+    Builds the next request for every route from ids sampled out of the
+    current data. Routes that consume what they touch (delete, borrow,
+    return) draw from pools and never get the same id twice.
+    """
+
+    def __init__(self, repeat: int, seed: int):
+        self.rng = random.Random(seed)
+        size = repeat + 2
+        self.book_ids = sample_ids(Books.objects.all(), size * 4, self.rng)
+        self.author_ids = sample_ids(Authors.objects.all(), size * 3, self.rng)
+        self.lend_ids = sample_ids(BookLending.objects.all(), size, self.rng)
+        self.borrower_ids = sample_ids(Borrower.objects.all(), size, self.rng)
+        self.available_book_ids = sample_ids(Books.objects.filter(available=True), size * 2, self.rng)
+        self.open_lend_ids = sample_ids(BookLending.objects.filter(book_returned=False), size * 2, self.rng)
+        if not (self.book_ids and self.author_ids and self.lend_ids):
+            raise CommandError('Seed the catalog first, e.g. manage.py seed_library')
+        self.counter = 0
+        self.books_to_delete = self.book_ids[len(self.book_ids) // 2:]
+        self.available_book_ids = sorted(set(self.available_book_ids) - set(self.books_to_delete))
+        self.authors_to_delete = self.author_ids[len(self.author_ids) // 2:]
+        self.mobiles = list(Borrower.objects.filter(id__in=self.borrower_ids).values_list('mobile', flat=True))
+        self.title_words = [title.split()[0] for title in Books.objects.filter(id__in=self.book_ids[:20]).values_list('title', flat=True)]
+        self._builders = self.builders()
+
+    def next_number(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    def pick(self, ids: list):
+        return self.rng.choice(ids[:len(ids) // 2] or ids)
+
+    @staticmethod
+    def take(pool: list):
+        if not pool:
+            raise LookupError('pool exhausted')
+        return pool.pop()
+
+    def ndjson(self, lines: list) -> str:
+        return '\n'.join(json.dumps(line) for line in lines) + '\n'
+
+    def builders(self) -> dict:
+        """
+        :return: {URL name: callable returning (method, path, body, content type) of its next request}
+        """
+        today = timezone.localdate()
+        page = lambda: self.rng.randint(1, 50)
+        since = lambda: (timezone.localtime() - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        number = self.next_number
+        return {
+            'api-books-create': lambda name: ('post', reverse(name), {'title': f'Benchmark Book {number()}', 'publication_date': '2020-01-01', 'available': True}, None),
+            'api-books-bulk-create': lambda name: ('post', reverse(name), self.ndjson([
+                {'title': f'Benchmark Bulk {number()}', 'publication_date': '2020-01-01', 'available': True} for _ in range(100)
+            ]), 'application/x-ndjson'),
+            'api-books-read': lambda name: ('get', reverse(name), {'count': 20, 'page': page()}, None),
+            'api-books-search': lambda name: ('get', reverse(name), {'q': self.rng.choice(self.title_words or ['book'])}, None),
+            'api-books-export': lambda name: ('get', reverse(name), {'updated_from': since()}, None),
+            'api-books-read-details': lambda name: ('get', reverse(name, args=[self.pick(self.book_ids)]), None, None),
+            'api-books-read-many': lambda name: ('get', reverse(name), {'ids': ','.join(map(str, self.rng.sample(self.book_ids, min(20, len(self.book_ids)))))}, None),
+            'api-books-update': lambda name: ('patch', reverse(name, args=[self.pick(self.book_ids)]), {'title': f'Renamed {number()}'}, None),
+            'api-books-delete': lambda name: ('delete', reverse(name, args=[self.take(self.books_to_delete)]), None, None),
+            'api-author-create': lambda name: ('post', reverse(name), {'name': f'Benchmark Author {number()}'}, None),
+            'api-author-bulk-create': lambda name: ('post', reverse(name), self.ndjson([
+                {'name': f'Benchmark Author {number()}'} for _ in range(100)
+            ]), 'application/x-ndjson'),
+            'api-author-read': lambda name: ('get', reverse(name), {'count': 20, 'page': page()}, None),
+            'api-author-export': lambda name: ('get', reverse(name), {'updated_from': since()}, None),
+            'api-author-read-details': lambda name: ('get', reverse(name, args=[self.pick(self.author_ids)]), None, None),
+            'api-author-read-many': lambda name: ('get', reverse(name), {'ids': ','.join(map(str, self.rng.sample(self.author_ids, min(20, len(self.author_ids)))))}, None),
+            'api-author-update': lambda name: ('patch', reverse(name, args=[self.pick(self.author_ids)]), {'name': f'Renamed {number()}'}, None),
+            'api-author-delete': lambda name: ('delete', reverse(name, args=[self.take(self.authors_to_delete)]), None, None),
+            'api-author-book-add': lambda name: ('post', reverse(name), {'author_id': self.pick(self.author_ids), 'book_id': self.pick(self.book_ids)}, None),
+            'api-author-book-remove': lambda name: ('post', reverse(name), {'author_id': self.pick(self.author_ids), 'book_id': self.pick(self.book_ids)}, None),
+            'api-book-borrow': lambda name: ('post', reverse(name), {
+                'book_ids': [self.take(self.available_book_ids)],
+                'borrower': {'name': 'Benchmark Borrower', 'mobile': f'09{number():09d}'},
+                'borrow_date': str(today),
+                'due_date': str(today + timedelta(days=14)),
+            }, None),
+            'api-book-borrow-history': lambda name: ('get', reverse(name), {'count': 20, 'page': page()}, None),
+            'api-book-borrow-overdue': lambda name: ('get', reverse(name), {'count': 20}, None),
+            'api-book-borrow-export': lambda name: ('get', reverse(name), {'borrow_date_from': str(today)}, None),
+            'api-book-borrow-history-details': lambda name: ('get', reverse(name, args=[self.pick(self.lend_ids)]), None, None),
+            'api-book-return': lambda name: ('post', reverse(name), {'lend_id': self.take(self.open_lend_ids), 'return_date': str(today)}, None),
+            'api-borrower-loans-by-mobile': lambda name: ('get', reverse(name), {'mobile': self.rng.choice(self.mobiles or ['01700000000'])}, None),
+            'api-borrower-loans': lambda name: ('get', reverse(name, args=[self.rng.choice(self.borrower_ids or [0])]), None, None),
+        }
+
+    def covers(self, name: str) -> bool:
+        return name in self._builders
+
+    def build(self, name: str):
+        """
+        :param name: URL name
+        :return: (method, path, body, content type) of the next request
+        :raise LookupError: when a consuming route has used up its pool
+        """
+        return self._builders[name](name)
+
+
+def send(client: Client, method: str, path: str, body, content_type):
+    """
+    :return: status code, after the whole (possibly streamed) body has been read
+    """
+    if method == 'get':
+        response = client.get(path, body or {})
+    elif content_type:
+        response = getattr(client, method)(path, body, content_type=content_type)
+    else:
+        response = getattr(client, method)(path, json.dumps(body) if body is not None else '', content_type='application/json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response.status_code
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every route of LMS_API.urls on the current data: latency percentiles, '
+        'queries and peak Python memory per endpoint, as JSON. Writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per route')
+        parser.add_argument('--routes', help='Comma separated URL names to run, default all')
+        parser.add_argument('--seed', type=int, default=7, help='Random seed for the sampled ids')
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+        parser.add_argument('--compare', help='Earlier result file to print p50/p95 changes against')
+        parser.add_argument('--cache', action='store_true', help='Keep the configured cache instead of disabling it')
+
+    def measure(self, client: Client, requests: RouteRequests, name: str, repeat: int) -> dict:
+        if not requests.covers(name):
+            return {'skipped': 'no request defined for this route'}
+        statuses = Counter()
+        queries, peak_memory = None, None
+        try:
+            request = requests.build(name)
+        except LookupError:
+            request = None
+        if request is not None:
+            # Queries and peak memory come from an untimed first request, which also
+            # warms up the route; capturing them would skew the timings
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as captured:
+                statuses[send(client, *request)] += 1
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            queries = len(captured.captured_queries)
+
+        timings = []
+        for _ in range(repeat):
+            try:
+                request = requests.build(name)
+            except LookupError:
+                break
+            started = time.perf_counter()
+            statuses[send(client, *request)] += 1
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'p50_ms': round(percentile(timings, 0.50), 2) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95), 2) if timings else None,
+            'p99_ms': round(percentile(timings, 0.99), 2) if timings else None,
+            'max_ms': round(timings[-1], 2) if timings else None,
+            'queries': queries,
+            'peak_memory_kib': round(peak_memory / 1024, 1) if peak_memory is not None else None,
+        }
+
+    def compare(self, path: str, results: dict):
+        with open(path) as previous_file:
+            previous = json.load(previous_file)['routes']
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Compared with {path}'))
+        for name, result in results.items():
+            before = previous.get(name, {})
+            for metric in ('p50_ms', 'p95_ms', 'queries'):
+                old, new = before.get(metric), result.get(metric)
+                if old and new is not None and old != new:
+                    self.stdout.write(f'  {name:<34} {metric:<8} {old:>10} -> {new:<10} ({(new - old) / old:+.0%})')
+
+    def handle(self, *args, **options):
+        names = [pattern.name for pattern in api_urls.urlpatterns]
+        if options['routes']:
+            wanted = options['routes'].split(',')
+            unknown = set(wanted) - set(names)
+            if unknown:
+                raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}')
+            names = [name for name in names if name in wanted]
+
+        overrides = {'DEBUG': False}
+        if not options['cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        results = {}
+        with override_settings(**overrides):
+            requests = RouteRequests(options['repeat'], options['seed'])
+            client = Client(HTTP_HOST='127.0.0.1')
+            # Everything the write routes change is rolled back, so runs can be repeated on the same data
+            with transaction.atomic():
+                for name in names:
+                    results[name] = self.measure(client, requests, name, options['repeat'])
+                    result = results[name]
+                    if 'skipped' in result:
+                        self.stdout.write(self.style.WARNING(f'{name:<34} skipped: {result["skipped"]}'))
+                        continue
+                    self.stdout.write(
+                        f'{name:<34} p50 {str(result["p50_ms"]):>9} ms  p95 {str(result["p95_ms"]):>9} ms  '
+                        f'p99 {str(result["p99_ms"]):>9} ms  {result["queries"]} queries  '
+                        f'{result["peak_memory_kib"]} KiB  {result["statuses"]}'
+                    )
+                transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+                'rows': {
+                    'books': Books.objects.count(),
+                    'authors': Authors.objects.count(),
+                    'lendings': BookLending.objects.count(),
+                    'borrowers': Borrower.objects.count(),
+                },
+                'finished_at': timezone.now().isoformat(),
+            },
+            'routes': results,
+        }
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        if options['compare']:
+            self.compare(options['compare'], results)
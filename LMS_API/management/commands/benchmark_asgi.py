@@ -0,0 +1,195 @@
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+
+from LMS_Core.models import Books, Authors, BookLending
+from LMS_Core.seeding import seed_library
+
+# (label, server, LMS_ASYNC_READ_VIEWS) of the deployments compared
+SETUPS = [
+    ('WSGI, sync views', 'wsgi', 'False'),
+    ('ASGI, sync views', 'asgi', 'False'),
+    ('ASGI, async views', 'asgi', 'True'),
+]
+
+
+def request_paths(count: int, seed: int = 7) -> list:
+    """
+    :param count: number of requests
+    :param seed:
+    :return: [(path, query string), ...] spread over the six read endpoints
+    """
+    rng = random.Random(seed)
+    book_ids = list(Books.objects.values_list('id', flat=True)[:1000])
+    author_ids = list(Authors.objects.values_list('id', flat=True)[:1000])
+    lend_ids = list(BookLending.objects.values_list('id', flat=True)[:1000])
+    if not (book_ids and author_ids and lend_ids):
+        raise CommandError('Seed some books, authors and lendings first (--books/--authors/--lendings)')
+    choices = [
+        lambda: ('/api/v1/book/read', f'count=20&page={rng.randint(1, 20)}'),
+        lambda: ('/api/v1/author/read', f'count=20&page={rng.randint(1, 20)}'),
+        lambda: ('/api/v1/borrow-book/history', f'count=20&page={rng.randint(1, 20)}&expand=books'),
+        lambda: (f'/api/v1/book/read/{rng.choice(book_ids)}', ''),
+        lambda: (f'/api/v1/author/read/{rng.choice(author_ids)}', ''),
+        lambda: (f'/api/v1/borrow-book/history/{rng.choice(lend_ids)}', ''),
+    ]
+    return [rng.choice(choices)() for _ in range(count)]
+
+
+def wsgi_get(application, path: str, query_string: str) -> int:
+    status = []
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query_string,
+        'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    result = application(environ, lambda status_line, headers, exc_info=None: status.append(int(status_line[:3])))
+    try:
+        b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
+
+
+async def asgi_get(application, path: str, query_string: str) -> int:
+    status = []
+    finished = asyncio.Event()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'127.0.0.1')], 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+    }
+    messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+    async def receive():
+        message = next(messages, None)
+        if message is None:
+            # The client stays connected until the whole response has been sent
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+        return message
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def run_wsgi(paths: list, concurrency: int) -> list:
+    """
+    :return: [(status, seconds), ...] of the requests, served by `concurrency` threads like a threaded WSGI server
+    """
+    application = get_wsgi_application()
+
+    def timed(path_query):
+        started = time.perf_counter()
+        return wsgi_get(application, *path_query), time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, paths))
+
+
+def run_asgi(paths: list, concurrency: int) -> list:
+    """
+    :return: [(status, seconds), ...] of the requests, `concurrency` of them in flight on one event loop
+    """
+    application = get_asgi_application()
+
+    async def main():
+        pending = iter(paths)
+        results = []
+
+        async def client():
+            for path_query in pending:
+                started = time.perf_counter()
+                status = await asgi_get(application, *path_query)
+                results.append((status, time.perf_counter() - started))
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return results
+
+    return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent throughput of the read endpoints under ASGI (sync and async views) and WSGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=0, help='Seed this many books first')
+        parser.add_argument('--authors', type=int, default=0, help='Seed this many authors first')
+        parser.add_argument('--lendings', type=int, default=0, help='Seed this many lendings first')
+        parser.add_argument('--requests', type=int, default=600, help='Requests per concurrency level')
+        parser.add_argument('--concurrency', default='1,8,32', help='Comma separated numbers of concurrent clients')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], help='Internal: measure one server in this process')
+
+    def measure(self, server: str, requests: int, levels: list) -> list:
+        paths = request_paths(requests)
+        run = run_wsgi if server == 'wsgi' else run_asgi
+        # Measure the database-backed path, not the response cache or DEBUG's query log
+        with override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            run(paths[:20], 1)
+            results = []
+            for concurrency in levels:
+                started = time.perf_counter()
+                responses = run(paths, concurrency)
+                elapsed = time.perf_counter() - started
+                latencies = sorted(seconds * 1000 for _, seconds in responses)
+                errors = sum(1 for status, _ in responses if status >= 500)
+                results.append({
+                    'concurrency': concurrency,
+                    'requests_per_second': round(len(responses) / elapsed, 1),
+                    'p50_ms': round(latencies[len(latencies) // 2], 2),
+                    'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+                    'errors': errors,
+                })
+        return results
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        if options['server']:
+            self.stdout.write(json.dumps(self.measure(options['server'], options['requests'], levels)))
+            return
+
+        if options['books'] or options['authors'] or options['lendings']:
+            created = seed_library(options['books'], options['authors'], options['lendings'])
+            self.stdout.write(f'Seeded {created}')
+
+        # Each setup runs in its own process, since the URLconf picks the views at import time
+        report = []
+        for label, server, async_views in SETUPS:
+            command = [
+                sys.executable, sys.argv[0], 'benchmark_asgi', '--server', server,
+                '--requests', str(options['requests']), '--concurrency', options['concurrency'],
+            ]
+            output = subprocess.run(
+                command, env={**os.environ, 'LMS_ASYNC_READ_VIEWS': async_views},
+                capture_output=True, text=True, check=True
+            ).stdout
+            results = json.loads(output.strip().splitlines()[-1])
+            report.append({'setup': label, 'results': results})
+            for result in results:
+                self.stdout.write(
+                    f'{label:<18} c={result["concurrency"]:<4} {result["requests_per_second"]:>8} req/s  '
+                    f'p50 {result["p50_ms"]:>8} ms  p99 {result["p99_ms"]:>8} ms  errors {result["errors"]}'
+                )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(report, output, indent=2)
@@ -0,0 +1,196 @@
+import json
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from LMS_Core.models import Books, Authors, BookLending, Borrower
+from LMS_Core.seeding import analyze_tables, seed_library
+
+INDEXED_MODELS = (Books, Authors, Borrower, BookLending)
+
+
+def _explain(sql: str) -> list:
+    """
+    :param sql: SELECT statement as executed
+    :return: lines of the database's query plan
+    """
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        return [row[-1] for row in rows]
+    return [' | '.join('' if value is None else str(value) for value in row) for row in rows]
+
+
+def _without_indexes(sql: str):
+    """
+    The same statement, with the planner told to leave the declared indexes
+    alone: NO_INDEX optimizer hints on MySQL (8.0.20+), NOT INDEXED on the
+    indexed tables on SQLite, which also passes over their other indexes but
+    not primary key lookups. PostgreSQL has no per-index hint; there the index
+    scans are turned off for the transaction instead (see _planner_without_indexes()).
+    :param sql: SELECT statement as executed
+    :return: the rewritten statement, or None where indexes can not be left out
+    """
+    indexes = {model._meta.db_table: [index.name for index in model._meta.indexes] for model in INDEXED_MODELS}
+    if connection.vendor == 'mysql':
+        hints = ' '.join(f'NO_INDEX(`{table}` {", ".join(names)})' for table, names in indexes.items() if names)
+        return re.sub(r'^\s*SELECT\b', f'SELECT /*+ {hints} */', sql, count=1, flags=re.IGNORECASE)
+    if connection.vendor == 'sqlite':
+        tables = '|'.join(re.escape(table) for table in indexes)
+        return re.sub(rf'((?:FROM|JOIN) "(?:{tables})"(?: [A-Z]\d+)?)', r'\1 NOT INDEXED', sql)
+    if connection.vendor == 'postgresql':
+        return sql
+    return None
+
+
+def _planner_without_indexes():
+    """
+    Settings of the current transaction keeping PostgreSQL's planner off index scans
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for setting in ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan'):
+                cursor.execute(f'SET LOCAL {setting} = off')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure query plans and latencies of the list and lookup endpoints; their SQL is also run with the '
+        'model indexes left out through planner hints, which never drops an index'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=0, help='Seed this many books first')
+        parser.add_argument('--authors', type=int, default=0, help='Seed this many authors first')
+        parser.add_argument('--lendings', type=int, default=0, help='Seed this many lendings first')
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per endpoint')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def endpoints(self) -> list:
+        """
+        :return: [(label, url), ...] of the requests to measure, sized to the data present
+        """
+        count = 20
+        deep_page = max(1, Books.objects.count() // count // 2)
+        since = timezone.localtime().strftime('%Y-%m-%dT%H:%M:%S')
+        endpoints = [
+            ('books, first page', f'/api/v1/book/read?count={count}'),
+            ('books, deep page', f'/api/v1/book/read?count={count}&page={deep_page}'),
+            ('books, cursor page', f'/api/v1/book/read?count={count}&pagination=cursor'),
+            ('authors, first page', f'/api/v1/author/read?count={count}'),
+            ('lending history, first page', f'/api/v1/borrow-book/history?count={count}'),
+            ('overdue report', f'/api/v1/borrow-book/overdue?count={count}'),
+            ('books export, incremental sync', f'/api/v1/book/export?updated_from={since}'),
+        ]
+        borrower = Borrower.objects.order_by('id').first()
+        if borrower is not None:
+            endpoints.append(('borrower open loans', f'/api/v1/borrower/loans?mobile={borrower.mobile}&open=true'))
+        return endpoints
+
+    def measure(self, client: Client, url: str, repeat: int) -> dict:
+        """
+        :return: median and p95 latency in ms, query count and the SELECTs of one request
+        """
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        timings.sort()
+        return {
+            'median_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+            'queries': len(queries.captured_queries),
+            'selects': [
+                query['sql'] for query in queries.captured_queries if query['sql'].lstrip().upper().startswith('SELECT')
+            ],
+        }
+
+    @staticmethod
+    def measure_sql(selects: list, repeat: int, without_indexes: bool) -> dict:
+        """
+        Run the SELECTs of a request again, as they are or with the declared indexes
+        left out by planner hints; nothing is dropped, so this is safe on a live database
+        :return: median and p95 of their summed run time in ms, and their plans
+        """
+        if without_indexes:
+            selects = [_without_indexes(sql) for sql in selects]
+            if None in selects:
+                return None
+        timings = []
+        with transaction.atomic():
+            if without_indexes:
+                _planner_without_indexes()
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    for sql in selects:
+                        cursor.execute(sql)
+                        cursor.fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            plans = [{'sql': sql, 'plan': _explain(sql)} for sql in selects]
+        timings.sort()
+        return {
+            'sql_median_ms': round(statistics.median(timings), 2),
+            'sql_p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+            'plans': plans,
+        }
+
+    def measure_all(self, repeat: int) -> tuple:
+        """
+        :return: ({label: run}, {label: run}) without and with the declared indexes
+        """
+        client = Client(HTTP_HOST='127.0.0.1')
+        before, after = {}, {}
+        for label, url in self.endpoints():
+            request = self.measure(client, url, repeat)
+            selects = request.pop('selects')
+            after[label] = {**request, **self.measure_sql(selects, repeat, without_indexes=False)}
+            without = self.measure_sql(selects, repeat, without_indexes=True)
+            if without is not None:
+                before[label] = without
+        return before, after
+
+    def handle(self, *args, **options):
+        if options['books'] or options['authors'] or options['lendings']:
+            created = seed_library(
+                options['books'], options['authors'], options['lendings'], log=lambda message: self.stdout.write(message)
+            )
+            self.stdout.write(f'Seeded {created}')
+            analyze_tables()
+
+        # Measure the database, not the response cache
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            before, after = self.measure_all(options['repeat'])
+        if not before:
+            self.stdout.write(self.style.WARNING(f'{connection.vendor} can not leave indexes out; measuring the current indexes only'))
+
+        for label, result in after.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(f'  request: median {result["median_ms"]} ms, p95 {result["p95_ms"]} ms, {result["queries"]} queries')
+            for name, run in (('without indexes', before.get(label)), ('with indexes', result)):
+                if run is None:
+                    continue
+                self.stdout.write(f'  SQL {name}: median {run["sql_median_ms"]} ms, p95 {run["sql_p95_ms"]} ms')
+                for query in run['plans']:
+                    for line in query['plan']:
+                        self.stdout.write(f'    {line}')
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump({'vendor': connection.vendor, 'before': before, 'after': after}, output, indent=2)
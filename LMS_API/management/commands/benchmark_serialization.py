@@ -0,0 +1,95 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from LMS_Core.models import Books, Authors, BookLending
+
+ENDPOINTS = [
+    ('api-books-read', Books),
+    ('api-author-read', Authors),
+    ('api-book-borrow-history', BookLending),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the list endpoints with and without LMS_FAST_SERIALIZATION: latency, rows/s, '
+        'and whether both paths return the same bytes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Rows per page')
+        parser.add_argument('--pages', type=int, default=20, help='Distinct pages requested per endpoint')
+        parser.add_argument('--repeat', type=int, default=3, help='Times every page is requested per path')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', default=None, help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        client = Client(SERVER_NAME='localhost')
+        results = []
+        with override_settings(ALLOWED_HOSTS=['localhost'], LMS_PAGINATION_MAX_COUNT=max(options['count'], 500)):
+            for url_name, model in ENDPOINTS:
+                last_page = max(1, min(model.objects.count() // options['count'], 1000))
+                pages = [rng.randint(1, last_page) for _ in range(options['pages'])]
+                if not model.objects.exists():
+                    raise CommandError('Seed the catalog first, e.g. manage.py seed_library')
+                results.append(self.compare(client, url_name, pages, options))
+
+        self.stdout.write(
+            f'{"endpoint":<26} {"path":<10} {"p50 ms":>8} {"mean ms":>8} {"rows/s":>9}  same bytes'
+        )
+        for result in results:
+            for path in ('serializer', 'fast'):
+                figures = result[path]
+                self.stdout.write(
+                    f'{result["url_name"]:<26} {path:<10} {figures["p50_ms"]:8.2f} {figures["mean_ms"]:8.2f} '
+                    f'{figures["rows_per_second"]:9.0f}  {result["identical"] if path == "fast" else ""}'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{result["url_name"]:<26} {"speedup":<10} {result["speedup"]:8.2f}x'
+            ))
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump({'count': options['count'], 'results': results}, output, indent=2)
+        if not all(result['identical'] for result in results):
+            raise CommandError('The fast path returned different bytes')
+
+    def compare(self, client, url_name: str, pages: list, options) -> dict:
+        """
+        :return: figures of both paths over the same pages, interleaved so that caches and
+            background load treat them alike
+        """
+        path = reverse(url_name)
+        timings = {'serializer': [], 'fast': []}
+        rows = 0
+        identical = True
+        for page in pages:
+            params = {'page': page, 'count': options['count'], 'count_mode': 'cached'}
+            bodies = {}
+            for _ in range(options['repeat']):
+                for name, fast in (('serializer', False), ('fast', True)):
+                    with override_settings(LMS_FAST_SERIALIZATION=fast):
+                        started = time.perf_counter()
+                        response = client.get(path, params)
+                        timings[name].append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url_name} answered {response.status_code}')
+                    bodies[name] = response.content
+            identical = identical and bodies['serializer'] == bodies['fast']
+            rows += len(json.loads(bodies['fast'])['data']['results']) * options['repeat']
+
+        result = {'url_name': url_name, 'identical': identical}
+        for name, seconds in timings.items():
+            result[name] = {
+                'p50_ms': statistics.median(seconds) * 1000,
+                'mean_ms': statistics.mean(seconds) * 1000,
+                'rows_per_second': rows / sum(seconds),
+            }
+        result['speedup'] = result['fast']['rows_per_second'] / result['serializer']['rows_per_second']
+        return result
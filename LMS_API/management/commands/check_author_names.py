@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from LMS_API.signals import registrations_changed
+from LMS_Core.models import Books
+
+# Stale book IDs listed in the output at most
+MAX_LISTED = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare author_names of every book with its author registrations, batch by batch; '
+        'exits with an error on a mismatch unless --fix repairs it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Books compared per batch')
+        parser.add_argument('--fix', action='store_true', help='Recompute author_names of the mismatched books')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        checked, stale = 0, []
+        last_id = 0
+        while True:
+            batch = list(
+                Books.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'author_names')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            checked += len(batch)
+
+            registered = Books.objects.filter(id__in=[book_id for book_id, _ in batch]).registered_author_names()
+            batch_stale = [book_id for book_id, names in batch if names != registered.get(book_id, [])]
+            if batch_stale and options['fix']:
+                # Also moves updated_at and evicts the cached details, as a registration change would
+                registrations_changed([], batch_stale)
+            stale += batch_stale
+
+        summary = f'{checked} books checked, {len(stale)} with stale author names'
+        if stale:
+            listed = ', '.join(map(str, stale[:MAX_LISTED])) + (', ...' if len(stale) > MAX_LISTED else '')
+            summary += f': {listed}'
+        if stale and not options['fix']:
+            raise CommandError(f'{summary}; run with --fix to repair them')
+        self.stdout.write(self.style.SUCCESS(f'{summary}{", fixed" if stale else ""}'))
@@ -0,0 +1,83 @@
+import json
+import pstats
+import sysconfig
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from LMS_API.profiling import PROFILE_HEADER, category_of, profile_token
+
+
+def short_location(function_key: tuple) -> str:
+    """
+    :param function_key: pstats (filename, line, function name) key
+    :return: the function with its path cut after site-packages, the standard library or the project directory
+    """
+    filename, line, function_name = function_key
+    if filename == '~':
+        return function_name
+    for marker in ('site-packages/', f'{sysconfig.get_paths()["stdlib"]}/', f'{settings.BASE_DIR}/'):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    return f'{filename}:{line}({function_name})'
+
+
+class Command(BaseCommand):
+    help = 'Merge the request profiles of every process and show where the time of each route goes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Profile directory; defaults to LMS_PROFILE_DIR')
+        parser.add_argument('--url-name', action='append', default=[], help='Only this route; may be repeated')
+        parser.add_argument('--top', type=int, default=15, help='Functions listed per route')
+        parser.add_argument('--sort', choices=['tottime', 'cumulative'], default='tottime')
+        parser.add_argument('--token', action='store_true', help=f'Print a signed {PROFILE_HEADER} header and exit')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(f'{PROFILE_HEADER}: {profile_token()}')
+            return
+
+        directory = Path(options['dir'] or settings.LMS_PROFILE_DIR)
+        routes = sorted(path for path in directory.glob('*') if path.is_dir()) if directory.is_dir() else []
+        if options['url_name']:
+            routes = [route for route in routes if route.name in options['url_name']]
+        if not routes:
+            raise CommandError(f'No profiles under {directory}')
+
+        for route in routes:
+            files = sorted(route.glob('*.prof'))
+            if not files:
+                continue
+            stats = pstats.Stats(*map(str, files))
+            requests = sum(
+                json.loads(path.with_suffix('.json').read_text())['requests']
+                for path in files if path.with_suffix('.json').exists()
+            )
+            self.report(route.name, stats, requests, len(files), options)
+
+    def report(self, url_name: str, stats: pstats.Stats, requests: int, processes: int, options):
+        per_request = max(requests, 1)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{url_name}: {requests} requests from {processes} processes, '
+            f'{stats.total_tt / per_request * 1000:.2f} ms profiled per request'
+        ))
+
+        categories = {}
+        for function_key, (_, _, tottime, _, _) in stats.stats.items():
+            category = category_of(function_key)
+            categories[category] = categories.get(category, 0.0) + tottime
+        for category, seconds in sorted(categories.items(), key=lambda item: -item[1]):
+            share = seconds / stats.total_tt * 100 if stats.total_tt else 0.0
+            self.stdout.write(f'  {category:<34} {seconds / per_request * 1000:9.2f} ms {share:5.1f}%')
+
+        column = 2 if options['sort'] == 'tottime' else 3
+        top = sorted(stats.stats.items(), key=lambda item: -item[1][column])[:options['top']]
+        self.stdout.write(f'  {"calls":>10} {"tottime ms":>11} {"cumtime ms":>11}  function')
+        for function_key, (_, calls, tottime, cumtime, _) in top:
+            self.stdout.write(
+                f'  {calls / per_request:10.1f} {tottime / per_request * 1000:11.3f} '
+                f'{cumtime / per_request * 1000:11.3f}  {short_location(function_key)}'
+            )
+        self.stdout.write('')
@@ -0,0 +1,95 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from LMS_Core import jobs
+
+logger = logging.getLogger('lms')
+
+# Seconds between two rounds of queueing the due periodic jobs and taking back stale ones
+HOUSEKEEPING_INTERVAL = 15
+
+
+def run_job(job) -> bool:
+    """
+    Run a job in a pool thread, whose database connection is looked after like a request's
+    """
+    close_old_connections()
+    try:
+        return jobs.run(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the queued background jobs and the periodic schedules of LMS_PERIODIC_JOBS; start as many '
+        'workers as needed, they never take the same job'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help='Jobs run at once; defaults to LMS_JOB_CONCURRENCY')
+        parser.add_argument('--name', default=None, help='Worker name recorded on its jobs; defaults to host-pid')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due, instead of waiting for more')
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'] or settings.LMS_JOB_CONCURRENCY, 1)
+        worker = options['name'] or f'{socket.gethostname()}-{os.getpid()}'
+        autodiscover_modules('tasks')
+
+        stopping = threading.Event()
+        previous_handlers = {
+            signum: signal.signal(signum, lambda *args: stopping.set()) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        outcomes = {True: 0, False: 0}
+        try:
+            jobs.sync_schedules()
+            self.stdout.write(f'{worker}: running up to {concurrency} jobs at once')
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='lms-job') as pool:
+                self.work(worker, pool, concurrency, stopping, outcomes, options['burst'])
+                # Leaving the pool waits for the running jobs, also after SIGTERM
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'{worker}: {outcomes[True]} jobs succeeded, {outcomes[False]} failed'))
+
+    def work(self, worker: str, pool: ThreadPoolExecutor, concurrency: int, stopping: threading.Event,
+             outcomes: dict, burst: bool):
+        running = set()
+        last_housekeeping = None
+        while not stopping.is_set():
+            close_old_connections()
+            if last_housekeeping is None or time.monotonic() - last_housekeeping >= HOUSEKEEPING_INTERVAL:
+                jobs.requeue_stale()
+                jobs.enqueue_due_schedules()
+                last_housekeeping = time.monotonic()
+
+            claimed = jobs.claim(worker, concurrency - len(running)) if len(running) < concurrency else []
+            running |= {pool.submit(run_job, job) for job in claimed}
+            if not running:
+                if burst:
+                    return
+                stopping.wait(settings.LMS_JOB_POLL_INTERVAL)
+                continue
+            # Free threads mean the queue had no more due jobs; look again after a poll interval at most
+            finished, running = wait(running, timeout=settings.LMS_JOB_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            self.count(finished, outcomes)
+        self.count(wait(running).done, outcomes)
+
+    @staticmethod
+    def count(finished, outcomes: dict):
+        for future in finished:
+            try:
+                outcomes[future.result()] += 1
+            except Exception:
+                logger.exception('Recording the outcome of a job failed')
+                outcomes[False] += 1
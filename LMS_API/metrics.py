@@ -0,0 +1,310 @@
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REGISTRY = []
+
+# Every thread records into its own dict, so recording takes no lock; the
+# scrape sums the dicts of all threads. The dict of a thread that exited is
+# folded into _retired, so threads coming and going do not pile up dicts.
+_local = threading.local()
+_shards = []
+_retired = {}
+_exited = deque()
+_shards_lock = threading.Lock()
+_write_lock = threading.Lock()
+_last_write = 0.0
+_process_name = None
+
+
+class _ThreadExit:
+    """
+    Kept in the thread-local storage next to the thread's dict; it is released
+    when the thread exits, and its finalizer queues the dict for folding. The
+    finalizer takes no lock, as it runs in whatever thread drops the storage.
+    """
+    __slots__ = ('__weakref__',)
+
+
+def _shard() -> dict:
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        _local.exit = _ThreadExit()
+        weakref.finalize(_local.exit, _exited.append, shard)
+        with _shards_lock:
+            _fold_exited()
+            _shards.append(shard)
+        return shard
+
+
+def _fold_exited():
+    """
+    Move the dicts of the exited threads into _retired; called holding _shards_lock
+    """
+    while _exited:
+        shard = _exited.popleft()
+        for index, live in enumerate(_shards):
+            if live is shard:
+                del _shards[index]
+                _merge(_retired, shard)
+                break
+
+
+def _reset_after_fork():
+    """
+    A forked worker starts from zero under its own file, instead of reporting
+    the figures it inherited from its parent a second time
+    """
+    global _local, _shards, _retired, _exited, _shards_lock, _write_lock, _last_write, _process_name
+    _local = threading.local()
+    _shards = []
+    _retired = {}
+    _exited = deque()
+    _shards_lock = threading.Lock()
+    _write_lock = threading.Lock()
+    _last_write = 0.0
+    _process_name = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        """
+        :param labels: label values, in the order of labelnames
+        :param amount:
+        """
+        shard = _shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, labels: tuple, value):
+        yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        """
+        :param value:
+        :param labels: label values, in the order of labelnames
+        """
+        shard = _shard()
+        key = (self.name, labels)
+        # One count per bucket, the +Inf bucket last, then the sum of the observations
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self, labels: tuple, value):
+        label_values = dict(zip(self.labelnames, labels))
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            yield f'{self.name}_bucket', {**label_values, 'le': le}, cumulative
+        yield f'{self.name}_sum', label_values, value[-1]
+        yield f'{self.name}_count', label_values, cumulative
+
+
+REQUESTS = Counter(
+    'lms_http_requests_total', 'HTTP requests served', ('url_name', 'method', 'status')
+)
+REQUEST_ERRORS = Counter(
+    'lms_http_request_errors_total', 'HTTP requests answered with a 4xx or 5xx status', ('url_name', 'method', 'status')
+)
+REQUEST_DURATION = Histogram(
+    'lms_http_request_duration_seconds', 'Time to serve a request, up to the first byte of streamed responses',
+    ('url_name', 'method'), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+RESPONSE_SIZE = Histogram(
+    'lms_http_response_size_bytes', 'Size of the response bodies; streamed responses are not measured',
+    ('url_name',), buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+DB_QUERIES = Counter('lms_db_queries_total', 'SQL queries run while serving requests', ('url_name',))
+DB_QUERY_DURATION = Counter(
+    'lms_db_query_duration_seconds_total', 'Time spent in SQL queries while serving requests', ('url_name',)
+)
+LOANS_OPENED = Counter('lms_loans_opened_total', 'Lendings created by borrow-book')
+BOOKS_BORROWED = Counter('lms_books_borrowed_total', 'Books lent out by borrow-book')
+BORROW_CONFLICTS = Counter('lms_borrow_conflicts_total', 'Borrow requests refused because a book had no copy left on the shelf')
+LOANS_RETURNED = Counter('lms_loans_returned_total', 'Lendings closed by return-book')
+BOOKS_RETURNED = Counter('lms_books_returned_total', 'Book copies put back on the shelf by return-book')
+
+_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def record_request(request, response, timings):
+    """
+    Count a served request; the route's URL name rather than its path keeps the number of series bounded
+    :param request:
+    :param response:
+    :param timings: RequestTimings of the request
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = (resolver_match.url_name if resolver_match else None) or 'unmatched'
+    method = request.method if request.method in _METHODS else 'other'
+    status = str(response.status_code)
+
+    REQUESTS.inc(url_name, method, status)
+    if response.status_code >= 400:
+        REQUEST_ERRORS.inc(url_name, method, status)
+    REQUEST_DURATION.observe(time.perf_counter() - timings.started, url_name, method)
+    if not response.streaming:
+        RESPONSE_SIZE.observe(len(response.content), url_name)
+    if timings.query_count:
+        DB_QUERIES.inc(url_name, amount=timings.query_count)
+        DB_QUERY_DURATION.inc(url_name, amount=timings.sql_seconds)
+    write_process_file(force=False)
+
+
+def _merge(into: dict, values: dict):
+    for key, value in values.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            into[key] = [mine + theirs for mine, theirs in zip(current, value)]
+        else:
+            into[key] = current + value
+
+
+def snapshot() -> dict:
+    """
+    :return: this process's figures, {(metric name, label values): value}
+    """
+    merged = {}
+    with _shards_lock:
+        _fold_exited()
+        shards = list(_shards)
+        _merge(merged, _retired)
+    for shard in shards:
+        _merge(merged, shard.copy())
+    return merged
+
+
+def process_file():
+    """
+    :return: the file this process shares its figures through, or None without LMS_METRICS_DIR
+    """
+    global _process_name
+    if not settings.LMS_METRICS_DIR:
+        return None
+    if _process_name is None:
+        # The start time tells apart two processes that got the same pid
+        _process_name = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}.json'
+    return Path(settings.LMS_METRICS_DIR) / _process_name
+
+
+def write_process_file(force: bool = True):
+    """
+    Replace this process's file with its current figures
+    :param force: write even if the last write is less than LMS_METRICS_WRITE_INTERVAL seconds old
+    """
+    global _last_write
+    path = process_file()
+    if path is None:
+        return
+    if not force and time.monotonic() - _last_write < settings.LMS_METRICS_WRITE_INTERVAL:
+        return
+    if not _write_lock.acquire(blocking=force):
+        return
+    try:
+        _last_write = time.monotonic()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps([[name, list(labels), value] for (name, labels), value in snapshot().items()]))
+        os.replace(temporary, path)
+    finally:
+        _write_lock.release()
+
+
+def collect() -> dict:
+    """
+    :return: the figures of every worker, this one live and the others from their files in LMS_METRICS_DIR
+    """
+    merged = snapshot()
+    own_file = process_file()
+    if own_file is None:
+        return merged
+    for path in own_file.parent.glob('*.json'):
+        if path == own_file:
+            continue
+        try:
+            rows = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        _merge(merged, {(name, tuple(labels)): value for name, labels, value in rows})
+    return merged
+
+
+def scrape_allowed(request) -> bool:
+    """
+    :param request:
+    :return: whether the client may read /metrics: its address is in LMS_METRICS_ALLOWED_IPS,
+        or it sent the LMS_METRICS_TOKEN bearer token
+    """
+    token = settings.LMS_METRICS_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(allowed, strict=False) for allowed in settings.LMS_METRICS_ALLOWED_IPS)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def exposition(values: dict) -> str:
+    """
+    :param values: figures as returned by collect()
+    :return: the Prometheus text format of every registered metric
+    """
+    by_metric = {}
+    for (name, labels), value in values.items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for labels, value in sorted(by_metric.get(metric.name, [])):
+            for name, label_values, sample in metric.samples(labels, value):
+                rendered = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in label_values.items())
+                lines.append(f'{name}{{{rendered}}} {sample}' if rendered else f'{name} {sample}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,313 @@
+import atexit
+import contextvars
+import cProfile
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .profiling import ProfileStore, should_profile
+from .replicas import SAFE_METHODS, STICKY_COOKIE
+
+logger = logging.getLogger('lms')
+
+_current_timings = contextvars.ContextVar('lms_request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Figures collected while one request is served; they are passed on to the
+    timings of an outer middleware, if any
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_sql = ''
+        self.phases = {}
+
+    def add_query(self, sql: str, seconds: float):
+        self.query_count += 1
+        self.sql_seconds += seconds
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds, self.slowest_sql = seconds, sql
+        if self.parent is not None:
+            self.parent.add_query(sql, seconds)
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.parent is not None:
+            self.parent.add_phase(name, seconds)
+
+    def durations(self) -> dict:
+        """
+        :return: milliseconds per metric; app is what is left of the total once SQL and
+            the timed phases (serialize, render) are taken out, i.e. the view logic
+        """
+        total = time.perf_counter() - self.started
+        durations = {'db': self.sql_seconds, 'db-slowest': self.slowest_seconds}
+        durations.update(self.phases)
+        durations['app'] = max(0.0, total - self.sql_seconds - sum(self.phases.values()))
+        durations['total'] = total
+        return {name: round(seconds * 1000, 2) for name, seconds in durations.items()}
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper that adds the query's duration to the current request's timings
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    Put record_query() in the connection's execute wrappers, once. It stays there
+    and only records while a request is being timed; the request is found
+    through a context variable, which also follows queries that async views
+    run in worker threads.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed_request():
+    """
+    Collect the RequestTimings of the request served in the block
+    """
+    timings = RequestTimings(parent=_current_timings.get())
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed_phase(name: str):
+    """
+    Time a block as a Server-Timing metric of the current request, if it is timed.
+    Queries run in the block, e.g. by lazy querysets a serializer walks, count as
+    db and not as the phase.
+    :param name: metric name, e.g. render
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started, sql_seconds = time.perf_counter(), timings.sql_seconds
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started - (timings.sql_seconds - sql_seconds)
+        timings.add_phase(name, max(elapsed, 0.0))
+
+
+class ServerTimingMiddleware:
+    """
+    Reports the query count, SQL time, slowest query, serialization and render
+    time and the rest of the view time of every request in a Server-Timing header and a JSON log
+    line on the 'lms' logger. Enabled by LMS_SERVER_TIMING. Streamed responses
+    are timed up to the first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder, dispatch_uid='lms_install_query_recorder')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        with timed_request() as timings:
+            response = self.get_response(request)
+        return self.report(request, response, timings)
+
+    async def __acall__(self, request):
+        with timed_request() as timings:
+            response = await self.get_response(request)
+        return self.report(request, response, timings)
+
+    @staticmethod
+    def report(request, response, timings: RequestTimings):
+        durations = timings.durations()
+        metrics = []
+        for name, milliseconds in durations.items():
+            description = f';desc="{timings.query_count} queries"' if name == 'db' else ''
+            metrics.append(f'{name};dur={milliseconds}{description}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'event': 'request_timing',
+            'method': request.method,
+            'path': request.path,
+            'url_name': resolver_match.url_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': timings.query_count,
+            'slowest_sql': timings.slowest_sql[:300],
+            **{f'{name.replace("-", "_")}_ms': milliseconds for name, milliseconds in durations.items()},
+        }))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Counts the requests, latency, response size, errors and SQL queries of
+    every route and status for the /metrics endpoint. Enabled by LMS_METRICS;
+    with LMS_METRICS_DIR set, each worker process shares its figures through a
+    file in that directory every LMS_METRICS_WRITE_INTERVAL seconds.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder, dispatch_uid='lms_install_query_recorder')
+        atexit.register(metrics.write_process_file)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        with timed_request() as timings:
+            response = self.get_response(request)
+        metrics.record_request(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        with timed_request() as timings:
+            response = await self.get_response(request)
+        metrics.record_request(request, response, timings)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the whole view, serialization and rendering of sampled requests
+    with cProfile and aggregates the profiles per route into LMS_PROFILE_DIR
+    (see manage.py profile_report). Requests are picked by the per-route
+    LMS_PROFILE_SAMPLE_RATES or by a signed X-LMS-Profile header. Enabled by
+    LMS_PROFILING. cProfile follows one thread, and the event loop interleaves
+    requests; under ASGI the profiler therefore runs in the thread the request's
+    sync work is handed to (sync views, rendering, the ORM calls of async views),
+    and code running on the event loop itself is left out.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        self.store = ProfileStore()
+        atexit.register(self.store.flush_all)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        url_name = self.sampled_url_name(request)
+        if url_name is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        self.store.add(url_name, profiler)
+        return response
+
+    async def __acall__(self, request):
+        url_name = self.sampled_url_name(request)
+        if url_name is None:
+            return await self.get_response(request)
+
+        # The ASGI handler gives every request a thread of its own for its thread-sensitive sync work
+        profiler = cProfile.Profile()
+        try:
+            await sync_to_async(profiler.enable)()
+        except ValueError:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(profiler.disable)()
+        await sync_to_async(self.store.add)(url_name, profiler)
+        return response
+
+    @staticmethod
+    def sampled_url_name(request):
+        """
+        :param request:
+        :return: URL name of the request's route if the request is to be profiled, else None
+        """
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        if not url_name or not should_profile(request, url_name):
+            return None
+        return url_name
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Keeps the reads of a client that just wrote on the primary for
+    LMS_REPLICA_STICKY_SECONDS, through a cookie set by every unsafe-method
+    request, so the client reads its own writes whatever the replication lag.
+    Enabled by DB_REPLICA_URLS.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.stick(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.stick(request, await self.get_response(request))
+
+    @staticmethod
+    def stick(request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.LMS_REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
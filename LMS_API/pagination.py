@@ -0,0 +1,421 @@
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+COUNT_MODES = ('exact', 'cached', 'estimated')
+
+
+def _count_version_key(model) -> str:
+    return f'lms:count-version:{model._meta.label_lower}'
+
+
+def count_version(model) -> int:
+    """
+    :param model:
+    :return: number that changes whenever rows of the model are created or deleted
+    """
+    return cache.get(_count_version_key(model), 0)
+
+
+async def acount_version(model) -> int:
+    """
+    Async counterpart of count_version()
+    """
+    return await cache.aget(_count_version_key(model), 0)
+
+
+def invalidate_counts(model):
+    """
+    Drop every cached count of the model's table by bumping its version
+    :param model: model class whose rows were created or deleted
+    """
+    key = _count_version_key(model)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def _estimated_count(queryset):
+    """
+    :param queryset: unfiltered queryset
+    :return: row count from the database's table statistics, or None if they are unavailable
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'sqlite':
+        # Only present once ANALYZE has run; the first figure of stat is the row count
+        sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    count = int(str(row[0]).split()[0])
+    return count if count >= 0 else None
+
+
+def _count_cache_key(queryset, version: int) -> str:
+    sql_digest = hashlib.md5(str(queryset.query).encode('utf-8')).hexdigest()
+    return f'lms:count:{queryset.model._meta.label_lower}:{version}:{sql_digest}'
+
+
+def count_rows(queryset, count_mode: str):
+    """
+    :param queryset:
+    :param count_mode: exact, cached or estimated
+    :return: (count, mode that actually produced the count)
+    """
+    if count_mode == 'estimated' and not queryset.query.where:
+        count = _estimated_count(queryset)
+        if count is not None:
+            return count, 'estimated'
+        count_mode = 'cached'
+    if count_mode == 'cached':
+        key = _count_cache_key(queryset, count_version(queryset.model))
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, timeout=settings.LMS_COUNT_CACHE_TTL)
+        return count, 'cached'
+    return queryset.count(), 'exact'
+
+
+async def acount_rows(queryset, count_mode: str):
+    """
+    Async counterpart of count_rows()
+    :param queryset:
+    :param count_mode: exact, cached or estimated
+    :return: (count, mode that actually produced the count)
+    """
+    if count_mode == 'estimated' and not queryset.query.where:
+        count = await sync_to_async(_estimated_count)(queryset)
+        if count is not None:
+            return count, 'estimated'
+        count_mode = 'cached'
+    if count_mode == 'cached':
+        key = _count_cache_key(queryset, await acount_version(queryset.model))
+        count = await cache.aget(key)
+        if count is None:
+            count = await queryset.acount()
+            await cache.aset(key, count, timeout=settings.LMS_COUNT_CACHE_TTL)
+        return count, 'cached'
+    return await queryset.acount(), 'exact'
+
+
+def get_count_mode(request) -> str:
+    """
+    :param request: ?count_mode= overrides LMS_PAGINATION_COUNT_MODE
+    :return:
+    """
+    count_mode = request.GET.get('count_mode', settings.LMS_PAGINATION_COUNT_MODE)
+    if count_mode not in COUNT_MODES:
+        raise ValidationError({'count_mode': f'Must be one of: {", ".join(COUNT_MODES)}'})
+    return count_mode
+
+
+class InexactPage(Page):
+    """
+    Page that knows whether a next page exists from an extra fetched row, for
+    when the paginator's count is a cached or estimated figure
+    """
+
+    def __init__(self, object_list, number, paginator, has_next: bool):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountingPaginator(Paginator):
+    """
+    Django paginator whose total comes from count_rows(). Unless the count is
+    exact, page bounds are not checked against it; the page itself tells
+    whether another one follows.
+    """
+
+    def __init__(self, object_list, per_page, count_mode: str = 'exact', **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_mode = count_mode
+
+    @cached_property
+    def count(self):
+        count, self.count_mode = count_rows(self.object_list, self.count_mode)
+        return count
+
+    def validate_number(self, number):
+        if self.count_mode == 'exact':
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise self.PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise self.EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        if self.count_mode == 'exact':
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise self.EmptyPage('That page contains no results')
+        return InexactPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+    async def acount(self) -> int:
+        """
+        Fill the count from the async ORM, so later reads of .count and
+        .num_pages do not query
+        """
+        if 'count' not in self.__dict__:
+            self.__dict__['count'], self.count_mode = await acount_rows(self.object_list, self.count_mode)
+        return self.count
+
+    async def apage(self, number):
+        """
+        Async counterpart of page(), with the count already filled by acount()
+        """
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        if self.count_mode == 'exact':
+            rows = [row async for row in self.object_list[bottom:bottom + self.per_page]]
+            return self._get_page(rows, number, self)
+        rows = [row async for row in self.object_list[bottom:bottom + self.per_page + 1]]
+        if not rows and number > 1:
+            raise self.EmptyPage('That page contains no results')
+        return InexactPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+
+class CountPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination sized by ?count=, capped at LMS_PAGINATION_MAX_COUNT,
+    with the primary key as tie-breaker so rows sharing a sort value keep a stable order
+    """
+    page_size = 10
+    page_size_query_param = 'count'
+
+    def __init__(self, ordering: str, count_mode: str = 'exact'):
+        self.ordering = ordering
+        self.count_mode = count_mode
+        self.max_page_size = settings.LMS_PAGINATION_MAX_COUNT
+
+    def django_paginator_class(self, object_list, per_page, **kwargs):
+        return CountingPaginator(object_list, per_page, count_mode=self.count_mode, **kwargs)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return super().paginate_queryset(queryset.order_by(self.ordering, 'id'), request, view)
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Async counterpart of paginate_queryset(), through the async ORM
+        """
+        self.request = request
+        paginator = self.django_paginator_class(queryset.order_by(self.ordering, 'id'), self.get_page_size(request))
+        await paginator.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = await paginator.apage(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_mode'] = self.page.paginator.count_mode
+        return response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the (ordering, id) tuple. The opaque cursor carries the
+    sort value and id of the boundary row, so every page is an index range scan
+    whatever its depth, and rows can not repeat or vanish between pages.
+    """
+    page_size = 10
+    page_size_query_param = 'count'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering: str, count_mode: str = 'exact'):
+        self.ordering = ordering
+        self.count_mode = count_mode
+        self.max_page_size = settings.LMS_PAGINATION_MAX_COUNT
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def decode_cursor(self, request, model):
+        """
+        :param request:
+        :param model: model of the paginated rows, whose fields convert the values of the cursor
+        :return: (sort value, id, reverse) of the boundary row, or None on the first page
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = model._meta.get_field(self.ordering).to_python(cursor['v'])
+            pk = model._meta.pk.to_python(cursor['i'])
+            if value is None or pk is None:
+                raise ValueError('Cursor without a boundary row')
+            return value, pk, bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        cursor = {'v': self.get_row_value(row, self.ordering), 'i': self.get_row_value(row, 'id'), 'r': reverse}
+        payload = json.dumps(cursor, cls=JSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def get_row_value(row, name: str):
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+    def page_queryset(self, queryset, request):
+        """
+        :param queryset:
+        :param request:
+        :return: unevaluated queryset of the page, with one extra row to detect a following page
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request, queryset.model)
+        if self.cursor is None:
+            return queryset.order_by(self.ordering, 'id')[:self.page_size + 1]
+
+        value, pk, self.reverse = self.cursor
+        if self.reverse:
+            boundary = Q(**{f'{self.ordering}__lt': value}) | Q(**{self.ordering: value, 'id__lt': pk})
+            queryset = queryset.filter(boundary).order_by(f'-{self.ordering}', '-id')
+        else:
+            boundary = Q(**{f'{self.ordering}__gt': value}) | Q(**{self.ordering: value, 'id__gt': pk})
+            queryset = queryset.filter(boundary).order_by(self.ordering, 'id')
+        return queryset[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count, self.count_mode = count_rows(queryset, self.count_mode)
+        self.reverse = False
+        return self.paginate_rows(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Async counterpart of paginate_queryset(), through the async ORM
+        """
+        self.count, self.count_mode = await acount_rows(queryset, self.count_mode)
+        self.reverse = False
+        return self.paginate_rows([row async for row in self.page_queryset(queryset, request)])
+
+    def paginate_rows(self, rows: list) -> list:
+        """
+        :param rows: evaluated rows of page_queryset()
+        :return: rows of the page, in display order
+        """
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+            ('count_mode', self.count_mode)
+        ]))
+
+
+def get_paginator(request, ordering: str):
+    """
+    :param request: ?pagination=cursor opts into keyset pagination, ?count_mode= picks how the total is counted
+    :param ordering: model field the list is sorted by
+    :return: paginator for the list view
+    """
+    count_mode = get_count_mode(request)
+    if request.GET.get('pagination') == 'cursor':
+        return KeysetPagination(ordering, count_mode)
+    return CountPageNumberPagination(ordering, count_mode)
+
+
+def page_queryset(request, queryset, ordering: str):
+    """
+    :param request:
+    :param queryset:
+    :param ordering:
+    :return: unevaluated queryset of the rows the list view will return for this request, or None
+        when the page can not be told without running the pagination
+    """
+    if not isinstance(request, Request):
+        request = Request(request)
+    if request.GET.get('pagination') == 'cursor':
+        try:
+            return KeysetPagination(ordering).page_queryset(queryset, request)
+        except NotFound:
+            return None
+    paginator = CountPageNumberPagination(ordering)
+    page_size = paginator.get_page_size(request)
+    try:
+        page_number = int(request.GET.get(paginator.page_query_param, 1))
+    except ValueError:
+        return None
+    if page_number < 1:
+        return None
+    offset = (page_number - 1) * page_size
+    return queryset.order_by(ordering, 'id')[offset:offset + page_size]
@@ -0,0 +1,119 @@
+import json
+import os
+import pstats
+import random
+import socket
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = 'X-LMS-Profile'
+_TOKEN_SALT = 'lms.profile'
+
+# Where self time is attributed in reports; the first matching category wins
+CATEGORIES = [
+    ('SQL driver', ('sqlite3', 'SQLiteCursorWrapper', 'MySQLdb', '_mysql', 'psycopg')),
+    ('Django ORM', ('/django/db/',)),
+    ('DRF serializers', (
+        '/rest_framework/serializers.py', '/rest_framework/fields.py', '/rest_framework/relations.py',
+        '/rest_framework/utils/serializer_helpers.py', '/rest_framework_friendly_errors/',
+    )),
+    ('Rendering', ('/rest_framework/renderers.py', '/json/', '/ApReusable/renderer.py', 'LMS_API/renderers.py')),
+    ('LMS code', ('/LMS_API/', '/LMS_Core/')),
+    ('Django and DRF request handling', ('/django/', '/rest_framework/')),
+]
+
+
+def profile_token() -> str:
+    """
+    :return: value for the X-LMS-Profile header, valid for LMS_PROFILE_TOKEN_MAX_AGE seconds
+    """
+    return signing.TimestampSigner(salt=_TOKEN_SALT).sign('profile')
+
+
+def has_valid_token(request) -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=_TOKEN_SALT).unsign(token, max_age=settings.LMS_PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(request, url_name: str) -> bool:
+    """
+    :param request:
+    :param url_name: name of the resolved route
+    :return: whether this request is sampled by LMS_PROFILE_SAMPLE_RATES or asked for with a signed header
+    """
+    rates = settings.LMS_PROFILE_SAMPLE_RATES
+    rate = rates.get(url_name, rates.get('*', 0.0))
+    if rate and random.random() < rate:
+        return True
+    return has_valid_token(request)
+
+
+def category_of(function_key: tuple) -> str:
+    """
+    :param function_key: pstats (filename, line, function name) key
+    :return: name of the category the function's self time goes to
+    """
+    filename, _, function_name = function_key
+    location = f'{filename}:{function_name}'.replace(os.sep, '/')
+    for name, patterns in CATEGORIES:
+        if any(pattern in location for pattern in patterns):
+            return name
+    return 'Builtins and other'
+
+
+class ProfileStore:
+    """
+    Per-process accumulator of the profiles of each route. Every
+    LMS_PROFILE_FLUSH_EVERY profiles of a route, its aggregate replaces
+    <LMS_PROFILE_DIR>/<url name>/<host>-<pid>.prof, with the number of
+    requests in a .json file next to it.
+    """
+
+    def __init__(self, directory=None, flush_every: int = None):
+        self.directory = Path(directory or settings.LMS_PROFILE_DIR)
+        self.flush_every = flush_every or settings.LMS_PROFILE_FLUSH_EVERY
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.requests = {}
+        self.pending = {}
+
+    def path_of(self, url_name: str) -> Path:
+        return self.directory / url_name / f'{socket.gethostname()}-{os.getpid()}.prof'
+
+    def add(self, url_name: str, profiler):
+        with self.lock:
+            if url_name in self.stats:
+                self.stats[url_name].add(profiler)
+            else:
+                self.stats[url_name] = pstats.Stats(profiler)
+            self.requests[url_name] = self.requests.get(url_name, 0) + 1
+            self.pending[url_name] = self.pending.get(url_name, 0) + 1
+            if self.pending[url_name] >= self.flush_every:
+                self.flush(url_name)
+
+    def flush(self, url_name: str):
+        """
+        Write the route's aggregate; called with the lock held
+        """
+        path = self.path_of(url_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix('.tmp')
+        self.stats[url_name].dump_stats(temporary)
+        os.replace(temporary, path)
+        path.with_suffix('.json').write_text(json.dumps({'requests': self.requests[url_name]}))
+        self.pending[url_name] = 0
+
+    def flush_all(self):
+        with self.lock:
+            for url_name, pending in self.pending.items():
+                if pending:
+                    self.flush(url_name)
@@ -0,0 +1,76 @@
+import orjson
+from ApReusable.renderer import CustomJSONRenderer
+from django.conf import settings
+from rest_framework import renderers
+
+from .middleware import timed_phase
+
+# Values visited by is_plain_json() before it gives up and lets the json module write the response
+PLAIN_JSON_BUDGET = 256
+
+
+class PlainRows(list):
+    """
+    List of rows whose values are only str, int, bool, None and containers of
+    them, so orjson and the json module write them the same way
+    """
+
+
+def is_plain_json(value, budget: int = PLAIN_JSON_BUDGET) -> bool:
+    """
+    :param value: data about to be rendered
+    :param budget: most values to look at; PlainRows count as one
+    :return: whether the data holds no float, which orjson formats differently from json
+        (1e-05 becomes 0.00001), and no type orjson would write differently
+    """
+    pending = [value]
+    while pending:
+        budget -= 1
+        if budget < 0:
+            return False
+        value = pending.pop()
+        if value is None or isinstance(value, (str, int, PlainRows)):
+            continue
+        if isinstance(value, dict):
+            if not all(type(key) is str for key in value):
+                return False
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+        else:
+            return False
+    return True
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer writing through orjson whenever that gives the very same bytes:
+    compact, unindented unicode output of plain JSON values, with
+    LMS_FAST_SERIALIZATION on. Anything else still goes through the json module.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if not settings.LMS_FAST_SERIALIZATION or indent is not None or not self.compact or self.ensure_ascii \
+                or not is_plain_json(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data)
+        except orjson.JSONEncodeError:
+            # e.g. an integer beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping of the JavaScript line terminators as JSONRenderer
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class TimedJSONRenderer(CustomJSONRenderer, FastJSONRenderer):
+    """
+    CustomJSONRenderer, written by FastJSONRenderer, whose work shows up as the
+    render metric of Server-Timing
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,113 @@
+import contextvars
+import itertools
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+# Set on a client by every write; while it lasts, the client's reads stay on the primary
+STICKY_COOKIE = 'lms_primary_reads'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = contextvars.ContextVar('lms_read_alias', default=None)
+_turns = itertools.count()
+
+
+def next_replica():
+    """
+    :return: the alias of the replica whose turn it is, or None without replicas
+    """
+    replicas = settings.LMS_DATABASE_REPLICAS
+    return replicas[next(_turns) % len(replicas)] if replicas else None
+
+
+def reading_from_replica() -> bool:
+    """
+    :return: whether the queries of the current request read from a replica
+    """
+    return _read_alias.get() is not None
+
+
+def read_alias_for(request):
+    """
+    :param request:
+    :return: the replica a request reads from, or None for the primary: writes, and clients
+        that wrote less than LMS_REPLICA_STICKY_SECONDS ago, stay on the primary
+    """
+    if request.method not in SAFE_METHODS or STICKY_COOKIE in request.COOKIES:
+        return None
+    return next_replica()
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of requests served by a replica_reads() view to the replica
+    picked for the request, and everything else, writes included, to default.
+    Replicas are copies of default, so they are never migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.LMS_DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in settings.LMS_DATABASE_REPLICAS else None
+
+
+def _streamed_from(alias, content):
+    """
+    Produce the chunks of a streamed response with its reads still on the replica
+    of the request, since the queries behind them run after the view returned
+    """
+    chunks = iter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+def _finish(alias, response):
+    if alias is not None and response.streaming and not getattr(response, 'is_async', False):
+        response.streaming_content = _streamed_from(alias, response.streaming_content)
+    return response
+
+
+def replica_reads(view):
+    """
+    Serve the safe-method requests of a read view, conditional request checks
+    included, from one replica picked in turn per request, so a response never
+    mixes replicas that lag differently. No-op without LMS_DATABASE_REPLICAS.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            alias = read_alias_for(request)
+            token = _read_alias.set(alias)
+            try:
+                return _finish(alias, await view(request, *args, **kwargs))
+            finally:
+                _read_alias.reset(token)
+        return async_view
+
+    @wraps(view)
+    def sync_view(request, *args, **kwargs):
+        alias = read_alias_for(request)
+        token = _read_alias.set(alias)
+        try:
+            return _finish(alias, view(request, *args, **kwargs))
+        finally:
+            _read_alias.reset(token)
+    return sync_view
@@ -0,0 +1,77 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from LMS_Core.models import Books
+
+
+def search_terms(query: str) -> list:
+    """
+    :param query: free text typed by the patron
+    :return: word tokens of the query, without any full-text operators
+    """
+    return re.findall(r'\w+', query)
+
+
+def _sqlite_search(connection, terms: list, limit: int, offset: int):
+    match = ' OR '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM LMS_Core_books_search WHERE LMS_Core_books_search MATCH %s', [match])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT rowid, -bm25(LMS_Core_books_search) AS score FROM LMS_Core_books_search '
+            'WHERE LMS_Core_books_search MATCH %s ORDER BY score DESC, rowid LIMIT %s OFFSET %s',
+            [match, limit, offset]
+        )
+        return total, cursor.fetchall()
+
+
+def _mysql_search(connection, terms: list, limit: int, offset: int):
+    against = ' '.join(f'{term}*' for term in terms)
+    matches = (
+        'SELECT id AS book_id, MATCH (title) AGAINST (%s IN BOOLEAN MODE) AS score FROM LMS_Core_books '
+        'WHERE MATCH (title) AGAINST (%s IN BOOLEAN MODE) '
+        'UNION ALL '
+        'SELECT ab.books_id AS book_id, MATCH (a.name) AGAINST (%s IN BOOLEAN MODE) AS score FROM LMS_Core_authors a '
+        'INNER JOIN LMS_Core_authors_books ab ON ab.authors_id = a.id '
+        'WHERE MATCH (a.name) AGAINST (%s IN BOOLEAN MODE)'
+    )
+    params = [against] * 4
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(DISTINCT book_id) FROM ({matches}) matches', params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f'SELECT book_id, SUM(score) AS score FROM ({matches}) matches '
+            'GROUP BY book_id ORDER BY score DESC, book_id LIMIT %s OFFSET %s',
+            params + [limit, offset]
+        )
+        return total, cursor.fetchall()
+
+
+def _fallback_search(terms: list, limit: int, offset: int):
+    condition = Q()
+    for term in terms:
+        condition |= Q(title__icontains=term) | Q(authors__name__icontains=term)
+    book_ids = Books.objects.filter(condition).values_list('id', flat=True).distinct().order_by('id')
+    return book_ids.count(), [(book_id, None) for book_id in book_ids[offset:offset + limit]]
+
+
+def search_books(query: str, limit: int, offset: int = 0, using: str = 'default'):
+    """
+    Rank books by relevance of their title and author names to the query
+    :param query: free text
+    :param limit: page size
+    :param offset: rows to skip
+    :param using: database alias
+    :return: (total number of matches, [(book id, score), ...] of the page, best match first)
+    """
+    terms = search_terms(query)
+    if not terms:
+        return 0, []
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        return _sqlite_search(connection, terms, limit, offset)
+    if connection.vendor == 'mysql':
+        return _mysql_search(connection, terms, limit, offset)
+    return _fallback_search(terms, limit, offset)
@@ -1,30 +1,238 @@
 import re
+from functools import cache
 
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from rest_framework import serializers
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import SkipField, empty
+from rest_framework.settings import api_settings
 from rest_framework_friendly_errors.mixins import FriendlyErrorMessagesMixin
 from rest_framework.exceptions import ValidationError
 from rest_framework import status
-from LMS_Core.models import Books, Authors, BookLending
-from datetime import datetime
+from LMS_Core.models import Books, Authors, BookLending, Borrower
+from datetime import date, datetime
+from .renderers import PlainRows, is_plain_json
+
+
+class EagerLoadingMixin:
+    """
+    Serializers list the relations they read, so views can load them with the
+    queryset instead of one query per serialized row
+    """
+    select_related_fields = []
+    prefetch_related_fields = []
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        :param queryset:
+        :return: queryset with the serializer's relations joined or prefetched
+        """
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+
+def _field_converter(field):
+    return field.to_representation
+
+
+def _date_converter(field):
+    if getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601:
+        return date.isoformat
+    return field.to_representation
+
+
+def _datetime_converter(field):
+    """
+    :return: DateTimeField.to_representation() without its per-value lookups of the format and time zone
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def to_representation(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return to_representation
+
+
+class RowSerializer:
+    """
+    Read-only stand-in for a ModelSerializer made of plain model fields, for
+    list endpoints: the rows come from values_list() instead of model
+    instances and become dicts without going through the field objects, while
+    the output stays the serializer's, value for value.
+    """
+    # Fields whose representation is the value read from the database
+    identity_fields = (serializers.IntegerField, serializers.CharField, serializers.BooleanField)
+    # Fields that need more than the column's value
+    unsupported_fields = (
+        serializers.RelatedField, serializers.ManyRelatedField, serializers.FileField, serializers.BaseSerializer
+    )
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        self.field_names, self.columns, self.converted_fields, self.json_fields = [], [], [], []
+        self.plain = True
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            try:
+                model_field = model._meta.get_field(field.source) if len(field.source_attrs) == 1 else None
+            except FieldDoesNotExist:
+                model_field = None
+            primary_key_only = isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None
+            if model_field is None or not model_field.concrete or model_field.many_to_many or (
+                isinstance(field, self.unsupported_fields) and not primary_key_only
+            ):
+                raise ValueError(f'{serializer_class.__name__}.{field.field_name} is not a plain model field')
+            self.field_names.append(field.field_name)
+            self.columns.append(field.source)
+
+            if isinstance(field, serializers.JSONField) and not field.binary:
+                self.json_fields.append(field.field_name)
+            elif primary_key_only or isinstance(field, self.identity_fields):
+                continue
+            elif isinstance(field, serializers.DateTimeField):
+                self.converted_fields.append((field, _datetime_converter))
+            elif isinstance(field, serializers.DateField):
+                self.converted_fields.append((field, _date_converter))
+            else:
+                self.converted_fields.append((field, _field_converter))
+                self.plain = False
+
+    def queryset(self, queryset):
+        """
+        :param queryset: queryset of the serializer's model
+        :return: the same rows as named tuples of the serializer's columns
+        """
+        return queryset.values_list(*self.columns, named=True)
+
+    def to_representation(self, rows) -> list:
+        """
+        :param rows: rows of queryset()
+        :return: what serializer_class(instances, many=True).data holds; PlainRows when
+            every value is a plain JSON value
+        """
+        names = self.field_names
+        # Made per call, as the time zone of the datetimes is the request's
+        converters = [(field.field_name, make_converter(field)) for field, make_converter in self.converted_fields]
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, convert in converters:
+                value = item[name]
+                if value is not None:
+                    item[name] = convert(value)
+            data.append(item)
+        plain = self.plain and all(is_plain_json(item[name]) for item in data for name in self.json_fields)
+        return PlainRows(data) if plain else data
+
+
+class RowValidator:
+    """
+    Write-side counterpart of RowSerializer, for bulk imports: each line of
+    plain fields goes through the field objects, the validate_<field> methods
+    and validate() of the serializer, without the per-row machinery of
+    run_validation(). A line that fails is validated once more by the
+    serializer itself, so its errors are the serializer's, word for word.
+    """
+    unsupported_fields = RowSerializer.unsupported_fields
+
+    def __init__(self, serializer_class):
+        self.serializer = serializer_class()
+        if self.serializer.get_validators():
+            raise ValueError(f'{serializer_class.__name__} has validators of its own')
+        self.fields = []
+        for field in self.serializer._writable_fields:
+            if isinstance(field, self.unsupported_fields) or len(field.source_attrs) != 1:
+                raise ValueError(f'{serializer_class.__name__}.{field.field_name} is not a plain model field')
+            validate_method = getattr(self.serializer, f'validate_{field.field_name}', None)
+            self.fields.append((field.field_name, field.source, field, validate_method))
+
+    def run_validation(self, row: dict) -> dict:
+        """
+        :param row: a parsed line
+        :return: the validated attributes, as serializer.run_validation(row) returns them
+        """
+        attrs = {}
+        try:
+            for name, source, field, validate_method in self.fields:
+                try:
+                    value = field.run_validation(row.get(name, empty))
+                except SkipField:
+                    continue
+                attrs[source] = validate_method(value) if validate_method else value
+            return self.serializer.validate(attrs)
+        except (ValidationError, DjangoValidationError):
+            return self.serializer.run_validation(row)
+
+
+@cache
+def row_validator(serializer_class):
+    """
+    :param serializer_class: ModelSerializer of a bulk-create endpoint
+    :return: its RowValidator, or None when it has fields or validators a RowValidator can not run
+    """
+    try:
+        return RowValidator(serializer_class)
+    except ValueError:
+        return None
+
+
+@cache
+def row_serializer(serializer_class):
+    """
+    :param serializer_class: ModelSerializer of a list endpoint
+    :return: its RowSerializer, or None when it has fields a RowSerializer can not read,
+        e.g. SerializerMethodFields or nested serializers
+    """
+    try:
+        return RowSerializer(serializer_class)
+    except ValueError:
+        return None
 
 
 class BooksSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+    available = serializers.BooleanField(required=False, default=True)
+    copies = serializers.IntegerField(required=False, default=1, min_value=0)
+
+    def validate(self, attrs):
+        """
+        :param attrs:
+        :return: the attributes with every copy on the shelf, or none if the book is created unavailable
+        """
+        attrs['available_count'] = attrs['copies'] if attrs['available'] else 0
+        attrs['available'] = attrs['available_count'] > 0
+        return attrs
+
     class Meta:
         model = Books
         fields = '__all__'
+        read_only_fields = ['available_count']
 
 
-class BooksInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+class BooksInfoSerializer(EagerLoadingMixin, FriendlyErrorMessagesMixin, serializers.ModelSerializer):
     authors = serializers.SerializerMethodField('get_authors')
+    prefetch_related_fields = ['authors_set']
 
     def get_authors(self, instance: Books):
         return AuthorSerializer(instance.authors_set.all(), many=True).data
 
     class Meta:
         model = Books
-        fields = ['id', 'title', 'publication_date', 'available', 'authors', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'publication_date', 'available', 'copies', 'available_count', 'authors', 'created_at', 'updated_at']
 
 
 class BooksBasicInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
@@ -33,14 +241,88 @@ class BooksBasicInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSeri
         fields = ['id', 'title', 'publication_date']
 
 
+class BookSearchResultSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+    authors = serializers.ListField(source='author_names', child=serializers.CharField(), read_only=True)
+
+    class Meta:
+        model = Books
+        fields = ['id', 'title', 'publication_date', 'available', 'copies', 'available_count', 'authors']
+
+
+class BookSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=True, max_length=255)
+    page = serializers.IntegerField(required=False, default=1, min_value=1)
+    count = serializers.IntegerField(required=False, default=10, min_value=1)
+
+    def validate_count(self, count):
+        """
+        :param count:
+        :return: page size capped at LMS_PAGINATION_MAX_COUNT
+        """
+        return min(count, settings.LMS_PAGINATION_MAX_COUNT)
+
+
+class ReadManySerializer(serializers.Serializer):
+    ids = serializers.CharField(required=True)
+
+    def validate_ids(self, ids) -> list:
+        """
+        :param ids: comma separated ids
+        :return: de-duplicated list of ids, in request order, at most LMS_READ_MANY_MAX_IDS of them
+        """
+        try:
+            ids = list(dict.fromkeys(int(part) for part in ids.split(',') if part.strip()))
+        except ValueError:
+            raise ValidationError('ids must be a comma separated list of IDs.', code=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            raise ValidationError('ids can not be empty.', code=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.LMS_READ_MANY_MAX_IDS:
+            raise ValidationError(f'At most {settings.LMS_READ_MANY_MAX_IDS} ids can be read at once.', code=status.HTTP_400_BAD_REQUEST)
+        return ids
+
+
 class BooksUpdateSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
     title = serializers.CharField(required=False)
     publication_date = serializers.DateField(required=False)
+    copies = serializers.IntegerField(required=False, min_value=0)
     available = serializers.BooleanField(required=False)
 
+    def update(self, instance: Books, validated_data):
+        """
+        The inventory columns are never saved from the instance, which borrowers may
+        have made stale by now; a new number of copies moves available_count in the
+        database instead, available false withdraws the copies on the shelf and
+        available true puts back every copy that is not on loan
+        :param instance:
+        :param validated_data:
+        :return: the updated book
+        """
+        copies = validated_data.pop('copies', None)
+        available = validated_data.pop('available', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if copies is None and available is None:
+            instance.save(update_fields=[*validated_data, 'updated_at'])
+            return instance
+
+        with transaction.atomic():
+            book = Books.objects.filter(id=instance.id)
+            if copies is not None and not book.set_copies(copies):
+                raise ValidationError(
+                    {'copies': 'More copies of this book are on loan than that.'}, code=status.HTTP_400_BAD_REQUEST
+                )
+            if available is True:
+                book.restock()
+            elif available is False:
+                book.withdraw()
+            instance.save(update_fields=[*validated_data, 'updated_at'])
+        instance.refresh_from_db(fields=['available', 'copies', 'available_count'])
+        return instance
+
     class Meta:
         model = Books
         fields = '__all__'
+        read_only_fields = ['available_count']
 
 
 class AuthorSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
@@ -57,8 +339,9 @@ class AuthorUpdateSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerial
         fields = ['id', 'name', 'created_at', 'updated_at']
 
 
-class AuthorInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+class AuthorInfoSerializer(EagerLoadingMixin, FriendlyErrorMessagesMixin, serializers.ModelSerializer):
     books = serializers.SerializerMethodField('get_books')
+    prefetch_related_fields = ['books']
 
     def get_books(self, instance: Authors):
         return BooksSerializer(instance.books.all(), many=True).data
@@ -68,44 +351,87 @@ class AuthorInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializ
         fields = ['id', 'name', 'books', 'created_at', 'updated_at']
 
 
-class AuthorBookSerializer(serializers.Serializer):
-    book_id = serializers.IntegerField(required=True)
+class AuthorBookPairSerializer(serializers.Serializer):
     author_id = serializers.IntegerField(required=True)
+    book_id = serializers.IntegerField(required=True)
 
-    def validate_book_id(self, book_id) -> Books:
-        """
-        :param book_id:
-        :return: Books
-        """
-        book = Books.objects.filter(id=book_id)
-        if not book.exists():
-            raise ValidationError('Book not found!', code=status.HTTP_404_NOT_FOUND)
-        return book.last()
 
-    def validate_author_id(self, author_id) -> Authors:
+class AuthorBookSerializer(serializers.Serializer):
+    """
+    Author-book registrations given as one pair (author_id and book_id), one author
+    with many books (author_id and book_ids), one book with many authors (book_id
+    and author_ids), or a list of pairs
+    """
+    author_id = serializers.IntegerField(required=False)
+    book_id = serializers.IntegerField(required=False)
+    author_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    book_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    pairs = serializers.ListField(child=AuthorBookPairSerializer(), required=False, allow_empty=False)
+
+    def validate(self, attrs):
         """
-        :param author_id:
-        :return: Authors
+        Checks every ID with one query per model
+        :param attrs:
+        :return: {'pairs': de-duplicated list of (author_id, book_id), in request order}
         """
-        author = Authors.objects.filter(id=author_id)
-        if not author.exists():
-            raise ValidationError('Author not found!', code=status.HTTP_404_NOT_FOUND)
-        return author.last()
+        if 'pairs' in attrs:
+            if len(attrs) > 1:
+                raise ValidationError({'pairs': 'Provide either pairs or author and book IDs.'}, code=status.HTTP_400_BAD_REQUEST)
+            pairs = [(pair['author_id'], pair['book_id']) for pair in attrs['pairs']]
+        else:
+            if ('author_id' in attrs) == ('author_ids' in attrs) or ('book_id' in attrs) == ('book_ids' in attrs):
+                raise ValidationError(
+                    {'author_id': 'Provide author_id or author_ids, and book_id or book_ids.'}, code=status.HTTP_400_BAD_REQUEST
+                )
+            if 'author_ids' in attrs and 'book_ids' in attrs:
+                raise ValidationError(
+                    {'author_ids': 'Provide either one author with book_ids or one book with author_ids.'}, code=status.HTTP_400_BAD_REQUEST
+                )
+            author_ids = attrs.get('author_ids', [attrs.get('author_id')])
+            book_ids = attrs.get('book_ids', [attrs.get('book_id')])
+            pairs = [(author_id, book_id) for author_id in author_ids for book_id in book_ids]
+        pairs = list(dict.fromkeys(pairs))
+        if len(pairs) > settings.LMS_AUTHOR_BOOK_MAX_PAIRS:
+            raise ValidationError(
+                {'pairs': f'At most {settings.LMS_AUTHOR_BOOK_MAX_PAIRS} registrations can be changed at once.'},
+                code=status.HTTP_400_BAD_REQUEST
+            )
+
+        book_ids = list(dict.fromkeys(book_id for _, book_id in pairs))
+        found_book_ids = set(Books.objects.filter(id__in=book_ids).values_list('id', flat=True))
+        missing_book_ids = [book_id for book_id in book_ids if book_id not in found_book_ids]
+        if missing_book_ids:
+            raise ValidationError(
+                {'book_id': f'Book not found: {", ".join(map(str, missing_book_ids))}'}, code=status.HTTP_404_NOT_FOUND
+            )
+        author_ids = list(dict.fromkeys(author_id for author_id, _ in pairs))
+        found_author_ids = set(Authors.objects.filter(id__in=author_ids).values_list('id', flat=True))
+        missing_author_ids = [author_id for author_id in author_ids if author_id not in found_author_ids]
+        if missing_author_ids:
+            raise ValidationError(
+                {'author_id': f'Author not found: {", ".join(map(str, missing_author_ids))}'}, code=status.HTTP_404_NOT_FOUND
+            )
+        return {'pairs': pairs}
 
 
 class BookLendCreateSerializer(serializers.Serializer):
-    book_ids = serializers.ListField(required=True)
+    book_ids = serializers.ListField(child=serializers.IntegerField(), required=True, allow_empty=False)
     borrower = serializers.JSONField(required=True)
     borrow_date = serializers.DateField(required=True)
     due_date = serializers.DateField(required=True)
 
     def validate_book_ids(self, book_ids):
         """
+        Only checks that every book exists, in a single query. Availability is claimed
+        atomically by the view, so checking it here would only be a racy hint.
         :param book_ids:
-        :return:
+        :return: de-duplicated list of book ids, in request order
         """
-        if not Books.objects.filter(id__in=book_ids, available=True).exists():
-            raise ValidationError('Some Books are not found/available for lending!', code=status.HTTP_404_NOT_FOUND)
+        book_ids = list(dict.fromkeys(book_ids))
+        found_ids = set(Books.objects.filter(id__in=book_ids).values_list('id', flat=True))
+        missing_ids = [book_id for book_id in book_ids if book_id not in found_ids]
+        if missing_ids:
+            raise ValidationError(f'Some Books are not found for lending: {", ".join(map(str, missing_ids))}', code=status.HTTP_404_NOT_FOUND)
         return book_ids
 
     def validate_borrower(self, borrower):
@@ -120,6 +446,12 @@ class BookLendCreateSerializer(serializers.Serializer):
         blank_fields = [field for field in borrower_fields if not borrower.get(field)]
         if blank_fields:
             raise ValidationError(f'Borrower information fields can not be blank. Required fields are: {", ".join(borrower_fields)}', code=status.HTTP_400_BAD_REQUEST)
+        # The values are copied onto the Borrower row, whose columns are bounded
+        values = {'name': str(borrower['name']), 'mobile': Borrower.normalize_mobile(borrower['mobile'])}
+        for field, value in values.items():
+            max_length = Borrower._meta.get_field(field).max_length
+            if len(value) > max_length:
+                raise ValidationError(f'Borrower {field} can not be longer than {max_length} characters.', code=status.HTTP_400_BAD_REQUEST)
         return borrower
 
     def validate_due_date(self, due_date):
@@ -147,8 +479,9 @@ class BookLendSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer
         fields = ['id', 'borrower', 'borrow_date', 'due_date', 'book_returned', 'return_date']
 
 
-class BookLendInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+class BookLendInfoSerializer(EagerLoadingMixin, FriendlyErrorMessagesMixin, serializers.ModelSerializer):
     book = serializers.SerializerMethodField('get_book')
+    prefetch_related_fields = ['book']
 
     def get_book(self, instance: BookLending):
         return BooksBasicInfoSerializer(instance.book.all(), many=True).data
@@ -158,8 +491,46 @@ class BookLendInfoSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerial
         fields = ['id', 'borrower', 'book', 'borrow_date', 'due_date', 'book_returned', 'return_date']
 
 
+class BorrowerSerializer(FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Borrower
+        fields = ['id', 'name', 'mobile', 'created_at', 'updated_at']
+
+
+class BorrowerLoansSerializer(serializers.Serializer):
+    mobile = serializers.CharField(required=False)
+    open = serializers.BooleanField(required=False, default=False)
+
+    def validate_mobile(self, mobile) -> Borrower:
+        """
+        :param mobile:
+        :return: Borrower
+        """
+        borrower = Borrower.objects.filter(mobile=Borrower.normalize_mobile(mobile)).first()
+        if borrower is None:
+            raise ValidationError('Borrower not found!', code=status.HTTP_404_NOT_FOUND)
+        return borrower
+
+
+class OverdueLoanSerializer(EagerLoadingMixin, FriendlyErrorMessagesMixin, serializers.ModelSerializer):
+    books = serializers.SerializerMethodField('get_books')
+    days_overdue = serializers.SerializerMethodField('get_days_overdue')
+    prefetch_related_fields = [Prefetch('book', queryset=Books.objects.only('id', 'title'))]
+
+    def get_books(self, instance: BookLending):
+        return [{'id': book.id, 'title': book.title} for book in instance.book.all()]
+
+    def get_days_overdue(self, instance: BookLending):
+        return (self.context['today'] - instance.due_date).days
+
+    class Meta:
+        model = BookLending
+        fields = ['id', 'books', 'borrow_date', 'due_date', 'days_overdue']
+
+
 class BookLendReturnSerializer(serializers.Serializer):
-    lend_id = serializers.IntegerField(required=True)
+    lend_id = serializers.IntegerField(required=False)
+    lend_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
     return_date = serializers.DateField(required=True)
 
     def validate_lend_id(self, lend_id):
@@ -167,3 +538,45 @@ class BookLendReturnSerializer(serializers.Serializer):
         if not lend_object.exists():
             raise ValidationError("No lending details found. Either the ID is invalid or book has been returned.", code=status.HTTP_404_NOT_FOUND)
         return lend_object.last()
+
+    def validate_lend_ids(self, lend_ids):
+        """
+        :param lend_ids:
+        :return: de-duplicated list of lending ids, in request order
+        """
+        return list(dict.fromkeys(lend_ids))
+
+    def validate(self, attrs):
+        if ('lend_id' in attrs) == ('lend_ids' in attrs):
+            raise ValidationError({'lend_id': 'Provide either lend_id or lend_ids.'}, code=status.HTTP_400_BAD_REQUEST)
+        return attrs
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False, default='csv')
+    updated_from = serializers.DateTimeField(required=False)
+    updated_to = serializers.DateTimeField(required=False)
+
+    def filter_queryset(self, queryset):
+        """
+        :param queryset:
+        :return: queryset restricted to the requested ranges
+        """
+        if 'updated_from' in self.validated_data:
+            queryset = queryset.filter(updated_at__gte=self.validated_data['updated_from'])
+        if 'updated_to' in self.validated_data:
+            queryset = queryset.filter(updated_at__lte=self.validated_data['updated_to'])
+        return queryset
+
+
+class LendingExportFilterSerializer(ExportFilterSerializer):
+    borrow_date_from = serializers.DateField(required=False)
+    borrow_date_to = serializers.DateField(required=False)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if 'borrow_date_from' in self.validated_data:
+            queryset = queryset.filter(borrow_date__gte=self.validated_data['borrow_date_from'])
+        if 'borrow_date_to' in self.validated_data:
+            queryset = queryset.filter(borrow_date__lte=self.validated_data['borrow_date_to'])
+        return queryset
@@ -0,0 +1,111 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from LMS_Core.models import Books, Authors, BookLending
+from .cache import invalidate_authors, invalidate_books, invalidate_lendings
+from .pagination import invalidate_counts
+
+
+@receiver(post_save, sender=Books)
+@receiver(post_save, sender=Authors)
+@receiver(post_save, sender=BookLending)
+def row_saved(sender, created, **kwargs):
+    if created:
+        invalidate_counts(sender)
+
+
+@receiver(post_delete, sender=Books)
+@receiver(post_delete, sender=Authors)
+@receiver(post_delete, sender=BookLending)
+def row_deleted(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+def registrations_changed(author_ids, book_ids):
+    """
+    Author-book registrations, or the names of registered authors, changed:
+    recompute author_names of the books, bump updated_at on both sides, so the
+    Last-Modified of their detail endpoints moves forward, and evict every
+    cached detail that embeds them. Call it in the transaction of the change,
+    once the registrations are written.
+    :param author_ids:
+    :param book_ids:
+    """
+    author_ids, book_ids = list(author_ids), list(book_ids)
+    now = timezone.now()
+    if author_ids:
+        Authors.objects.filter(id__in=author_ids).update(updated_at=now)
+        invalidate_authors(author_ids)
+    if book_ids:
+        Books.objects.filter(id__in=book_ids).refresh_author_names(updated_at=now)
+        invalidate_books(book_ids, include_lendings=False)
+
+
+@receiver(post_save, sender=Books)
+def book_saved(sender, instance: Books, created, **kwargs):
+    if not created:
+        invalidate_books([instance.pk])
+
+
+@receiver(pre_delete, sender=Books)
+def book_deleted(sender, instance: Books, **kwargs):
+    invalidate_books([instance.pk])
+    registrations_changed(instance.authors_set.values_list('id', flat=True), [])
+
+
+@receiver(post_save, sender=Authors)
+def author_saved(sender, instance: Authors, created, update_fields, **kwargs):
+    if created:
+        return
+    invalidate_authors([instance.pk])
+    if update_fields is None or 'name' in update_fields:
+        registrations_changed([], instance.books.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Authors)
+def author_deleted(sender, instance: Authors, **kwargs):
+    invalidate_authors([instance.pk])
+    # The registrations are deleted with the author; its books are refreshed once they are gone
+    instance._registered_book_ids = list(instance.books.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Authors)
+def author_registrations_deleted(sender, instance: Authors, **kwargs):
+    registrations_changed([], getattr(instance, '_registered_book_ids', []))
+
+
+@receiver(post_save, sender=BookLending)
+@receiver(pre_delete, sender=BookLending)
+def lending_changed(sender, instance: BookLending, created=False, **kwargs):
+    if not created:
+        invalidate_lendings([instance.pk])
+
+
+@receiver(m2m_changed, sender=Authors.books.through)
+def author_books_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Only known before the clear, but author_names can only be recomputed after it
+        related = instance.authors_set if reverse else instance.books
+        instance._cleared_pks = set(related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        registrations_changed(pk_set, [instance.pk])
+    else:
+        registrations_changed([instance.pk], pk_set)
+
+
+@receiver(m2m_changed, sender=BookLending.book.through)
+def lending_books_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_lendings([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_lendings(instance.booklending_set.values_list('id', flat=True))
+    else:
+        invalidate_lendings(pk_set)
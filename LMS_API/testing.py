@@ -0,0 +1,56 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+# Most queries a request to the route may run, whatever the number of rows involved.
+# Lower a budget when a change saves queries; raising one needs a reason.
+QUERY_BUDGETS = {
+    'api-books-create': 1,
+    'api-books-read': 3,
+    'api-books-search': 3,
+    'api-books-export': 3,
+    'api-books-read-details': 3,
+    'api-books-read-many': 2,
+    'api-books-update': 4,
+    'api-author-create': 1,
+    'api-author-read': 3,
+    'api-author-export': 3,
+    'api-author-read-details': 3,
+    'api-author-read-many': 2,
+    'api-author-update': 10,
+    'api-author-book-add': 12,
+    'api-author-book-remove': 12,
+    'api-book-borrow': 12,
+    'api-book-borrow-history': 3,
+    'api-book-borrow-overdue': 4,
+    'api-book-borrow-export': 3,
+    'api-book-borrow-history-details': 3,
+    'api-book-return': 11,
+    'api-borrower-loans-by-mobile': 4,
+    'api-borrower-loans': 4,
+}
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing a test when a request runs more queries than its
+    route's budget, so an N+1 regression shows up as a failure listing the SQL
+    """
+    query_budgets = QUERY_BUDGETS
+
+    def assertQueryBudget(self, method: str, url_name: str, args=None, data=None, **extra):
+        """
+        :param method: client method, e.g. get
+        :param url_name: name of the route, e.g. api-books-read
+        :param args: URL arguments
+        :param data: query parameters or body
+        :return: the response
+        """
+        path = reverse(url_name, args=args)
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(path, data, **extra)
+        budget = self.query_budgets[resolve(path).url_name]
+        if len(captured) > budget:
+            queries = '\n'.join(f'  {query["sql"]}' for query in captured.captured_queries)
+            self.fail(f'{url_name} ran {len(captured)} queries, over its budget of {budget}:\n{queries}')
+        return response
@@ -1,15 +1,43 @@
+import asyncio
+import base64
 import json
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 from rest_framework.test import RequestsClient
+from LMS_Core.models import Books, Authors, BookLending, Borrower
+from LMS_API import metrics, replicas, urls as api_urls, views
+from Library_Management_System_API import urls as project_urls
+from LMS_API.cache import detail_cache_key
+from LMS_API.search import search_books
+from LMS_API.serializers import BooksSerializer, row_validator
+from LMS_API.testing import QueryBudgetMixin
+from LMS_API.views import (
+    authorReadAsync, authorReadDetailsAsync, booksReadAsync, booksReadDetailsAsync, borrowBookHistoryAsync,
+    borrowBookHistoryDetailsAsync, metricsExposition
+)
 
 
-class BookAPITestCase(TestCase):
+class BookAPITestCase(QueryBudgetMixin, TestCase):
     def setUp(self):
         self.client = APIClient()
+        cache.clear()
         self.headers = {
             'Content-Type': 'application/json',
         }
@@ -225,6 +253,17 @@ class BookAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
         url = reverse('api-book-borrow')
+        for borrower in [{"name": "Rafat", "mobile": "0" * 33}, {"name": "R" * 201, "mobile": "01704005054"}]:
+            data = {
+                "book_ids": [book_id],
+                "borrower": borrower,
+                "borrow_date": "2023-07-04",
+                "due_date": "2025-05-08"
+            }
+            response = self.client.post(url, data=data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Borrower.objects.exists())
+
         data = {
             "book_ids": [book_id],
             "borrower": {
@@ -302,3 +341,1113 @@ class BookAPITestCase(TestCase):
         }
         response = self.client.post(url, data=data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_borrow_book_partial_claim_rolls_back(self):
+        url = reverse('api-books-create')
+        book_ids = []
+        for title in ['First Book', 'Second Book']:
+            response = self.client.post(url, {
+                'title': title,
+                'publication_date': '2023-07-23',
+                'available': True
+            })
+            book_ids.append(response.data.get('data', {}).get('id'))
+
+        today = date.today()
+        url = reverse('api-book-borrow')
+        data = {
+            "book_ids": [book_ids[1]],
+            "borrower": {
+                "name": "Rafat",
+                "mobile": "01704005054"
+            },
+            "borrow_date": today.isoformat(),
+            "due_date": (today + timedelta(days=14)).isoformat()
+        }
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        data['book_ids'] = book_ids
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data.get('data', {}).get('unavailable_book_ids'), [book_ids[1]])
+        self.assertTrue(Books.objects.get(id=book_ids[0]).available)
+        self.assertEqual(BookLending.objects.count(), 1)
+
+        data['book_ids'] = [book_ids[0], 9999999]
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_return_books_in_bulk(self):
+        today = date.today()
+        lend_ids = []
+        for title in ['First Book', 'Second Book', 'Third Book']:
+            response = self.client.post(reverse('api-books-create'), {
+                'title': title,
+                'publication_date': '2023-07-23',
+                'available': True
+            })
+            book_id = response.data.get('data', {}).get('id')
+            response = self.client.post(reverse('api-book-borrow'), data={
+                "book_ids": [book_id],
+                "borrower": {
+                    "name": "Rafat",
+                    "mobile": "01704005054"
+                },
+                "borrow_date": today.isoformat(),
+                "due_date": (today + timedelta(days=14)).isoformat()
+            })
+            lend_ids.append(response.data.get('data', {}).get('id'))
+
+        url = reverse('api-book-return')
+        response = self.client.post(url, data={
+            "lend_ids": [lend_ids[0]],
+            "return_date": today.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url, data={
+            "lend_ids": lend_ids + [2342342],
+            "return_date": today.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        outcome = response.data.get('data', {})
+        self.assertEqual(outcome.get('returned'), lend_ids[1:])
+        self.assertEqual(outcome.get('already_returned'), lend_ids[:1])
+        self.assertEqual(outcome.get('not_found'), [2342342])
+        self.assertFalse(BookLending.objects.filter(book_returned=False).exists())
+        self.assertFalse(Books.objects.filter(available=False).exists())
+
+        response = self.client.post(url, data={
+            "lend_ids": lend_ids,
+            "return_date": today.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_return_copies_of_several_books_at_once(self):
+        popular = Books.objects.create(title='Popular Book', publication_date='2023-07-23', available=True, copies=2, available_count=2)
+        other = Books.objects.create(title='Other Book', publication_date='2023-07-23', available=True)
+        lend_ids = []
+        for book_ids in [[popular.id, other.id], [popular.id]]:
+            lending = BookLending.objects.create(borrower={'name': 'Rafat', 'mobile': '01704005054'}, borrow_date='2023-07-20', due_date='2023-07-27')
+            lending.book.add(*book_ids)
+            lend_ids.append(lending.id)
+        Books.objects.filter(id__in=[popular.id, other.id]).update(available=False, available_count=0)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('api-book-return'), {'lend_ids': lend_ids, 'return_date': '2023-07-21'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith(f'UPDATE {connection.ops.quote_name(Books._meta.db_table)}')]), 1)
+        self.assertEqual(dict(Books.objects.values_list('id', 'available_count')), {popular.id: 2, other.id: 1})
+        self.assertEqual(Books.objects.return_copies({}), 0)
+
+    def test_bulk_create_books_and_authors_from_ndjson(self):
+        lines = [
+            json.dumps({'title': 'First Book', 'publication_date': '2023-07-23', 'available': True}),
+            '',
+            json.dumps({'title': 'Second Book', 'publication_date': 'not-a-date', 'available': True}),
+            '{broken json',
+            json.dumps({'title': 'Third Book', 'publication_date': '2023-07-24', 'available': False}),
+        ]
+        url = reverse('api-books-bulk-create')
+        response = self.client.post(url, data='\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data.get('data'), {'created': 2, 'failed': 2})
+        self.assertEqual([error['line'] for error in response.data.get('errors')], [3, 4])
+        self.assertIn('publication_date', response.data.get('errors')[0]['errors'])
+        self.assertEqual(Books.objects.count(), 2)
+
+        url = reverse('api-author-bulk-create')
+        body = '\n'.join(json.dumps({'name': f'Author {i}'}) for i in range(5))
+        response = self.client.post(url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Authors.objects.count(), 5)
+
+        response = self.client.post(url, data='[]', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_row_validator_matches_the_serializer(self):
+        self.assertIsNotNone(row_validator(BooksSerializer))
+        rows = [
+            {'title': 'First Book', 'publication_date': '2023-07-23', 'available': 'true', 'copies': '3'},
+            {'title': 'Second Book', 'publication_date': '2023-07-23'},
+            {'title': '', 'publication_date': 'not-a-date', 'copies': -1},
+        ]
+        for row in rows:
+            try:
+                expected = BooksSerializer().run_validation(row)
+            except ValidationError as e:
+                with self.assertRaises(ValidationError) as raised:
+                    row_validator(BooksSerializer).run_validation(row)
+                self.assertEqual(raised.exception.detail, e.detail)
+            else:
+                self.assertEqual(row_validator(BooksSerializer).run_validation(row), expected)
+
+    def test_bulk_create_refuses_a_body_it_can_not_read(self):
+        url = reverse('api-author-bulk-create')
+        body = '\n'.join(json.dumps({'name': f'Author {i}'}) for i in range(2))
+        for data, extra in [('', {}), ('\n \n', {}), (body, {'CONTENT_LENGTH': '', 'HTTP_TRANSFER_ENCODING': 'chunked'})]:
+            response = self.client.post(url, data=data, content_type='application/x-ndjson', **extra)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Content-Length', response.data.get('message'))
+        self.assertFalse(Authors.objects.exists())
+
+    @override_settings(LMS_BULK_CREATE_CHUNK_SIZE=2)
+    def test_bulk_create_reports_the_lines_of_a_rejected_chunk(self):
+        insert_rows = views._insert_rows
+
+        def reject_second_chunk(model, rows):
+            if any(row['name'] == 'Author 2' for row in rows):
+                raise IntegrityError('rejected')
+            return insert_rows(model, rows)
+
+        body = '\n'.join(json.dumps({'name': f'Author {i}'}) for i in range(5))
+        with mock.patch.object(views, '_insert_rows', side_effect=reject_second_chunk):
+            response = self.client.post(reverse('api-author-bulk-create'), data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data.get('data'), {'created': 3, 'failed': 2})
+        self.assertEqual([(error['line'], error['last_line']) for error in response.data.get('errors')], [(3, 4)])
+        self.assertEqual(sorted(Authors.objects.values_list('name', flat=True)), ['Author 0', 'Author 1', 'Author 4'])
+
+    def test_export_books_and_lending_history(self):
+        for title in ['First Book', 'Second, Book']:
+            response = self.client.post(reverse('api-books-create'), {
+                'title': title,
+                'publication_date': '2023-07-23',
+                'available': True
+            })
+        book_id = response.data.get('data', {}).get('id')
+
+        response = self.client.get(reverse('api-books-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,publication_date,available,created_at,updated_at')
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"Second, Book"', lines[2])
+
+        today = date.today()
+        self.client.post(reverse('api-book-borrow'), data={
+            "book_ids": [book_id],
+            "borrower": {
+                "name": "Rafat",
+                "mobile": "01704005054"
+            },
+            "borrow_date": today.isoformat(),
+            "due_date": (today + timedelta(days=14)).isoformat()
+        })
+        url = reverse('api-book-borrow-export')
+        response = self.client.get(url, {'output': 'ndjson', 'borrow_date_from': today.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['book_ids'], [book_id])
+        self.assertEqual(rows[0]['borrower'], {"name": "Rafat", "mobile": "01704005054"})
+
+        response = self.client.get(url, {'output': 'ndjson', 'borrow_date_from': (today + timedelta(days=1)).isoformat()})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        response = self.client.get(url, {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_read_authors_with_cursor_pagination(self):
+        author_ids = [
+            Authors.objects.create(name=name).id
+            for name in ['Same Name', 'Another', 'Same Name', 'Same Name', 'Zed']
+        ]
+        url = reverse('api-author-read')
+        response = self.client.get(url, {'pagination': 'cursor', 'count': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('data', {}).get('count'), 5)
+        self.assertIsNone(response.data.get('data', {}).get('previous'))
+
+        pages = []
+        next_url = url + '?pagination=cursor&count=2'
+        while next_url:
+            response = self.client.get(next_url)
+            data = response.data.get('data', {})
+            pages.append([author['id'] for author in data.get('results')])
+            next_url = data.get('next')
+        seen = [author_id for page in pages for author_id in page]
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(sorted(seen), sorted(author_ids))
+        self.assertEqual(seen[0], author_ids[1])
+
+        response = self.client.get(data.get('previous'))
+        self.assertEqual([author['id'] for author in response.data.get('data', {}).get('results')], pages[-2])
+
+        response = self.client.get(url, {'pagination': 'cursor', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Well-formed cursors whose values do not fit the ordering or id fields
+        history_url = reverse('api-book-borrow-history')
+        for list_url, cursor in [
+            (history_url, {'v': 'not-a-date', 'i': 1, 'r': False}), (history_url, {'v': {}, 'i': 1, 'r': False}),
+            (url, {'v': 'Zed', 'i': 'one', 'r': False}), (url, {'v': None, 'i': 1, 'r': False})
+        ]:
+            encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+            response = self.client.get(list_url, {'pagination': 'cursor', 'cursor': encoded})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(LMS_PAGINATION_MAX_COUNT=2)
+    def test_read_books_count_is_capped(self):
+        for title in ['A', 'B', 'C']:
+            Books.objects.create(title=title, publication_date='2023-07-23', available=True)
+        response = self.client.get(reverse('api-books-read'), {'count': 100})
+        self.assertEqual(len(response.data.get('data', {}).get('results')), 2)
+
+    def test_read_books_count_modes(self):
+        for title in ['A', 'B']:
+            Books.objects.create(title=title, publication_date='2023-07-23', available=True)
+        url = reverse('api-books-read')
+        response = self.client.get(url)
+        self.assertEqual(response.data.get('data', {}).get('count_mode'), 'exact')
+
+        response = self.client.get(url, {'count_mode': 'cached'})
+        self.assertEqual(response.data.get('data', {}).get('count'), 2)
+        self.assertEqual(response.data.get('data', {}).get('count_mode'), 'cached')
+        self.client.post(reverse('api-books-create'), {
+            'title': 'C',
+            'publication_date': '2023-07-23',
+            'available': True
+        })
+        response = self.client.get(url, {'count_mode': 'cached', 'count': 2})
+        self.assertEqual(response.data.get('data', {}).get('count'), 3)
+        self.assertIsNotNone(response.data.get('data', {}).get('next'))
+        response = self.client.get(url, {'count_mode': 'cached', 'count': 2, 'page': 2})
+        self.assertEqual(len(response.data.get('data', {}).get('results')), 1)
+        self.assertIsNone(response.data.get('data', {}).get('next'))
+
+        response = self.client.get(url, {'count_mode': 'estimated', 'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(response.data.get('data', {}).get('count_mode'), ['estimated', 'cached'])
+
+        response = self.client.get(url, {'count_mode': 'guess'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_books_by_title_and_author(self):
+        hobbit = Books.objects.create(title='The Hobbit', publication_date='1937-09-21', available=True)
+        silmarillion = Books.objects.create(title='The Silmarillion', publication_date='1977-09-15', available=True)
+        Books.objects.create(title='Dune', publication_date='1965-08-01', available=True)
+        author = Authors.objects.create(name='J. R. R. Tolkien')
+        author.books.add(hobbit, silmarillion)
+
+        url = reverse('api-books-search')
+        response = self.client.get(url, {'q': 'hobbit'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get('data', {}).get('results')
+        self.assertEqual([book['id'] for book in results], [hobbit.id])
+        self.assertEqual(results[0]['authors'], ['J. R. R. Tolkien'])
+
+        response = self.client.get(url, {'q': 'tolkien', 'count': 1})
+        data = response.data.get('data', {})
+        self.assertEqual(data.get('count'), 2)
+        self.assertEqual(len(data.get('results')), 1)
+        self.assertIsNotNone(data.get('next'))
+
+        author.name = 'Ronald Tolkien'
+        author.save()
+        response = self.client.get(url, {'q': 'ronald'})
+        self.assertEqual(response.data.get('data', {}).get('count'), 2)
+
+        author.books.remove(hobbit)
+        response = self.client.get(url, {'q': 'ronald hobbit'})
+        self.assertEqual(response.data.get('data', {}).get('count'), 2)
+        response = self.client.get(url, {'q': 'ronald'})
+        self.assertEqual(response.data.get('data', {}).get('count'), 1)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_expansions_use_a_fixed_number_of_queries(self):
+        def add_books(count):
+            for i in range(count):
+                book = Books.objects.create(title=f'Book {i}', publication_date='2023-07-23', available=True)
+                Authors.objects.create(name=f'Author {i}').books.add(book)
+                lending = BookLending.objects.create(
+                    borrower={'name': 'Rafat', 'mobile': '01704005054'},
+                    borrow_date='2023-07-04',
+                    due_date='2023-08-04'
+                )
+                lending.book.add(book)
+
+        add_books(2)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api-books-read'), {'expand': 'authors'})
+        self.assertEqual(len(response.data.get('data', {}).get('results')[0]['authors']), 1)
+        add_books(4)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('api-books-read'), {'expand': 'authors'})
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api-book-borrow-history'), {'expand': 'books'})
+        self.assertEqual(len(response.data.get('data', {}).get('results')[0]['book']), 1)
+
+        book_id = Books.objects.first().id
+        with self.assertNumQueries(3):
+            self.client.get(reverse('api-books-read-details', args=[book_id]))
+
+    def test_detail_cache_is_invalidated_by_writes(self):
+        book = Books.objects.create(title='The Hobbit', publication_date='1937-09-21', available=True)
+        author = Authors.objects.create(name='Tolkien')
+        book_url = reverse('api-books-read-details', args=[book.id])
+        author_url = reverse('api-author-read-details', args=[author.id])
+        self.client.get(book_url)
+        self.client.get(author_url)
+        with self.assertNumQueries(0):
+            self.client.get(book_url)
+
+        self.client.post(reverse('api-author-book-add'), data={'author_id': author.id, 'book_id': book.id})
+        response = self.client.get(book_url)
+        self.assertEqual([a['name'] for a in response.data.get('data', {}).get('authors')], ['Tolkien'])
+        response = self.client.get(author_url)
+        self.assertEqual([b['id'] for b in response.data.get('data', {}).get('books')], [book.id])
+
+        self.client.patch(reverse('api-author-update', args=[author.id]), data={'name': 'J. R. R. Tolkien'})
+        response = self.client.get(book_url)
+        self.assertEqual([a['name'] for a in response.data.get('data', {}).get('authors')], ['J. R. R. Tolkien'])
+
+        today = date.today()
+        response = self.client.post(reverse('api-book-borrow'), data={
+            "book_ids": [book.id],
+            "borrower": {
+                "name": "Rafat",
+                "mobile": "01704005054"
+            },
+            "borrow_date": today.isoformat(),
+            "due_date": (today + timedelta(days=14)).isoformat()
+        })
+        lend_id = response.data.get('data', {}).get('id')
+        self.assertFalse(self.client.get(book_url).data.get('data', {}).get('available'))
+        self.assertFalse(self.client.get(author_url).data.get('data', {}).get('books')[0]['available'])
+        lend_url = reverse('api-book-borrow-history-details', args=[lend_id])
+        self.assertFalse(self.client.get(lend_url).data.get('data', {}).get('book_returned'))
+
+        self.client.post(reverse('api-book-return'), data={'lend_ids': [lend_id], 'return_date': today.isoformat()})
+        self.assertTrue(self.client.get(book_url).data.get('data', {}).get('available'))
+        self.assertTrue(self.client.get(lend_url).data.get('data', {}).get('book_returned'))
+
+        self.client.delete(reverse('api-books-delete', args=[book.id]))
+        self.assertEqual(self.client.get(author_url).data.get('data', {}).get('books'), [])
+        self.assertEqual(self.client.get(book_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get_on_detail_and_list(self):
+        book = Books.objects.create(title='The Hobbit', publication_date='1937-09-21', available=True)
+        url = reverse('api-books-read-details', args=[book.id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        author = Authors.objects.create(name='Tolkien')
+        author.books.add(book)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        list_url = reverse('api-books-read')
+        response = self.client.get(list_url)
+        etag = response['ETag']
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(list_url, {'count': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        Books.objects.create(title='Dune', publication_date='1965-08-01', available=True)
+        response = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_borrower_loans_by_id_and_mobile(self):
+        today = date.today()
+        lend_ids = []
+        for mobile in ['01704005054', '0170 400 5054', '01800000000']:
+            book = Books.objects.create(title='Test Book', publication_date='2023-07-23', available=True)
+            response = self.client.post(reverse('api-book-borrow'), data={
+                "book_ids": [book.id],
+                "borrower": {
+                    "name": "Rafat",
+                    "mobile": mobile
+                },
+                "borrow_date": today.isoformat(),
+                "due_date": (today + timedelta(days=14)).isoformat()
+            })
+            self.assertEqual(response.data.get('data', {}).get('borrower', {}).get('mobile'), mobile)
+            lend_ids.append(response.data.get('data', {}).get('id'))
+        self.assertEqual(Borrower.objects.count(), 2)
+        borrower = Borrower.objects.get(mobile='01704005054')
+
+        self.client.post(reverse('api-book-return'), data={'lend_id': lend_ids[0], 'return_date': today.isoformat()})
+
+        response = self.client.get(reverse('api-borrower-loans', args=[borrower.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('data', {}).get('count'), 2)
+        response = self.client.get(reverse('api-borrower-loans-by-mobile'), {'mobile': '0170 4005054', 'open': 'true'})
+        self.assertEqual([loan['id'] for loan in response.data.get('data', {}).get('results')], [lend_ids[1]])
+        self.assertEqual(response.data.get('data', {}).get('borrower', {}).get('id'), borrower.id)
+
+        response = self.client.get(reverse('api-borrower-loans', args=[987654]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('api-borrower-loans-by-mobile'), {'mobile': '000'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_overdue_loans_grouped_by_borrower(self):
+        today = date.today()
+        first = Books.objects.create(title='First Book', publication_date='2023-07-23', available=False)
+        second = Books.objects.create(title='Second Book', publication_date='2023-07-23', available=False)
+        for book, due_in, returned in [(first, -3, False), (second, -10, False), (second, -20, True), (first, 5, False)]:
+            lending = BookLending.objects.create(
+                borrower={'name': 'Rafat', 'mobile': '01704005054'},
+                borrow_date=today - timedelta(days=30),
+                due_date=today + timedelta(days=due_in),
+                book_returned=returned
+            )
+            lending.book.add(book)
+        BookLending.objects.create(
+            borrower={'name': 'Doe', 'mobile': '01800000000'},
+            borrow_date=today - timedelta(days=30),
+            due_date=today - timedelta(days=1)
+        ).book.add(first)
+
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('api-book-borrow-overdue'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get('data', {}).get('results')
+        self.assertEqual([group['borrower']['name'] for group in results], ['Doe', 'Rafat'])
+        rafat = results[1]
+        self.assertEqual(rafat['days_overdue'], 10)
+        self.assertEqual([loan['days_overdue'] for loan in rafat['loans']], [10, 3])
+        self.assertEqual(rafat['loans'][0]['books'], [{'id': second.id, 'title': 'Second Book'}])
+
+    def test_index_benchmark_keeps_the_indexes(self):
+        output = StringIO()
+        call_command('benchmark_indexes', books=40, authors=10, lendings=40, repeat=1, stdout=output)
+        self.assertEqual(Books.objects.count(), 40)
+        self.assertEqual(BookLending.objects.count(), 40)
+        self.assertIn('books, deep page', output.getvalue())
+        self.assertIn('without indexes', output.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Books._meta.db_table)
+        self.assertIn('lms_books_title_idx', constraints)
+
+    def test_async_read_views_match_the_sync_views(self):
+        author = Authors.objects.create(name='Rafat')
+        books = [Books.objects.create(title=f'Book {i}', publication_date='2023-07-23', available=True) for i in range(3)]
+        author.books.add(*books)
+        lending = BookLending.objects.create(
+            borrower={'name': 'Rafat', 'mobile': '01704005054'},
+            borrow_date=date.today(),
+            due_date=date.today() + timedelta(days=7)
+        )
+        lending.book.add(books[0])
+        factory = AsyncRequestFactory()
+        requests = [
+            (booksReadAsync, reverse('api-books-read'), {'count': 2, 'expand': 'authors'}, {}),
+            (booksReadAsync, reverse('api-books-read'), {'count': 2, 'pagination': 'cursor', 'count_mode': 'cached'}, {}),
+            (booksReadAsync, reverse('api-books-read'), {'page': 9}, {}),
+            (booksReadDetailsAsync, reverse('api-books-read-details', args=[books[0].id]), {}, {'book_id': books[0].id}),
+            (booksReadDetailsAsync, reverse('api-books-read-details', args=[0]), {}, {'book_id': 0}),
+            (authorReadAsync, reverse('api-author-read'), {}, {}),
+            (authorReadDetailsAsync, reverse('api-author-read-details', args=[author.id]), {}, {'author_id': author.id}),
+            (borrowBookHistoryAsync, reverse('api-book-borrow-history'), {'expand': 'books'}, {}),
+            (borrowBookHistoryDetailsAsync, reverse('api-book-borrow-history-details', args=[lending.id]), {}, {'lend_id': lending.id}),
+        ]
+        for view, url, params, kwargs in requests:
+            cache.clear()
+            expected = self.client.get(url, params)
+            cache.clear()
+            response = async_to_sync(view)(factory.get(url, params), **kwargs)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content), url)
+            self.assertEqual(response.get('ETag'), expected.get('ETag'), url)
+
+        url = reverse('api-books-read-details', args=[books[0].id])
+        etag = self.client.get(url)['ETag']
+        response = async_to_sync(booksReadDetailsAsync)(factory.get(url, headers={'If-None-Match': etag}), book_id=books[0].id)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The coroutines go through the async cache API; the blocking one is never called on the event loop
+        loop_calls = []
+
+        def off_the_loop(name, method):
+            def call(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    loop_calls.append(name)
+                except RuntimeError:
+                    pass
+                return method(*args, **kwargs)
+            return call
+
+        cache.clear()
+        blocking = {name: off_the_loop(name, getattr(cache, name)) for name in ['get', 'get_many', 'set', 'set_many']}
+        with mock.patch.multiple(cache, **blocking):
+            for view, url, params, kwargs in requests:
+                async_to_sync(view)(factory.get(url, params), **kwargs)
+        self.assertEqual(loop_calls, [])
+        self.assertIsNotNone(cache.get(detail_cache_key(Books, books[0].id)))
+
+    def test_seed_and_benchmark_every_route(self):
+        call_command('seed_library', books=60, authors=15, lendings=80, stdout=StringIO())
+        self.assertEqual(Books.objects.count(), 60)
+        self.assertEqual(BookLending.objects.count(), 80)
+        self.assertTrue(Borrower.objects.exists())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark_api', repeat=2, json_path=path, stdout=StringIO())
+            with open(path) as result_file:
+                report = json.load(result_file)
+        self.assertEqual(report['meta']['rows']['books'], 60)
+        self.assertEqual(set(report['routes']), {pattern.name for pattern in api_urls.urlpatterns})
+        for name, result in report['routes'].items():
+            self.assertNotIn('skipped', result, name)
+            self.assertTrue(all(int(code) < 500 for code in result['statuses']), name)
+            self.assertIsNotNone(result['queries'], name)
+        # Everything the write routes did was rolled back
+        self.assertEqual(Books.objects.count(), 60)
+
+    def test_routes_stay_within_their_query_budgets(self):
+        today = date.today()
+        authors = [Authors.objects.create(name=f'Author {i}') for i in range(4)]
+        books = [Books.objects.create(title=f'Budget Book {i}', publication_date='2023-07-23', available=True) for i in range(8)]
+        for i, book in enumerate(books):
+            book.authors_set.add(authors[i % 4], authors[(i + 1) % 4])
+        lendings = []
+        for i in range(3):
+            lending = BookLending.objects.create(
+                borrower={'name': f'Borrower {i}', 'mobile': f'0170000000{i}'},
+                borrow_date=today - timedelta(days=20),
+                due_date=today - timedelta(days=i + 1)
+            )
+            lending.book.add(books[2 * i], books[2 * i + 1])
+            lendings.append(lending)
+
+        for params in [{}, {'expand': 'authors'}, {'pagination': 'cursor'}, {'count_mode': 'cached'}]:
+            self.assertQueryBudget('get', 'api-books-read', data=params)
+        self.assertQueryBudget('get', 'api-books-search', data={'q': 'Budget'})
+        self.assertQueryBudget('get', 'api-books-read-details', args=[books[0].id])
+        self.assertQueryBudget('get', 'api-author-read')
+        self.assertQueryBudget('get', 'api-author-read-details', args=[authors[0].id])
+        self.assertQueryBudget('get', 'api-books-read-many', data={'ids': ','.join(str(book.id) for book in books)})
+        self.assertQueryBudget('get', 'api-author-read-many', data={'ids': ','.join(str(author.id) for author in authors)})
+        for params in [{}, {'expand': 'books'}]:
+            self.assertQueryBudget('get', 'api-book-borrow-history', data=params)
+        self.assertQueryBudget('get', 'api-book-borrow-history-details', args=[lendings[0].id])
+        self.assertQueryBudget('get', 'api-book-borrow-overdue')
+        self.assertQueryBudget('get', 'api-borrower-loans-by-mobile', data={'mobile': '01700000000'})
+        self.assertQueryBudget('get', 'api-borrower-loans', args=[lendings[0].borrower_profile_id])
+        self.assertQueryBudget('patch', 'api-books-update', args=[books[0].id], data={'title': 'Renamed'})
+        self.assertQueryBudget('patch', 'api-author-update', args=[authors[0].id], data={'name': 'Renamed'})
+        response = self.assertQueryBudget('post', 'api-book-borrow', data={
+            'book_ids': [book.id for book in books[6:]],
+            'borrower': {'name': 'Rafat', 'mobile': '01704005054'},
+            'borrow_date': str(today),
+            'due_date': str(today + timedelta(days=7)),
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.assertQueryBudget('post', 'api-book-return', data={'lend_id': response.data['data']['id'], 'return_date': str(today)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_server_timing_header_and_log_line(self):
+        Books.objects.create(title='Timed Book', publication_date='2023-07-23', available=True)
+        with self.modify_settings(MIDDLEWARE={'prepend': 'LMS_API.middleware.ServerTimingMiddleware'}):
+            with self.assertLogs('lms', level='INFO') as logs:
+                response = self.client.get(reverse('api-books-read'))
+        metrics = dict(metric.split(';')[0:2] for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(metrics), {'db', 'db-slowest', 'serialize', 'render', 'app', 'total'})
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['url_name'], 'api-books-read')
+        self.assertEqual(record['queries'], 3)
+        self.assertGreater(record['total_ms'], 0)
+
+    def test_profiling_samples_requests_and_reports_per_route(self):
+        Books.objects.create(title='Profiled Book', publication_date='2023-07-23', available=True)
+        with tempfile.TemporaryDirectory() as directory:
+            profiling = self.modify_settings(MIDDLEWARE={'prepend': 'LMS_API.middleware.ProfilingMiddleware'})
+            sampled = self.settings(
+                LMS_PROFILE_DIR=directory, LMS_PROFILE_FLUSH_EVERY=1,
+                LMS_PROFILE_SAMPLE_RATES={'api-books-read': 1.0},
+            )
+            with profiling, sampled:
+                self.client.get(reverse('api-books-read'))
+                self.client.get(reverse('api-author-read'))
+                self.client.get(reverse('api-author-read'), HTTP_X_LMS_PROFILE='forged:token')
+            self.assertEqual(os.listdir(directory), ['api-books-read'])
+
+            out = StringIO()
+            call_command('profile_report', '--token', stdout=out)
+            token = out.getvalue().split(': ', 1)[1].strip()
+            with profiling, sampled:
+                self.client.get(reverse('api-author-read'), HTTP_X_LMS_PROFILE=token)
+            self.assertEqual(sorted(os.listdir(directory)), ['api-author-read', 'api-books-read'])
+
+            out = StringIO()
+            call_command('profile_report', '--dir', directory, '--url-name', 'api-books-read', stdout=out)
+        report = out.getvalue()
+        self.assertIn('api-books-read: 1 requests from 1 processes', report)
+        self.assertIn('DRF serializers', report)
+        self.assertIn('Django ORM', report)
+        self.assertNotIn('api-author-read', report)
+
+    def test_profiling_under_asgi_profiles_the_sync_work(self):
+        Books.objects.create(title='Profiled Book', publication_date='2023-07-23', available=True)
+        with tempfile.TemporaryDirectory() as directory:
+            profiling = self.modify_settings(MIDDLEWARE={'prepend': 'LMS_API.middleware.ProfilingMiddleware'})
+            sampled = self.settings(
+                LMS_PROFILE_DIR=directory, LMS_PROFILE_FLUSH_EVERY=1,
+                LMS_PROFILE_SAMPLE_RATES={'api-books-read': 1.0},
+            )
+
+            async def get_books():
+                return await self.async_client.get(reverse('api-books-read'))
+
+            with profiling, sampled:
+                response = async_to_sync(get_books)()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(os.listdir(directory), ['api-books-read'])
+
+            out = StringIO()
+            call_command('profile_report', '--dir', directory, stdout=out)
+        report = out.getvalue()
+        self.assertIn('api-books-read: 1 requests from 1 processes', report)
+        self.assertIn('DRF serializers', report)
+        self.assertIn('Django ORM', report)
+
+    def test_metrics_endpoint_counts_requests_queries_and_loans(self):
+        book = Books.objects.create(title='Counted Book', publication_date='2023-07-23', available=True)
+        today = date.today()
+        before = metrics.collect()
+        middleware = ['LMS_API.middleware.MetricsMiddleware', 'LMS_API.middleware.ServerTimingMiddleware']
+        with self.modify_settings(MIDDLEWARE={'prepend': middleware}):
+            self.client.get(reverse('api-books-read'))
+            self.client.get(reverse('api-books-read-details', args=[book.id + 1]))
+            self.client.post(reverse('api-book-borrow'), {
+                'book_ids': [book.id],
+                'borrower': {'name': 'Rafat', 'mobile': '01704005054'},
+                'borrow_date': str(today),
+                'due_date': str(today + timedelta(days=14)),
+            }, format='json')
+        # /metrics is only routed with LMS_METRICS on, so the scrape calls the view itself
+        response = metricsExposition(RequestFactory().get('/metrics'))
+        after = metrics.collect()
+
+        def delta(name, *labels):
+            return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+        self.assertEqual(delta('lms_http_requests_total', 'api-books-read', 'GET', '200'), 1)
+        self.assertEqual(delta('lms_http_request_errors_total', 'api-books-read-details', 'GET', '404'), 1)
+        self.assertEqual(delta('lms_db_queries_total', 'api-books-read'), 3)
+        self.assertEqual(delta('lms_loans_opened_total'), 1)
+        self.assertEqual(delta('lms_books_borrowed_total'), 1)
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('# TYPE lms_http_request_duration_seconds histogram', text)
+        self.assertRegex(text, r'lms_http_request_duration_seconds_bucket\{url_name="api-books-read",method="GET",le="\+Inf"\} \d+')
+        self.assertRegex(text, r'lms_http_response_size_bytes_count\{url_name="api-books-read"\} \d+')
+        self.assertRegex(text, r'\nlms_loans_opened_total \d+')
+
+    def test_metrics_scrapes_are_restricted(self):
+        self.assertEqual('metrics' in {getattr(pattern, 'name', None) for pattern in project_urls.urlpatterns}, settings.LMS_METRICS)
+        factory = RequestFactory()
+        self.assertEqual(metricsExposition(factory.get('/metrics')).status_code, status.HTTP_200_OK)
+        self.assertEqual(metricsExposition(factory.get('/metrics', REMOTE_ADDR='10.1.2.3')).status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(LMS_METRICS_ALLOWED_IPS=['10.0.0.0/8'], LMS_METRICS_TOKEN='secret'):
+            self.assertEqual(metricsExposition(factory.get('/metrics', REMOTE_ADDR='10.1.2.3')).status_code, status.HTTP_200_OK)
+            self.assertEqual(metricsExposition(factory.get('/metrics')).status_code, status.HTTP_403_FORBIDDEN)
+            scrape = factory.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(metricsExposition(scrape).status_code, status.HTTP_200_OK)
+            scrape = factory.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(metricsExposition(scrape).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_of_exited_threads_are_kept_without_their_shards(self):
+        before = metrics.snapshot().get(('lms_loans_opened_total', ()), 0)
+        threads = [threading.Thread(target=metrics.LOANS_OPENED.inc, kwargs={'amount': 2}) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.snapshot()[('lms_loans_opened_total', ())], before + 40)
+        self.assertFalse(any(shard for shard in metrics._shards if shard.get(('lms_loans_opened_total', ())) == 2))
+
+    def test_metrics_are_summed_across_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(LMS_METRICS_DIR=directory):
+            durations = [1] + [0] * len(metrics.REQUEST_DURATION.buckets) + [0.004]
+            with open(os.path.join(directory, 'other-worker.json'), 'w') as other:
+                json.dump([
+                    ['lms_loans_opened_total', [], 5],
+                    ['lms_http_request_duration_seconds', ['api-books-read', 'GET'], durations],
+                ], other)
+            metrics.LOANS_OPENED.inc()
+            metrics.write_process_file()
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            own = metrics.snapshot()
+            combined = metrics.collect()
+        self.assertEqual(combined[('lms_loans_opened_total', ())], own[('lms_loans_opened_total', ())] + 5)
+        key = ('lms_http_request_duration_seconds', ('api-books-read', 'GET'))
+        own_durations = own.get(key, [0] * len(durations))
+        self.assertEqual(combined[key][0], own_durations[0] + 1)
+        self.assertAlmostEqual(combined[key][-1], own_durations[-1] + 0.004)
+
+    def test_fast_serialization_returns_the_same_bytes(self):
+        books = [
+            Books.objects.create(title=title, publication_date='2023-07-23', available=index % 2 == 0)
+            for index, title in enumerate(['Plain', 'Ünïcode – “quotes” 😀', 'Line\u2028separator', 'Tab\tand "quotes"'])
+        ]
+        author = Authors.objects.create(name='Bânglà')
+        author.books.add(*books)
+        BookLending.objects.create(
+            borrower={'name': 'Rafat', 'mobile': '01704005054'}, borrow_date='2023-07-01', due_date='2023-07-08'
+        )
+        BookLending.objects.create(
+            borrower={'name': 'Doe', 'mobile': '01704005055', 'fine': 1e-05, 'tags': ['a', None]},
+            borrow_date='2023-07-02', due_date='2023-07-09', book_returned=True, return_date='2023-07-05'
+        )
+        requests = [
+            ('api-books-read', {}), ('api-books-read', {'count': 2, 'page': 2}),
+            ('api-books-read', {'pagination': 'cursor', 'count': 3}), ('api-books-read', {'expand': 'authors'}),
+            ('api-author-read', {}), ('api-book-borrow-history', {}),
+            ('api-book-borrow-history', {'pagination': 'cursor', 'count': 1}),
+            ('api-books-read-details', {}), ('api-books-read', {'count_mode': 'wrong'}),
+        ]
+        for url_name, params in requests:
+            args = [books[1].id] if url_name == 'api-books-read-details' else None
+            bodies = []
+            for fast in (False, True):
+                cache.clear()
+                with self.settings(LMS_FAST_SERIALIZATION=fast):
+                    bodies.append(self.client.get(reverse(url_name, args=args), params).content)
+            self.assertEqual(bodies[0], bodies[1], (url_name, params))
+
+        out = StringIO()
+        call_command('benchmark_serialization', '--count', '2', '--pages', '2', '--repeat', '1', stdout=out)
+        self.assertIn('api-book-borrow-history', out.getvalue())
+
+    def test_read_many_keeps_the_requested_order_and_reports_missing_ids(self):
+        authors = [Authors.objects.create(name=f'Shelf Author {i}') for i in range(2)]
+        books = [Books.objects.create(title=f'Shelf Book {i}', publication_date='2023-07-23', available=True) for i in range(3)]
+        books[0].authors_set.add(authors[0])
+        books[2].authors_set.add(authors[0], authors[1])
+        missing_id = books[-1].id + 100
+        ids = f'{books[2].id},{missing_id},{books[0].id},{books[2].id}'
+
+        response = self.client.get(reverse('api-books-read-many'), {'ids': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual([book['id'] for book in data['results']], [books[2].id, books[0].id])
+        self.assertEqual(data['missing_ids'], [missing_id])
+        detail = self.client.get(reverse('api-books-read-details', args=[books[2].id])).data['data']
+        self.assertEqual(data['results'][0], detail)
+
+        # Every detail now comes from the cache
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('api-books-read-many'), {'ids': f'{books[0].id},{books[2].id}'})
+        self.assertEqual([book['id'] for book in cached.data['data']['results']], [books[0].id, books[2].id])
+
+        response = self.client.get(reverse('api-author-read-many'), {'ids': [authors[1].id, authors[0].id]})
+        self.assertEqual([author['id'] for author in response.data['data']['results']], [authors[1].id, authors[0].id])
+        self.assertEqual([book['id'] for book in response.data['data']['results'][0]['books']], [books[2].id])
+
+        for params in [{}, {'ids': '1,two'}, {'ids': ','.join(map(str, range(1, 5)))}]:
+            with self.settings(LMS_READ_MANY_MAX_IDS=3):
+                response = self.client.get(reverse('api-books-read-many'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_author_book_registration_in_batches(self):
+        book = Books.objects.create(title='Anthology', publication_date='2023-07-23', available=True)
+        other_book = Books.objects.create(title='Sequel', publication_date='2023-07-23', available=True)
+        authors = [Authors.objects.create(name=f'Contributor {i}') for i in range(40)]
+        authors[0].books.add(book)
+        book_url = reverse('api-books-read-details', args=[book.id])
+        self.client.get(book_url)
+
+        response = self.assertQueryBudget('post', 'api-author-book-add', data={
+            'book_id': book.id, 'author_ids': [author.id for author in authors]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['data']['registered']), 39)
+        self.assertEqual(response.data['data']['already_registered'], [{'author_id': authors[0].id, 'book_id': book.id}])
+        self.assertEqual(book.authors_set.count(), 40)
+        # The cached detail was evicted although no m2m_changed was sent
+        self.assertEqual(len(self.client.get(book_url).data['data']['authors']), 40)
+
+        response = self.client.post(reverse('api-author-book-add'), data={'pairs': [
+            {'author_id': authors[1].id, 'book_id': other_book.id}, {'author_id': authors[1].id, 'book_id': book.id},
+        ]}, format='json')
+        self.assertEqual(len(response.data['data']['registered']), 1)
+        self.assertEqual(len(response.data['data']['already_registered']), 1)
+
+        response = self.assertQueryBudget('post', 'api-author-book-remove', data={
+            'author_id': authors[1].id, 'book_ids': [book.id, other_book.id]
+        }, format='json')
+        self.assertEqual(len(response.data['data']['unregistered']), 2)
+        self.assertEqual(list(authors[1].books.all()), [])
+        response = self.client.post(reverse('api-author-book-remove'), data={
+            'author_id': authors[1].id, 'book_id': book.id
+        }, format='json')
+        self.assertEqual(response.data['message'], 'This Book has not been registered to author.')
+
+        for payload in [
+            {'author_id': authors[0].id, 'book_ids': [book.id, other_book.id + 100]},
+            {'author_ids': [authors[0].id], 'book_ids': [book.id]},
+            {'author_id': authors[0].id},
+            {'pairs': [{'author_id': authors[0].id, 'book_id': book.id}], 'author_id': authors[0].id},
+        ]:
+            response = self.client.post(reverse('api-author-book-add'), data=payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, payload)
+        self.assertEqual(book.authors_set.count(), 39)
+
+    def test_withdrawn_book_can_lose_copies(self):
+        book = Books.objects.create(title='Popular Book', publication_date='2023-07-23', available=True, copies=3, available_count=3)
+        url = reverse('api-books-update', args=[book.id])
+        response = self.client.patch(url, {'available': False}, format='json')
+        self.assertEqual((response.data['data']['available'], response.data['data']['available_count']), (False, 0))
+
+        response = self.client.patch(url, {'copies': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            (response.data['data']['copies'], response.data['data']['available_count'], response.data['data']['available']),
+            (2, 0, False)
+        )
+        response = self.client.patch(url, {'available': True}, format='json')
+        self.assertEqual((response.data['data']['available'], response.data['data']['available_count']), (True, 2))
+
+        # Shrinking a shelf with a copy on loan leaves the copy on loan out of it
+        lending = BookLending.objects.create(borrower={'name': 'Rafat', 'mobile': '01704005054'}, borrow_date='2023-07-20', due_date='2023-07-27')
+        lending.book.add(book)
+        Books.objects.filter(id=book.id).borrow_copy()
+        response = self.client.patch(url, {'copies': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(url, {'copies': 1}, format='json')
+        self.assertEqual((response.data['data']['copies'], response.data['data']['available_count']), (1, 0))
+
+    def test_books_with_several_copies(self):
+        response = self.client.post(reverse('api-books-create'), {
+            'title': 'Popular Book',
+            'publication_date': '2023-07-23',
+            'copies': 2
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        book_id = response.data.get('data', {}).get('id')
+        self.assertEqual((response.data['data']['copies'], response.data['data']['available_count']), (2, 2))
+
+        today = date.today()
+        data = {
+            'book_ids': [book_id],
+            'borrower': {'name': 'Rafat', 'mobile': '01704005054'},
+            'borrow_date': today.isoformat(),
+            'due_date': (today + timedelta(days=14)).isoformat()
+        }
+        lend_ids = [self.client.post(reverse('api-book-borrow'), data, format='json').data['data']['id'] for _ in range(2)]
+        self.assertEqual(Books.objects.filter(id=book_id).values_list('available', 'available_count').get(), (False, 0))
+        response = self.client.post(reverse('api-book-borrow'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data.get('data', {}).get('unavailable_book_ids'), [book_id])
+
+        url = reverse('api-books-update', args=[book_id])
+        response = self.client.patch(url, {'title': 'Renamed', 'copies': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Books.objects.get(id=book_id).title, 'Popular Book')
+        response = self.client.patch(url, {'copies': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['data']['copies'], response.data['data']['available_count']), (5, 3))
+        self.assertTrue(response.data['data']['available'])
+
+        # available withdraws the copies on the shelf, and puts back the ones not on loan
+        response = self.client.patch(url, {'available': False}, format='json')
+        self.assertEqual((response.data['data']['available'], response.data['data']['available_count']), (False, 0))
+        response = self.client.patch(url, {'available': True}, format='json')
+        self.assertEqual((response.data['data']['available'], response.data['data']['available_count']), (True, 3))
+
+        response = self.client.post(reverse('api-book-return'), {'lend_ids': lend_ids, 'return_date': today.isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Books.objects.filter(id=book_id).values_list('copies', 'available_count').get(), (5, 5))
+
+    def test_author_names_follow_registrations_and_renames(self):
+        book = Books.objects.create(title='Good Omens', publication_date='1990-05-01', available=True)
+        other_book = Books.objects.create(title='Mort', publication_date='1987-11-12', available=True)
+        pratchett = Authors.objects.create(name='Terry Pratchett')
+        gaiman = Authors.objects.create(name='Neil Gaiman')
+        pratchett.books.add(book, other_book)
+        book.authors_set.add(gaiman)
+
+        def author_names():
+            return dict(Books.objects.values_list('id', 'author_names'))
+
+        self.assertEqual(author_names(), {book.id: ['Terry Pratchett', 'Neil Gaiman'], other_book.id: ['Terry Pratchett']})
+        response = self.client.get(reverse('api-books-read'))
+        self.assertEqual(
+            [(row['title'], row['author_names']) for row in response.data['data']['results']],
+            [('Good Omens', ['Terry Pratchett', 'Neil Gaiman']), ('Mort', ['Terry Pratchett'])]
+        )
+        response = self.client.get(reverse('api-books-search'), {'q': 'gaiman'})
+        self.assertEqual(response.data['data']['results'][0]['authors'], ['Terry Pratchett', 'Neil Gaiman'])
+
+        # The name change reaches the book shared with another author, and its cached detail
+        author_url = reverse('api-author-read-details', args=[gaiman.id])
+        self.client.get(author_url)
+        self.client.patch(reverse('api-author-update', args=[pratchett.id]), {'name': 'Sir Terry Pratchett'}, format='json')
+        self.assertEqual(author_names()[book.id], ['Sir Terry Pratchett', 'Neil Gaiman'])
+        self.assertEqual(self.client.get(author_url).data['data']['books'][0]['author_names'], ['Sir Terry Pratchett', 'Neil Gaiman'])
+
+        self.client.post(reverse('api-author-book-remove'), {'author_id': pratchett.id, 'book_id': book.id}, format='json')
+        self.assertEqual(author_names()[book.id], ['Neil Gaiman'])
+        self.client.post(reverse('api-author-book-add'), {'book_id': book.id, 'author_ids': [pratchett.id]}, format='json')
+        self.assertEqual(author_names()[book.id], ['Neil Gaiman', 'Sir Terry Pratchett'])
+        pratchett.books.clear()
+        self.assertEqual(author_names(), {book.id: ['Neil Gaiman'], other_book.id: []})
+        gaiman.delete()
+        self.assertEqual(author_names()[book.id], [])
+
+        book.authors_set.add(pratchett)
+        Books.objects.filter(id=book.id).update(author_names=['Somebody Else'])
+        with self.assertRaisesMessage(CommandError, f'2 books checked, 1 with stale author names: {book.id}'):
+            call_command('check_author_names', batch_size=1, stdout=StringIO())
+        out = StringIO()
+        call_command('check_author_names', fix=True, stdout=out)
+        self.assertIn('1 with stale author names', out.getvalue())
+        self.assertEqual(author_names()[book.id], ['Sir Terry Pratchett'])
+        call_command('check_author_names', stdout=StringIO())
+
+    def test_read_views_use_replicas_and_writers_read_their_writes(self):
+        with override_settings(LMS_DATABASE_REPLICAS=['replica_1', 'replica_2']):
+            router = replicas.ReplicaRouter()
+            self.assertIsNone(router.db_for_read(Books))
+            self.assertEqual(router.db_for_write(Books), 'default')
+            self.assertFalse(router.allow_migrate('replica_1', 'LMS_Core'))
+            self.assertIsNone(router.allow_migrate('default', 'LMS_Core'))
+            self.assertEqual({replicas.next_replica() for _ in range(4)}, {'replica_1', 'replica_2'})
+
+        reads = []
+
+        class RecordingRouter(replicas.ReplicaRouter):
+            def db_for_read(self, model, **hints):
+                alias = super().db_for_read(model, **hints)
+                reads.append(alias)
+                return alias
+
+        book = Books.objects.create(title='The Hobbit', publication_date='1937-09-21', available=True)
+        today = date.today()
+        # default stands in for the replica, so the queries run; what is checked is where the router sends them
+        with override_settings(
+            LMS_DATABASE_REPLICAS=['default'],
+            DATABASE_ROUTERS=[RecordingRouter()],
+            MIDDLEWARE=settings.MIDDLEWARE + ['LMS_API.middleware.ReplicaStickinessMiddleware']
+        ):
+            self.assertEqual(self.client.get(reverse('api-books-read')).status_code, status.HTTP_200_OK)
+            self.assertTrue(reads)
+            self.assertEqual(set(reads), {'default'})
+
+            reads.clear()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('api-book-borrow'), {
+                    'book_ids': [book.id],
+                    'borrower': {'name': 'Rafat', 'mobile': '01704005054'},
+                    'borrow_date': today.isoformat(),
+                    'due_date': (today + timedelta(days=14)).isoformat()
+                }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(set(reads), {None})
+            self.assertEqual(response.cookies[replicas.STICKY_COOKIE]['max-age'], settings.LMS_REPLICA_STICKY_SECONDS)
+
+            reads.clear()
+            response = self.client.get(reverse('api-books-read-details', args=[book.id]))
+            self.assertFalse(response.data.get('data', {}).get('available'))
+            self.assertEqual(set(reads), {None})
+
+            # Once the window is over, reads go back to the replica; they do not refill the cache
+            # with what a lagging replica could still hold from before the write
+            del self.client.cookies[replicas.STICKY_COOKIE]
+            cache.delete(detail_cache_key(Books, book.id))
+            reads.clear()
+            self.assertEqual(self.client.get(reverse('api-books-read-details', args=[book.id])).status_code, status.HTTP_200_OK)
+            self.assertEqual(set(reads), {'default'})
+            self.assertIsNone(cache.get(detail_cache_key(Books, book.id)))
+
+            reads.clear()
+            response = self.client.get(reverse('api-books-export'))
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+            self.assertEqual(set(reads), {'default'})
+
+            reads.clear()
+            with mock.patch('LMS_API.views.search_books', wraps=search_books) as search:
+                response = self.client.get(reverse('api-books-search'), {'q': 'hobbit'})
+            self.assertEqual(response.data['data']['count'], 1)
+            self.assertEqual(search.call_args.kwargs['using'], 'default')
+            self.assertEqual(set(reads), {'default'})
+
+
+class InventoryConcurrencyTestCase(TransactionTestCase):
+    """
+    Borrowers racing for the copies of one popular title over their own database
+    connections, so only the conditional updates keep the counters right
+    """
+
+    def test_concurrent_checkouts_never_oversell_or_drift(self):
+        if connection.vendor == 'sqlite':
+            if connection.is_in_memory_db():
+                self.skipTest('Threads can not wait for each other on a shared in-memory SQLite database')
+            # SQLite has no row locks; a transaction that read before writing fails at once when another
+            # writer went first, so transactions take the write lock up front and queue on it instead
+            begin_immediate = mock.patch.object(
+                type(connections['default']), '_start_transaction_under_autocommit',
+                lambda wrapper: wrapper.cursor().execute('BEGIN IMMEDIATE')
+            )
+            begin_immediate.start()
+            self.addCleanup(begin_immediate.stop)
+        copies, workers, rounds = 3, 8, 12
+        book = Books.objects.create(
+            title='Popular Book', publication_date='2023-07-23', available=True, copies=copies, available_count=copies
+        )
+        today = date.today()
+        start = threading.Barrier(workers)
+        outcomes = Counter()
+        lent_counts = []
+        failures = []
+
+        def borrow_and_return(worker: int):
+            client = APIClient()
+            data = {
+                'book_ids': [book.id],
+                'borrower': {'name': f'Borrower {worker}', 'mobile': f'0170000{worker:04d}'},
+                'borrow_date': today.isoformat(),
+                'due_date': (today + timedelta(days=14)).isoformat()
+            }
+            try:
+                start.wait()
+                for _ in range(rounds):
+                    response = client.post(reverse('api-book-borrow'), data, format='json')
+                    outcomes[response.status_code] += 1
+                    if response.status_code != status.HTTP_200_OK:
+                        continue
+                    lent_counts.append(BookLending.objects.filter(book=book, book_returned=False).count())
+                    response = client.post(reverse('api-book-return'), {
+                        'lend_id': response.data['data']['id'],
+                        'return_date': today.isoformat()
+                    }, format='json')
+                    outcomes['returned' if response.status_code == status.HTTP_200_OK else response.status_code] += 1
+            except Exception as exception:
+                failures.append(exception)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=borrow_and_return, args=(worker,)) for worker in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        self.assertLessEqual(set(outcomes), {status.HTTP_200_OK, status.HTTP_409_CONFLICT, 'returned'})
+        self.assertEqual(outcomes[status.HTTP_200_OK] + outcomes[status.HTTP_409_CONFLICT], workers * rounds)
+        self.assertEqual(outcomes['returned'], outcomes[status.HTTP_200_OK])
+        self.assertTrue(lent_counts)
+        self.assertLessEqual(max(lent_counts), copies)
+        book.refresh_from_db()
+        self.assertEqual((book.copies, book.available_count, book.available), (copies, copies, True))
+        self.assertEqual(BookLending.objects.filter(book_returned=False).count(), 0)
@@ -1,16 +1,32 @@
+from django.conf import settings
 from django.urls import path, include
 from .views import *
 
+
+def read_view(sync_view, async_view):
+    """
+    :return: the async variant of a read endpoint when LMS_ASYNC_READ_VIEWS is on (ASGI), else the sync one
+    """
+    return async_view if settings.LMS_ASYNC_READ_VIEWS else sync_view
+
+
 urlpatterns = [
     path('v1/book/create', booksCreate, name='api-books-create'),
-    path('v1/book/read', booksRead, name='api-books-read'),
-    path('v1/book/read/<int:book_id>', booksReadDetails, name='api-books-read-details'),
+    path('v1/book/bulk-create', booksBulkCreate, name='api-books-bulk-create'),
+    path('v1/book/read', read_view(booksRead, booksReadAsync), name='api-books-read'),
+    path('v1/book/search', booksSearch, name='api-books-search'),
+    path('v1/book/export', booksExport, name='api-books-export'),
+    path('v1/book/read-many', booksReadMany, name='api-books-read-many'),
+    path('v1/book/read/<int:book_id>', read_view(booksReadDetails, booksReadDetailsAsync), name='api-books-read-details'),
     path('v1/book/update/<int:book_id>', booksUpdate, name='api-books-update'),
     path('v1/book/delete/<int:book_id>', booksDelete, name='api-books-delete'),
 
     path('v1/author/create', authorCreate, name='api-author-create'),
-    path('v1/author/read', authorRead, name='api-author-read'),
-    path('v1/author/read/<int:author_id>', authorReadDetails, name='api-author-read-details'),
+    path('v1/author/bulk-create', authorBulkCreate, name='api-author-bulk-create'),
+    path('v1/author/read', read_view(authorRead, authorReadAsync), name='api-author-read'),
+    path('v1/author/export', authorExport, name='api-author-export'),
+    path('v1/author/read-many', authorReadMany, name='api-author-read-many'),
+    path('v1/author/read/<int:author_id>', read_view(authorReadDetails, authorReadDetailsAsync), name='api-author-read-details'),
     path('v1/author/update/<int:author_id>', authorUpdate, name='api-author-update'),
     path('v1/author/delete/<int:author_id>', authorDelete, name='api-author-delete'),
 
@@ -18,7 +34,12 @@ urlpatterns = [
     path('v1/author/books/unregister', authorBookRemove, name='api-author-book-remove'),
 
     path('v1/borrow-book', borrowBook, name='api-book-borrow'),
-    path('v1/borrow-book/history', borrowBookHistory, name='api-book-borrow-history'),
-    path('v1/borrow-book/history/<int:lend_id>', borrowBookHistoryDetails, name='api-book-borrow-history-details'),
+    path('v1/borrow-book/history', read_view(borrowBookHistory, borrowBookHistoryAsync), name='api-book-borrow-history'),
+    path('v1/borrow-book/overdue', borrowBookOverdue, name='api-book-borrow-overdue'),
+    path('v1/borrow-book/export', borrowBookExport, name='api-book-borrow-export'),
+    path('v1/borrow-book/history/<int:lend_id>', read_view(borrowBookHistoryDetails, borrowBookHistoryDetailsAsync), name='api-book-borrow-history-details'),
     path('v1/return-book', returnBook, name='api-book-return'),
+
+    path('v1/borrower/loans', borrowerLoansByMobile, name='api-borrower-loans-by-mobile'),
+    path('v1/borrower/<int:borrower_id>/loans', borrowerLoans, name='api-borrower-loans'),
 ]
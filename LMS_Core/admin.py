@@ -3,17 +3,36 @@ from .models import *
 
 
 class BooksAdmin(admin.ModelAdmin):
-    list_display = ['title', 'publication_date', 'available']
+    list_display = ['title', 'publication_date', 'available', 'copies', 'available_count']
+    readonly_fields = ['author_names']
 
 
 class AuthorsAdmin(admin.ModelAdmin):
     list_display = ['name']
 
 
+class BorrowerAdmin(admin.ModelAdmin):
+    list_display = ['name', 'mobile']
+    search_fields = ['mobile']
+
+
 class BookLendingAdmin(admin.ModelAdmin):
     list_display = ['borrower', 'borrow_date', 'due_date', 'book_returned', 'return_date']
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'run_at', 'attempts', 'locked_by', 'finished_at']
+    list_filter = ['status']
+    search_fields = ['task']
+
+
+class PeriodicScheduleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'task', 'interval_seconds', 'next_run_at', 'enabled']
+
+
 admin.site.register(Books, BooksAdmin)
 admin.site.register(Authors, AuthorsAdmin)
+admin.site.register(Borrower, BorrowerAdmin)
 admin.site.register(BookLending, BookLendingAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(PeriodicSchedule, PeriodicScheduleAdmin)
@@ -0,0 +1,194 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, PeriodicSchedule
+
+logger = logging.getLogger('lms')
+
+# Task name -> function, filled by @task; apps declare their tasks in a tasks module,
+# which the worker imports at start
+TASKS = {}
+
+
+def task(name: str):
+    """
+    Register a function as the task of that name; it is called with the job's payload as keyword arguments
+    :param name: e.g. lms.purge_jobs
+    """
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(task_name: str, payload: dict = None, delay: float = 0, run_at=None, max_attempts: int = None) -> Job:
+    """
+    Queue a task. Inside a transaction the job only becomes visible to the
+    workers if the transaction commits, along with the rows it works on.
+    :param task_name: name the task was registered under
+    :param payload: JSON keyword arguments of the task
+    :param delay: seconds to wait before running it
+    :param run_at: when to run it, instead of a delay
+    :param max_attempts: runs before the job is given up, defaults to LMS_JOB_MAX_ATTEMPTS
+    :return: the queued Job
+    """
+    return Job.objects.create(
+        task=task_name,
+        payload=payload or {},
+        run_at=run_at or timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.LMS_JOB_MAX_ATTEMPTS
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    :param attempts: runs so far
+    :return: seconds before the next run: LMS_JOB_RETRY_BACKOFF doubled on every further
+        attempt, at most LMS_JOB_MAX_BACKOFF, with some jitter so failed jobs do not retry in step
+    """
+    delay = min(settings.LMS_JOB_RETRY_BACKOFF * 2 ** max(attempts - 1, 0), settings.LMS_JOB_MAX_BACKOFF)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(worker: str, limit: int) -> list:
+    """
+    Take up to limit due jobs for a worker. Where the database can, the jobs are
+    picked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers pass over
+    each other's rows instead of waiting on them. SQLite has no row locks: there
+    the conditional UPDATE decides which worker gets a job.
+    :param worker: name of the worker
+    :param limit:
+    :return: the claimed jobs, in run_at order
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.Status.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        job_ids = list(due.values_list('id', flat=True)[:limit])
+        if not job_ids:
+            return []
+        Job.objects.filter(id__in=job_ids, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now
+        )
+    return list(
+        Job.objects.filter(id__in=job_ids, status=Job.Status.RUNNING, locked_by=worker, locked_at=now).order_by('run_at', 'id')
+    )
+
+
+def run(job: Job) -> bool:
+    """
+    Run a claimed job and record the outcome: succeeded, queued again after retry_delay(),
+    or failed once it has had max_attempts runs
+    :param job: Job returned by claim()
+    :return: whether the task succeeded
+    """
+    func = TASKS.get(job.task)
+    error = ''
+    try:
+        if func is None:
+            raise LookupError(f'No task is registered as {job.task}')
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Job %s (%s) failed on attempt %s of %s', job.id, job.task, job.attempts, job.max_attempts)
+
+    now = timezone.now()
+    if not error:
+        outcome = {'status': Job.Status.SUCCEEDED, 'finished_at': now, 'last_error': ''}
+    elif job.attempts < job.max_attempts and func is not None:
+        outcome = {'status': Job.Status.QUEUED, 'run_at': now + timedelta(seconds=retry_delay(job.attempts)), 'last_error': error}
+    else:
+        outcome = {'status': Job.Status.FAILED, 'finished_at': now, 'last_error': error}
+    # A job taken back by requeue_stale() in the meantime belongs to someone else now
+    Job.objects.filter(id=job.id, status=Job.Status.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at).update(
+        locked_by='', locked_at=None, updated_at=now, **outcome
+    )
+    return not error
+
+
+def requeue_stale(timeout: float = None) -> int:
+    """
+    Queue again the jobs still running after timeout seconds, whose worker most likely
+    died; the lost run counts as an attempt
+    :param timeout: defaults to LMS_JOB_TIMEOUT
+    :return: number of jobs queued again or, out of attempts, failed
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.Status.RUNNING,
+        locked_at__lt=now - timedelta(seconds=timeout or settings.LMS_JOB_TIMEOUT)
+    )
+    lost = 'Lost: the worker running the job stopped or timed out'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED, finished_at=now, locked_by='', locked_at=None, last_error=lost, updated_at=now
+    )
+    return failed + stale.update(
+        status=Job.Status.QUEUED, run_at=now, locked_by='', locked_at=None, last_error=lost, updated_at=now
+    )
+
+
+def sync_schedules() -> None:
+    """
+    Bring the PeriodicSchedule rows in line with LMS_PERIODIC_JOBS,
+    {name: {'task': ..., 'every': seconds, 'payload': {...}}}; schedules no
+    longer listed are disabled. A changed schedule keeps its next run.
+    """
+    now = timezone.now()
+    for name, spec in settings.LMS_PERIODIC_JOBS.items():
+        values = {'task': spec['task'], 'payload': spec.get('payload', {}), 'interval_seconds': spec['every'], 'enabled': True}
+        schedule, created = PeriodicSchedule.objects.get_or_create(name=name, defaults={**values, 'next_run_at': now})
+        if not created and any(getattr(schedule, field) != value for field, value in values.items()):
+            PeriodicSchedule.objects.filter(id=schedule.id).update(updated_at=now, **values)
+    PeriodicSchedule.objects.filter(enabled=True).exclude(name__in=list(settings.LMS_PERIODIC_JOBS)).update(
+        enabled=False, updated_at=now
+    )
+
+
+def enqueue_due_schedules() -> int:
+    """
+    Queue a job for every schedule whose time has come. The worker that moves
+    next_run_at on is the one that queues the job, so several workers never queue
+    the same run; runs missed while no worker was up are not made up for.
+    :return: number of jobs queued
+    """
+    now = timezone.now()
+    queued = 0
+    for schedule in PeriodicSchedule.objects.filter(enabled=True, next_run_at__lte=now):
+        interval = timedelta(seconds=max(schedule.interval_seconds, 1))
+        next_run_at = schedule.next_run_at + ((now - schedule.next_run_at) // interval + 1) * interval
+        with transaction.atomic():
+            moved = PeriodicSchedule.objects.filter(id=schedule.id, next_run_at=schedule.next_run_at).update(
+                next_run_at=next_run_at, last_enqueued_at=now, updated_at=now
+            )
+            if moved:
+                enqueue(schedule.task, schedule.payload)
+                queued += 1
+    return queued
+
+
+@task('lms.purge_jobs')
+def purge_jobs(days: int = None, batch_size: int = 1000):
+    """
+    Delete the jobs that succeeded more than days ago, in batches; failed jobs are kept for inspection
+    :param days: defaults to LMS_JOB_RETENTION_DAYS
+    :param batch_size:
+    """
+    cutoff = timezone.now() - timedelta(days=days or settings.LMS_JOB_RETENTION_DAYS)
+    finished = Job.objects.filter(status=Job.Status.SUCCEEDED, finished_at__lt=cutoff)
+    while True:
+        job_ids = list(finished.values_list('id', flat=True)[:batch_size])
+        if not job_ids:
+            return
+        Job.objects.filter(id__in=job_ids).delete()
@@ -0,0 +1,105 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE LMS_Core_books_search USING fts5(
+        title, author_names, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO LMS_Core_books_search (rowid, title, author_names)
+    SELECT b.id, b.title, COALESCE((
+        SELECT group_concat(a.name, ' ') FROM LMS_Core_authors a
+        INNER JOIN LMS_Core_authors_books ab ON ab.authors_id = a.id
+        WHERE ab.books_id = b.id
+    ), '')
+    FROM LMS_Core_books b
+    """,
+    """
+    CREATE TRIGGER LMS_Core_books_search_ai AFTER INSERT ON LMS_Core_books BEGIN
+        INSERT INTO LMS_Core_books_search (rowid, title, author_names) VALUES (new.id, new.title, '');
+    END
+    """,
+    """
+    CREATE TRIGGER LMS_Core_books_search_au AFTER UPDATE OF title ON LMS_Core_books BEGIN
+        UPDATE LMS_Core_books_search SET title = new.title WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER LMS_Core_books_search_ad AFTER DELETE ON LMS_Core_books BEGIN
+        DELETE FROM LMS_Core_books_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER LMS_Core_authors_books_search_ai AFTER INSERT ON LMS_Core_authors_books BEGIN
+        UPDATE LMS_Core_books_search SET author_names = COALESCE((
+            SELECT group_concat(a.name, ' ') FROM LMS_Core_authors a
+            INNER JOIN LMS_Core_authors_books ab ON ab.authors_id = a.id
+            WHERE ab.books_id = new.books_id
+        ), '') WHERE rowid = new.books_id;
+    END
+    """,
+    """
+    CREATE TRIGGER LMS_Core_authors_books_search_ad AFTER DELETE ON LMS_Core_authors_books BEGIN
+        UPDATE LMS_Core_books_search SET author_names = COALESCE((
+            SELECT group_concat(a.name, ' ') FROM LMS_Core_authors a
+            INNER JOIN LMS_Core_authors_books ab ON ab.authors_id = a.id
+            WHERE ab.books_id = old.books_id
+        ), '') WHERE rowid = old.books_id;
+    END
+    """,
+    """
+    CREATE TRIGGER LMS_Core_authors_search_au AFTER UPDATE OF name ON LMS_Core_authors BEGIN
+        UPDATE LMS_Core_books_search SET author_names = COALESCE((
+            SELECT group_concat(a.name, ' ') FROM LMS_Core_authors a
+            INNER JOIN LMS_Core_authors_books ab ON ab.authors_id = a.id
+            WHERE ab.books_id = LMS_Core_books_search.rowid
+        ), '') WHERE rowid IN (SELECT books_id FROM LMS_Core_authors_books WHERE authors_id = new.id);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS LMS_Core_authors_search_au',
+    'DROP TRIGGER IF EXISTS LMS_Core_authors_books_search_ad',
+    'DROP TRIGGER IF EXISTS LMS_Core_authors_books_search_ai',
+    'DROP TRIGGER IF EXISTS LMS_Core_books_search_ad',
+    'DROP TRIGGER IF EXISTS LMS_Core_books_search_au',
+    'DROP TRIGGER IF EXISTS LMS_Core_books_search_ai',
+    'DROP TABLE IF EXISTS LMS_Core_books_search',
+]
+
+MYSQL_FORWARD = [
+    'ALTER TABLE LMS_Core_books ADD FULLTEXT INDEX LMS_Core_books_title_ft (title)',
+    'ALTER TABLE LMS_Core_authors ADD FULLTEXT INDEX LMS_Core_authors_name_ft (name)',
+]
+
+MYSQL_BACKWARD = [
+    'ALTER TABLE LMS_Core_authors DROP INDEX LMS_Core_authors_name_ft',
+    'ALTER TABLE LMS_Core_books DROP INDEX LMS_Core_books_title_ft',
+]
+
+
+def run_statements(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index over book titles and author names: FULLTEXT indexes on MySQL,
+    a trigger-maintained FTS5 table on SQLite. Other backends fall back to LIKE.
+    """
+
+    dependencies = [
+        ('LMS_Core', '0002_alter_authors_options_alter_books_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'mysql': MYSQL_FORWARD}),
+            run_statements({'sqlite': SQLITE_BACKWARD, 'mysql': MYSQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from LMS_Core.operations import AddIndexOnline
+
+
+class Migration(migrations.Migration):
+    """
+    Borrower profiles for the loans. The index of the new loan column is built
+    without blocking the lending writes of a live library
+    """
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0003_books_full_text_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Borrower',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Borrower Name')),
+                ('mobile', models.CharField(max_length=32, unique=True, verbose_name='Mobile Number')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Borrowers',
+                'verbose_name_plural': 'Borrowers',
+            },
+        ),
+        migrations.AddField(
+            model_name='booklending',
+            name='borrower_profile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='loans', to='LMS_Core.borrower', verbose_name='Borrower'),
+        ),
+        AddIndexOnline(
+            model_name='booklending',
+            index=models.Index(fields=['borrower_profile', 'book_returned'], name='lms_lending_borrower_open_idx'),
+        ),
+    ]
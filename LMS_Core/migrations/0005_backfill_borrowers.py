@@ -0,0 +1,64 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_borrowers(apps, schema_editor):
+    """
+    Create a Borrower per distinct mobile number found in the lending JSON and
+    link the lendings to it, walking the table in primary key batches so that
+    memory and transaction size stay bounded on large tables. Legacy rows with
+    a mobile number too long for the column stay unlinked, since a cut number
+    could belong to someone else; names are cut to fit.
+    """
+    Borrower = apps.get_model('LMS_Core', 'Borrower')
+    mobile_length = Borrower._meta.get_field('mobile').max_length
+    name_length = Borrower._meta.get_field('name').max_length
+    BookLending = apps.get_model('LMS_Core', 'BookLending')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        batch = list(
+            BookLending.objects.using(db_alias).filter(id__gt=last_id, borrower_profile__isnull=True)
+            .order_by('id').values('id', 'borrower')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        last_id = batch[-1]['id']
+
+        mobiles, names = {}, {}
+        for row in batch:
+            info = row['borrower']
+            if isinstance(info, dict) and info.get('mobile'):
+                mobile = ''.join(str(info['mobile']).split())
+                if len(mobile) > mobile_length:
+                    continue
+                mobiles[row['id']] = mobile
+                names.setdefault(mobile, str(info.get('name') or '')[:name_length])
+        if not mobiles:
+            continue
+
+        with transaction.atomic(using=db_alias):
+            Borrower.objects.using(db_alias).bulk_create(
+                [Borrower(mobile=mobile, name=name) for mobile, name in names.items()],
+                ignore_conflicts=True
+            )
+            borrower_ids = dict(Borrower.objects.using(db_alias).filter(mobile__in=names).values_list('mobile', 'id'))
+            BookLending.objects.using(db_alias).bulk_update(
+                [BookLending(id=lend_id, borrower_profile_id=borrower_ids[mobile]) for lend_id, mobile in mobiles.items()],
+                ['borrower_profile'],
+                batch_size=BATCH_SIZE
+            )
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own instead of holding one transaction over the whole table
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0004_borrower'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_borrowers, migrations.RunPython.noop),
+    ]
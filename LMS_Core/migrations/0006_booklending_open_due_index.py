@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+from LMS_Core.operations import AddIndexOnline
+
+
+class Migration(migrations.Migration):
+    """
+    Index for the overdue-loans query, built without blocking the lending
+    writes of a live library
+    """
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0005_backfill_borrowers'),
+    ]
+
+    operations = [
+        AddIndexOnline(
+            model_name='booklending',
+            index=models.Index(fields=['book_returned', 'due_date'], name='lms_lending_open_due_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+from LMS_Core.operations import AddIndexOnline
+
+
+class Migration(migrations.Migration):
+    """
+    Indexes for the sort, keyset, filter and export paths of the API, built
+    without blocking writes so the migration can run against large live tables
+    """
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0006_booklending_open_due_index'),
+    ]
+
+    operations = [
+        AddIndexOnline(
+            model_name='books',
+            index=models.Index(fields=['title', 'id', 'updated_at'], name='lms_books_title_idx'),
+        ),
+        AddIndexOnline(
+            model_name='books',
+            index=models.Index(fields=['available'], name='lms_books_available_idx'),
+        ),
+        AddIndexOnline(
+            model_name='books',
+            index=models.Index(fields=['updated_at'], name='lms_books_updated_idx'),
+        ),
+        AddIndexOnline(
+            model_name='authors',
+            index=models.Index(fields=['name', 'id', 'updated_at'], name='lms_authors_name_idx'),
+        ),
+        AddIndexOnline(
+            model_name='authors',
+            index=models.Index(fields=['updated_at'], name='lms_authors_updated_idx'),
+        ),
+        AddIndexOnline(
+            model_name='borrower',
+            index=models.Index(fields=['name', 'id'], name='lms_borrowers_name_idx'),
+        ),
+        AddIndexOnline(
+            model_name='booklending',
+            index=models.Index(fields=['borrow_date', 'id', 'updated_at'], name='lms_lending_borrow_date_idx'),
+        ),
+        AddIndexOnline(
+            model_name='booklending',
+            index=models.Index(fields=['updated_at'], name='lms_lending_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+from importlib import import_module
+
+from django.db import migrations, models, transaction
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+full_text_search = import_module('LMS_Core.migrations.0003_books_full_text_search')
+
+
+def restore_search_triggers(apps, schema_editor):
+    """
+    SQLite changes the books table by rebuilding it, which drops the triggers
+    keeping the full-text index in sync with the titles; create them again
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in full_text_search.SQLITE_FORWARD:
+        if 'ON LMS_Core_books BEGIN' in statement:
+            schema_editor.execute(statement)
+
+
+def backfill_copies(apps, schema_editor):
+    """
+    Derive the inventory of every book from its open lendings, which are what
+    return-book will put back on the shelf: enough copies to cover them (at
+    least one) and the rest available. A book marked unavailable without an
+    open lending was withdrawn by hand; its copy stays off the shelf.
+    Books are walked in primary key batches so that transactions stay small.
+    """
+    Books = apps.get_model('LMS_Core', 'Books')
+    LendingBooks = apps.get_model('LMS_Core', 'BookLending').book.through
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        batch = list(
+            Books.objects.using(db_alias).filter(id__gt=last_id).order_by('id').values_list('id', 'available')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        last_id = batch[-1][0]
+
+        open_loans = dict(
+            LendingBooks.objects.using(db_alias)
+            .filter(books_id__in=[book_id for book_id, _ in batch], booklending__book_returned=False)
+            .values('books_id').annotate(loans=Count('id')).values_list('books_id', 'loans')
+        )
+        changed = []
+        for book_id, available in batch:
+            loans = open_loans.get(book_id, 0)
+            if loans or not available:
+                copies = max(1, loans)
+                available_count = copies - loans if available else 0
+                changed.append(Books(id=book_id, copies=copies, available_count=available_count, available=available_count > 0))
+        if changed:
+            with transaction.atomic(using=db_alias):
+                Books.objects.using(db_alias).bulk_update(
+                    changed, ['copies', 'available_count', 'available'], batch_size=BATCH_SIZE
+                )
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own instead of holding one transaction over the whole table
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='books',
+            name='copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='books',
+            name='available_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(backfill_copies, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='books',
+            constraint=models.CheckConstraint(
+                check=models.Q(available_count__lte=models.F('copies')), name='lms_books_available_lte_copies'
+            ),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
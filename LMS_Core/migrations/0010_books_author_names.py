@@ -0,0 +1,55 @@
+from django.db import migrations, models, transaction
+
+from LMS_Core.operations import restore_search_triggers
+
+BATCH_SIZE = 1000
+
+
+def backfill_author_names(apps, schema_editor):
+    """
+    Copy the names of the authors of every book onto it, in registration order.
+    Books are walked in primary key batches so that transactions stay small;
+    books without authors keep the default empty list.
+    """
+    Books = apps.get_model('LMS_Core', 'Books')
+    AuthorBooks = apps.get_model('LMS_Core', 'Authors').books.through
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        book_ids = list(
+            Books.objects.using(db_alias).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not book_ids:
+            return
+        last_id = book_ids[-1]
+
+        names = {}
+        registrations = AuthorBooks.objects.using(db_alias).filter(books_id__in=book_ids).order_by('id')
+        for book_id, name in registrations.values_list('books_id', 'authors__name'):
+            names.setdefault(book_id, []).append(name)
+        if names:
+            with transaction.atomic(using=db_alias):
+                Books.objects.using(db_alias).bulk_update(
+                    [Books(id=book_id, author_names=book_names) for book_id, book_names in names.items()],
+                    ['author_names'], batch_size=BATCH_SIZE
+                )
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own instead of holding one transaction over the whole table
+    atomic = False
+
+    dependencies = [
+        ('LMS_Core', '0009_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_triggers),
+        migrations.AddField(
+            model_name='books',
+            name='author_names',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Author Names'),
+        ),
+        migrations.RunPython(backfill_author_names, migrations.RunPython.noop),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
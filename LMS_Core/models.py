@@ -1,22 +1,175 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.db.models.lookups import GreaterThan
+
+
+def _open_loans():
+    """
+    :return: expression of the number of copies of the book (OuterRef pk) on open lendings
+    """
+    return Coalesce(Subquery(
+        BookLending.book.through.objects.filter(books_id=OuterRef('pk'), booklending__book_returned=False)
+        .values('books_id').annotate(loans=Count('id')).values('loans')
+    ), 0)
+
+
+class BooksQuerySet(models.QuerySet):
+    """
+    Inventory changes as single conditional UPDATEs: the counters move in the
+    database, so concurrent borrowers and returners never read-modify-write them
+    and need no row lock beyond the statement's own. available mirrors
+    available_count > 0 in the same statement; it is assigned before the counters
+    because MySQL evaluates the assignments of an UPDATE from left to right.
+    """
+
+    def borrow_copy(self, **fields) -> int:
+        """
+        Take one copy of every book that still has one on the shelf
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books a copy was taken of
+        """
+        return self.filter(available_count__gt=0).update(
+            available=Case(When(available_count__gt=1, then=Value(True)), default=Value(False)),
+            available_count=F('available_count') - 1,
+            **fields
+        )
+
+    def return_copies(self, count=1, **fields) -> int:
+        """
+        Put copies of every book back on the shelf
+        :param count: copies returned per book, or a {book_id: copies} mapping of the books getting them
+            back; the mapping becomes one CASE over the distinct numbers of copies in the same UPDATE
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books updated
+        """
+        queryset, returned = self, Value(count)
+        if isinstance(count, dict):
+            book_ids_by_count = {}
+            for book_id, copies in count.items():
+                book_ids_by_count.setdefault(copies, []).append(book_id)
+            queryset = self.filter(pk__in=count)
+            returned = Case(
+                *[When(pk__in=book_ids, then=Value(copies)) for copies, book_ids in book_ids_by_count.items()],
+                default=Value(0)
+            )
+        return queryset.update(available=True, available_count=F('available_count') + returned, **fields)
+
+    def set_copies(self, copies: int, **fields) -> int:
+        """
+        Change the number of copies owned, moving available_count by the same amount
+        but never above the copies that are not on loan, nor below zero, so a withdrawn
+        book stays withdrawn; books with more copies on loan than that are left alone
+        :param copies:
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books updated
+        """
+        open_loans = _open_loans()
+        available_count = Greatest(
+            Least(F('available_count') + copies - F('copies'), Value(copies) - open_loans), Value(0)
+        )
+        return self.alias(open_loans=open_loans).filter(open_loans__lte=copies).update(
+            available=Case(When(GreaterThan(available_count, 0), then=Value(True)), default=Value(False)),
+            available_count=available_count,
+            copies=copies,
+            **fields
+        )
+
+    def withdraw(self, **fields) -> int:
+        """
+        Take every copy on the shelf off it, e.g. for repairs; copies on loan come
+        back on the shelf when they are returned
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books updated
+        """
+        return self.update(available=False, available_count=0, **fields)
+
+    def restock(self, **fields) -> int:
+        """
+        Put every copy that is not on loan back on the shelf
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books updated
+        """
+        open_loans = _open_loans()
+        return self.update(
+            available=Case(When(copies__gt=open_loans, then=Value(True)), default=Value(False)),
+            available_count=F('copies') - open_loans,
+            **fields
+        )
+
+    def registered_author_names(self, lock: bool = False) -> dict:
+        """
+        :param lock: read the registrations with a locking read, which sees the ones
+            committed by concurrent transactions; only inside a transaction
+        :return: {book id: [names of its authors, in registration order]} of the books
+            with authors, from one query
+        """
+        registrations = Authors.books.through.objects.using(self.db).filter(books_id__in=self.values('id'))
+        if lock:
+            connection = transaction.get_connection(self.db)
+            registrations = registrations.select_for_update(
+                of=('self',) if connection.features.has_select_for_update_of else ()
+            )
+        names = {}
+        for book_id, name in registrations.order_by('id').values_list('books_id', 'authors__name'):
+            names.setdefault(book_id, []).append(name)
+        return names
+
+    def refresh_author_names(self, **fields) -> int:
+        """
+        Recompute author_names of the books from their registrations. The books are
+        locked first, so concurrent changes to the authors of a book write its names
+        one after the other, each from the registrations committed before it.
+        :param fields: other columns to set, e.g. updated_at
+        :return: number of books updated
+        """
+        books = self.select_for_update().order_by('id')
+        # The database written to, also when the queryset would read from a replica
+        db = books.db
+        with transaction.atomic(using=db, savepoint=False):
+            book_ids = list(books.values_list('id', flat=True))
+            if not book_ids:
+                return 0
+            names = self.model.objects.using(db).filter(id__in=book_ids).registered_author_names(lock=True)
+            return self.model.objects.using(db).bulk_update(
+                [self.model(id=book_id, author_names=names.get(book_id, []), **fields) for book_id in book_ids],
+                ['author_names', *fields]
+            )
 
 
 class Books(models.Model):
     """
-    Books model to manage the books in a Library
+    Books model to manage the books in a Library; a title owns a number of
+    copies, of which available_count are on the shelf. author_names copies the
+    names of the authors, so lists show them without joining the authors.
     """
     title = models.CharField(max_length=255, verbose_name='Book Title')
     publication_date = models.DateField()
     available = models.BooleanField()
+    copies = models.PositiveIntegerField(default=1)
+    available_count = models.PositiveIntegerField(default=1)
+    # Kept in step with the registrations and author names by LMS_API.signals (see refresh_author_names())
+    author_names = models.JSONField(default=list, blank=True, editable=False, verbose_name='Author Names')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BooksQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
     class Meta:
         verbose_name = 'Books'
         verbose_name_plural = 'Books'
+        constraints = [
+            models.CheckConstraint(check=Q(available_count__lte=F('copies')), name='lms_books_available_lte_copies'),
+        ]
+        indexes = [
+            # Sorted list, keyset pages and the list ETag (updated_at) are index-only
+            models.Index(fields=['title', 'id', 'updated_at'], name='lms_books_title_idx'),
+            models.Index(fields=['available'], name='lms_books_available_idx'),
+            models.Index(fields=['updated_at'], name='lms_books_updated_idx'),
+        ]
 
 
 class Authors(models.Model):
@@ -34,6 +187,46 @@ class Authors(models.Model):
     class Meta:
         verbose_name = 'Authors'
         verbose_name_plural = 'Authors'
+        indexes = [
+            models.Index(fields=['name', 'id', 'updated_at'], name='lms_authors_name_idx'),
+            models.Index(fields=['updated_at'], name='lms_authors_updated_idx'),
+        ]
+
+
+class Borrower(models.Model):
+    """
+    People borrowing books, identified by their mobile number
+    """
+    name = models.CharField(max_length=200, verbose_name='Borrower Name')
+    mobile = models.CharField(max_length=32, unique=True, verbose_name='Mobile Number')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.mobile})"
+
+    @staticmethod
+    def normalize_mobile(mobile) -> str:
+        return ''.join(str(mobile).split())
+
+    @classmethod
+    def get_or_create_from_info(cls, borrower_info: dict):
+        """
+        :param borrower_info: borrower JSON of a lending, with name and mobile
+        :return: the Borrower with that mobile number, created if needed
+        """
+        borrower, created = cls.objects.get_or_create(
+            mobile=cls.normalize_mobile(borrower_info['mobile']),
+            defaults={'name': borrower_info.get('name') or ''}
+        )
+        return borrower
+
+    class Meta:
+        verbose_name = 'Borrowers'
+        verbose_name_plural = 'Borrowers'
+        indexes = [
+            models.Index(fields=['name', 'id'], name='lms_borrowers_name_idx'),
+        ]
 
 
 class BookLending(models.Model):
@@ -42,6 +235,9 @@ class BookLending(models.Model):
     """
     book = models.ManyToManyField(Books, verbose_name='Borrowed Books')
     borrower = models.JSONField(verbose_name='Borrower Information')
+    borrower_profile = models.ForeignKey(
+        Borrower, null=True, blank=True, on_delete=models.PROTECT, related_name='loans', verbose_name='Borrower'
+    )
     borrow_date = models.DateField(verbose_name='Borrow Date')
     due_date = models.DateField(verbose_name='Due Date')
     book_returned = models.BooleanField(default=False, blank=True)
@@ -52,6 +248,78 @@ class BookLending(models.Model):
     def __str__(self):
         return f"Borrow Date: {self.borrow_date}, Due Date: {self.due_date}"
 
+    def save(self, *args, **kwargs):
+        # The borrower JSON stays as posted; the Borrower row makes it queryable
+        if self.borrower_profile_id is None and isinstance(self.borrower, dict) and self.borrower.get('mobile'):
+            self.borrower_profile = Borrower.get_or_create_from_info(self.borrower)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Book Lending History'
         verbose_name_plural = 'Book Lending History'
+        indexes = [
+            models.Index(fields=['borrower_profile', 'book_returned'], name='lms_lending_borrower_open_idx'),
+            models.Index(fields=['book_returned', 'due_date'], name='lms_lending_open_due_idx'),
+            models.Index(fields=['borrow_date', 'id', 'updated_at'], name='lms_lending_borrow_date_idx'),
+            models.Index(fields=['updated_at'], name='lms_lending_updated_idx'),
+        ]
+
+
+class Job(models.Model):
+    """
+    Background job, run by a manage.py run_jobs worker (see LMS_Core.jobs)
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        SUCCEEDED = 'succeeded'
+        FAILED = 'failed'
+
+    task = models.CharField(max_length=100, verbose_name='Task Name')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Keyword Arguments of the Task')
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    run_at = models.DateTimeField(verbose_name='Due At')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True, default='')
+    locked_by = models.CharField(max_length=255, blank=True, default='', verbose_name='Worker')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.task} #{self.id} ({self.status})"
+
+    class Meta:
+        verbose_name = 'Jobs'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            # Due jobs are claimed in run_at order; stale running jobs are found by locked_at
+            models.Index(fields=['status', 'run_at'], name='lms_job_due_idx'),
+            models.Index(fields=['status', 'locked_at'], name='lms_job_running_idx'),
+        ]
+
+
+class PeriodicSchedule(models.Model):
+    """
+    Task enqueued every interval_seconds; the rows are kept in line with
+    settings.LMS_PERIODIC_JOBS by the workers
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name='Schedule Name')
+    task = models.CharField(max_length=100, verbose_name='Task Name')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Keyword Arguments of the Task')
+    interval_seconds = models.PositiveIntegerField()
+    next_run_at = models.DateTimeField()
+    last_enqueued_at = models.DateTimeField(null=True, blank=True)
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.task} every {self.interval_seconds}s"
+
+    class Meta:
+        verbose_name = 'Periodic Schedules'
+        verbose_name_plural = 'Periodic Schedules'
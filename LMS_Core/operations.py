@@ -0,0 +1,42 @@
+from importlib import import_module
+
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexOnline(AddIndex):
+    """
+    AddIndex that keeps the table writable while the index is built:
+    ALGORITHM=INPLACE, LOCK=NONE on MySQL and CREATE INDEX CONCURRENTLY on
+    PostgreSQL, which needs the migration to be non-atomic. Other backends get
+    the plain CREATE INDEX.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        vendor = schema_editor.connection.vendor
+        if vendor == 'mysql':
+            schema_editor.execute(f'{self.index.create_sql(model, schema_editor)} ALGORITHM=INPLACE LOCK=NONE')
+        elif vendor == 'postgresql':
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def describe(self):
+        return f'{super().describe()} without locking the table'
+
+
+def restore_search_triggers(apps, schema_editor):
+    """
+    RunPython code creating again the SQLite triggers that keep the full-text
+    index of 0003 in sync with the book titles, which a rebuild of the books
+    table drops. Triggers that survived, e.g. because SQLite changed the table
+    in place, are left as they are.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    full_text_search = import_module('LMS_Core.migrations.0003_books_full_text_search')
+    for statement in full_text_search.SQLITE_FORWARD:
+        if 'ON LMS_Core_books BEGIN' in statement:
+            schema_editor.execute(statement.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS', 1))
@@ -0,0 +1,184 @@
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Books, Authors, BookLending, Borrower
+
+TITLE_WORDS = [
+    'Shadow', 'River', 'Garden', 'Empire', 'Silent', 'Winter', 'Secret', 'Golden', 'Broken', 'Last',
+    'Night', 'City', 'Ocean', 'Fire', 'Stone', 'Journey', 'House', 'Light', 'Storm', 'Kingdom',
+    'Memory', 'Forest', 'Glass', 'Song', 'Road', 'Island', 'Mountain', 'Letter', 'Machine', 'Star',
+]
+FIRST_NAMES = [
+    'Rafat', 'Ayesha', 'John', 'Maria', 'Chen', 'Fatima', 'David', 'Priya', 'Olga', 'Kwame',
+    'Sofia', 'Hiro', 'Amina', 'Lucas', 'Elena', 'Omar', 'Grace', 'Ivan', 'Nadia', 'Tariq',
+]
+LAST_NAMES = [
+    'Hossain', 'Smith', 'Garcia', 'Wang', 'Rahman', 'Johnson', 'Patel', 'Ivanova', 'Mensah', 'Rossi',
+    'Tanaka', 'Khan', 'Silva', 'Petrov', 'Ahmed', 'Brown', 'Kim', 'Haddad', 'Novak', 'Chowdhury',
+]
+
+
+def _skewed_index(rng: random.Random, size: int, skew: float) -> int:
+    """
+    :return: index in [0, size), heavily biased towards the start (a few popular items, a long tail)
+    """
+    return min(int(size * rng.random() ** skew), size - 1)
+
+
+def _insert(model, objects: list, using: str) -> list:
+    """
+    bulk_create one batch and return the new primary keys. Backends that can
+    not return them (MySQL) hand out a consecutive block to a single-statement
+    insert while the seeder is the only writer, so it is recovered from the max id.
+    """
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        model.objects.using(using).bulk_create(objects, batch_size=len(objects))
+        if connection.features.can_return_rows_from_bulk_insert:
+            return [obj.pk for obj in objects]
+        last_id = model.objects.using(using).aggregate(last_id=Max('id'))['last_id']
+    return list(range(last_id - len(objects) + 1, last_id + 1))
+
+
+def seed_library(books: int, authors: int, lendings: int, batch_size: int = 5000, seed: int = 42,
+                 using: str = 'default', log=None) -> dict:
+    """
+    Fill the catalog with synthetic but realistically shaped data: most books
+    have one author, author output and book popularity are heavily skewed, and
+    lendings spread over three years with the recent ones still open (some overdue)
+    :param books:
+    :param authors:
+    :param lendings:
+    :param batch_size: rows per bulk insert
+    :param seed: random seed, so runs are reproducible
+    :param using: database alias
+    :param log: optional callable receiving progress messages
+    :return: number of rows created per table
+    """
+    rng = random.Random(seed)
+    # Stock has its own generator, so the rest of the data set is the same as before copies existed
+    stock_rng = random.Random(seed + 1)
+    log = log or (lambda message: None)
+    today = timezone.localdate()
+    created = {'books': 0, 'authors': 0, 'author_books': 0, 'borrowers': 0, 'lendings': 0, 'lending_books': 0}
+
+    book_ids, copies_by_id = [], {}
+    for start in range(0, books, batch_size):
+        batch = []
+        for i in range(min(batch_size, books - start)):
+            # Most titles have one copy, a few are stocked several times
+            copies = 1 if stock_rng.random() < 0.8 else stock_rng.randint(2, 12)
+            batch.append(Books(
+                title=' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))) + f' {start + i}',
+                publication_date=date(1900, 1, 1) + timedelta(days=rng.randint(0, 45000)),
+                available=True,
+                copies=copies,
+                available_count=copies
+            ))
+        book_ids += _insert(Books, batch, using)
+        copies_by_id.update(zip(book_ids[-len(batch):], (book.copies for book in batch)))
+        created['books'] += len(batch)
+        log(f'books: {created["books"]}/{books}')
+
+    author_ids = []
+    for start in range(0, authors, batch_size):
+        batch = [
+            Authors(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {start + i}')
+            for i in range(min(batch_size, authors - start))
+        ]
+        author_ids += _insert(Authors, batch, using)
+        created['authors'] += len(batch)
+        log(f'authors: {created["authors"]}/{authors}')
+
+    AuthorBooks = Authors.books.through
+    if author_ids:
+        for start in range(0, len(book_ids), batch_size):
+            links = set()
+            for book_id in book_ids[start:start + batch_size]:
+                author_count = 1 if rng.random() < 0.8 else rng.randint(2, 4)
+                for _ in range(author_count):
+                    links.add((author_ids[_skewed_index(rng, len(author_ids), 3)], book_id))
+            AuthorBooks.objects.using(using).bulk_create(
+                [AuthorBooks(authors_id=author_id, books_id=book_id) for author_id, book_id in links],
+                batch_size=batch_size
+            )
+            # bulk_create sends no m2m_changed, so author_names is filled in here
+            Books.objects.using(using).filter(id__in=book_ids[start:start + batch_size]).refresh_author_names()
+            created['author_books'] += len(links)
+        log(f'author-book links: {created["author_books"]}')
+
+    borrower_count = max(1, lendings // 20) if lendings else 0
+    borrower_ids = []
+    for start in range(0, borrower_count, batch_size):
+        batch = [
+            Borrower(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', mobile=f'01{seed:02d}{start + i:09d}')
+            for i in range(min(batch_size, borrower_count - start))
+        ]
+        borrower_ids += _insert(Borrower, batch, using)
+        created['borrowers'] += len(batch)
+
+    LendingBooks = BookLending.book.through
+    open_loans = Counter()
+    if book_ids:
+        for start in range(0, lendings, batch_size):
+            batch, batch_books = [], []
+            for i in range(min(batch_size, lendings - start)):
+                borrow_date = today - timedelta(days=int(1095 * rng.random() ** 0.7))
+                due_date = borrow_date + timedelta(days=14)
+                returned = (today - borrow_date).days > 45 or rng.random() < 0.6
+                borrower_index = _skewed_index(rng, len(borrower_ids), 2)
+                batch.append(BookLending(
+                    borrower={'name': 'Borrower', 'mobile': f'01{seed:02d}{borrower_index:09d}'},
+                    borrower_profile_id=borrower_ids[borrower_index],
+                    borrow_date=borrow_date,
+                    due_date=due_date,
+                    book_returned=returned,
+                    return_date=borrow_date + timedelta(days=rng.randint(1, 30)) if returned else None
+                ))
+                lent = {book_ids[_skewed_index(rng, len(book_ids), 2)] for _ in range(rng.randint(1, 3))}
+                batch_books.append(lent)
+                if not returned:
+                    open_loans.update(lent)
+            lend_ids = _insert(BookLending, batch, using)
+            LendingBooks.objects.using(using).bulk_create(
+                [
+                    LendingBooks(booklending_id=lend_id, books_id=book_id)
+                    for lend_id, lent in zip(lend_ids, batch_books) for book_id in lent
+                ],
+                batch_size=batch_size
+            )
+            created['lendings'] += len(batch)
+            created['lending_books'] += sum(len(lent) for lent in batch_books)
+            log(f'lendings: {created["lendings"]}/{lendings}')
+
+    # Popular books can have more open lendings than copies; they get just enough copies to cover them
+    book_ids_by_stock = {}
+    for book_id, loans in sorted(open_loans.items()):
+        copies = max(copies_by_id[book_id], loans)
+        book_ids_by_stock.setdefault((copies, copies - loans), []).append(book_id)
+    for (copies, available_count), stock_book_ids in book_ids_by_stock.items():
+        for start in range(0, len(stock_book_ids), batch_size):
+            Books.objects.using(using).filter(id__in=stock_book_ids[start:start + batch_size]).update(
+                copies=copies, available_count=available_count, available=available_count > 0
+            )
+    return created
+
+
+def analyze_tables(using: str = 'default'):
+    """
+    Refresh the planner statistics after a bulk load, so query plans and the
+    estimated counts reflect the new table sizes
+    :param using: database alias
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            tables = ', '.join(model._meta.db_table for model in (Books, Authors, Borrower, BookLending))
+            cursor.execute(f'ANALYZE TABLE {tables}')
+        else:
+            cursor.execute('ANALYZE')
@@ -1,3 +1,124 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from LMS_Core import jobs
+from LMS_Core.models import Job, PeriodicSchedule
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(**payload):
+    calls.append(payload)
+
+
+@jobs.task('tests.fail')
+def fail():
+    raise ValueError('Boom')
+
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_once_and_failures_retry_with_backoff(self):
+        job = jobs.enqueue('tests.record', {'n': 1})
+        claimed = jobs.claim('worker-1', 10)
+        self.assertEqual([claimed_job.id for claimed_job in claimed], [job.id])
+        self.assertEqual(jobs.claim('worker-2', 10), [])
+        self.assertTrue(jobs.run(claimed[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.Status.SUCCEEDED, 1, ''))
+        self.assertEqual(calls, [{'n': 1}])
+
+        job = jobs.enqueue('tests.fail', max_attempts=2)
+        with self.assertLogs('lms', 'ERROR') as logs:
+            self.assertFalse(jobs.run(jobs.claim('worker-1', 10)[0]))
+        self.assertIn('failed on attempt 1 of 2', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.QUEUED, 1))
+        delay = (job.run_at - timezone.now()).total_seconds()
+        self.assertTrue(settings.LMS_JOB_RETRY_BACKOFF * 0.7 < delay <= settings.LMS_JOB_RETRY_BACKOFF * 1.2)
+        self.assertEqual(jobs.claim('worker-1', 10), [])
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        with self.assertLogs('lms', 'ERROR'):
+            self.assertFalse(jobs.run(jobs.claim('worker-1', 10)[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+        self.assertIn('Boom', job.last_error)
+        self.assertTrue(settings.LMS_JOB_MAX_BACKOFF * 0.8 <= jobs.retry_delay(30) <= settings.LMS_JOB_MAX_BACKOFF * 1.2)
+
+        job = jobs.enqueue('tests.unknown')
+        with self.assertLogs('lms', 'ERROR'):
+            self.assertFalse(jobs.run(jobs.claim('worker-1', 10)[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 1))
+
+    def test_delayed_and_stale_jobs(self):
+        jobs.enqueue('tests.record', delay=60)
+        self.assertEqual(jobs.claim('worker-1', 10), [])
+
+        job = jobs.enqueue('tests.record')
+        claimed = jobs.claim('worker-1', 10)[0]
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(seconds=settings.LMS_JOB_TIMEOUT + 1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.Status.QUEUED, 1, ''))
+        # The worker that lost the job can not record an outcome for it any more
+        jobs.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+
+    def test_periodic_schedules(self):
+        periodic_jobs = {'every-minute': {'task': 'tests.record', 'every': 60, 'payload': {'n': 2}}}
+        with override_settings(LMS_PERIODIC_JOBS=periodic_jobs):
+            jobs.sync_schedules()
+            self.assertEqual(jobs.enqueue_due_schedules(), 1)
+            self.assertEqual(jobs.enqueue_due_schedules(), 0)
+
+            # Runs missed while no worker was up are not made up for
+            PeriodicSchedule.objects.update(next_run_at=timezone.now() - timedelta(minutes=3, seconds=30))
+            self.assertEqual(jobs.enqueue_due_schedules(), 1)
+            schedule = PeriodicSchedule.objects.get(name='every-minute')
+            self.assertTrue(timezone.now() < schedule.next_run_at <= timezone.now() + timedelta(seconds=60))
+            self.assertEqual(list(Job.objects.values_list('task', 'payload')), [('tests.record', {'n': 2})] * 2)
+
+        with override_settings(LMS_PERIODIC_JOBS={}):
+            jobs.sync_schedules()
+        self.assertFalse(PeriodicSchedule.objects.get(name='every-minute').enabled)
+
+    def test_purge_jobs_keeps_recent_and_failed_jobs(self):
+        old = timezone.now() - timedelta(days=settings.LMS_JOB_RETENTION_DAYS + 1)
+        for status in (Job.Status.SUCCEEDED, Job.Status.FAILED):
+            Job.objects.create(task='tests.record', status=status, run_at=old, finished_at=old)
+        recent = Job.objects.create(task='tests.record', status=Job.Status.SUCCEEDED, run_at=old, finished_at=timezone.now())
+        jobs.purge_jobs(batch_size=1)
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.Status.SUCCEEDED, Job.Status.FAILED})
+        self.assertTrue(Job.objects.filter(id=recent.id).exists())
+
+
+class JobWorkerTestCase(TransactionTestCase):
+    def test_worker_runs_the_due_jobs_in_its_pool(self):
+        calls.clear()
+        for n in range(5):
+            jobs.enqueue('tests.record', {'n': n})
+        jobs.enqueue('tests.fail', max_attempts=1)
+        jobs.enqueue('tests.record', {'n': 'later'}, delay=3600)
+
+        # SQLite's shared in-memory test database fails concurrent writers instead of making them wait
+        concurrency = 1 if connection.vendor == 'sqlite' else 2
+        out = StringIO()
+        with override_settings(LMS_PERIODIC_JOBS={'every-hour': {'task': 'tests.record', 'every': 3600}}):
+            with self.assertLogs('lms', 'ERROR'):
+                call_command('run_jobs', burst=True, concurrency=concurrency, name='test-worker', stdout=out)
+        self.assertIn('test-worker: 6 jobs succeeded, 1 failed', out.getvalue())
+        self.assertEqual(sorted(call.get('n', -1) for call in calls), [-1, 0, 1, 2, 3, 4])
+        self.assertEqual(Job.objects.filter(status=Job.Status.QUEUED).count(), 1)
+        self.assertFalse(Job.objects.filter(status=Job.Status.RUNNING).exists())
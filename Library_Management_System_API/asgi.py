@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Library_Management_System_API.settings')
+# Under ASGI the read endpoints run as native async views
+os.environ.setdefault('LMS_ASYNC_READ_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -11,12 +11,17 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 import environ
 
 env = environ.Env(
     # set casting, default value
     DEBUG=(bool, False),
+    LMS_ASYNC_READ_VIEWS=(bool, False),
+    LMS_SERVER_TIMING=(bool, False),
+    LMS_PROFILING=(bool, False),
+    LMS_METRICS=(bool, False),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -88,18 +93,45 @@ WSGI_APPLICATION = 'Library_Management_System_API.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': env('DB_NAME'),
-        'HOST': env('DB_HOST'),
-        'PORT': env('DB_PORT'),
-        'USER': env('DB_USER'),
-        'PASSWORD': env('DB_PASS'),
-        'OPTIONS': {
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
+if env.str('DATABASE_URL', default=''):
+    # e.g. sqlite:////tmp/lms-primary.sqlite3 to run locally without MySQL
+    DATABASES = {
+        'default': env.db('DATABASE_URL')
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': env('DB_NAME'),
+            'HOST': env('DB_HOST'),
+            'PORT': env('DB_PORT'),
+            'USER': env('DB_USER'),
+            'PASSWORD': env('DB_PASS'),
+            'OPTIONS': {
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
+            }
         }
     }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Tests run on a file database rather than a shared in-memory one, and a locked database is waited
+    # for instead of failing at once, so the concurrency tests can race their threads on SQLite too
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault('timeout', 30)
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', os.path.join(tempfile.gettempdir(), 'lms-test.sqlite3'))
+
+# Read replicas of default, as comma separated database URLs; they become the aliases replica_1, replica_2, ...
+# Safe-method requests to the read views are spread over them (LMS_API.replicas)
+LMS_DATABASE_REPLICAS = []
+for replica_number, replica_url in enumerate(env.list('DB_REPLICA_URLS', default=[]), start=1):
+    DATABASES[f'replica_{replica_number}'] = {**environ.Env.db_url_config(replica_url), 'TEST': {'MIRROR': 'default'}}
+    LMS_DATABASE_REPLICAS.append(f'replica_{replica_number}')
+if LMS_DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['LMS_API.replicas.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://')
 }
 
 # Password validation
@@ -151,7 +183,7 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER':
         'rest_framework_friendly_errors.handlers.friendly_exception_handler',
     'DEFAULT_RENDERER_CLASSES': [
-        'ApReusable.renderer.CustomJSONRenderer',
+        'LMS_API.renderers.TimedJSONRenderer',
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
@@ -163,6 +195,82 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Library Management System
+# Upper bound for the ?count= page size of the list endpoints
+LMS_PAGINATION_MAX_COUNT = 500
+# How list endpoints fill data.count unless ?count_mode= says otherwise: exact, cached or estimated
+LMS_PAGINATION_COUNT_MODE = 'exact'
+# Seconds a cached list count lives; writes to the table invalidate it earlier
+LMS_COUNT_CACHE_TTL = 300
+# Seconds a cached book/author/lending detail lives; writes evict it earlier
+LMS_DETAIL_CACHE_TTL = 3600
+# Most IDs the read-many endpoints resolve in one request
+LMS_READ_MANY_MAX_IDS = 100
+# Most author-book pairs the register/unregister endpoints change in one request
+LMS_AUTHOR_BOOK_MAX_PAIRS = 1000
+# Rows inserted per bulk_create batch by the NDJSON bulk-create endpoints
+LMS_BULK_CREATE_CHUNK_SIZE = 1000
+# Maximum number of per-line errors reported back by the NDJSON bulk-create endpoints
+LMS_BULK_CREATE_MAX_ERRORS = 1000
+# Rows fetched per query while streaming the CSV/NDJSON exports
+LMS_EXPORT_CHUNK_SIZE = 2000
+# List endpoints read serializers of plain model fields with values_list(), and responses of plain
+# JSON values are written by orjson; both give the same bytes as the DRF serializers and json module
+LMS_FAST_SERIALIZATION = True
+# Serve the read endpoints with their async views; asgi.py turns this on unless the environment says otherwise
+LMS_ASYNC_READ_VIEWS = env('LMS_ASYNC_READ_VIEWS')
+# Time every request (queries, SQL, render) into a Server-Timing header and a log line on the 'lms' logger
+LMS_SERVER_TIMING = env('LMS_SERVER_TIMING')
+if LMS_SERVER_TIMING:
+    MIDDLEWARE.insert(0, 'LMS_API.middleware.ServerTimingMiddleware')
+# Profile sampled requests with cProfile into LMS_PROFILE_DIR; read them with manage.py profile_report
+LMS_PROFILING = env('LMS_PROFILING')
+# Fraction of requests profiled per URL name, '*' for every other route, e.g. api-books-read=0.05,*=0.001
+LMS_PROFILE_SAMPLE_RATES = env.dict('LMS_PROFILE_SAMPLE_RATES', cast={'value': float}, default={})
+# Seconds a signed X-LMS-Profile header (manage.py profile_report --token) asks for a profile
+LMS_PROFILE_TOKEN_MAX_AGE = 3600
+LMS_PROFILE_DIR = os.path.join(BASE_DIR, 'logs', 'profiles')
+# Profiles of a route aggregated in memory before its stats file is rewritten
+LMS_PROFILE_FLUSH_EVERY = 20
+if LMS_PROFILING:
+    MIDDLEWARE.insert(0, 'LMS_API.middleware.ProfilingMiddleware')
+# Count requests, latency, errors and queries per route for the Prometheus /metrics endpoint
+LMS_METRICS = env('LMS_METRICS')
+# Directory every worker process shares its metrics through; required with more than one process,
+# and to be emptied when the service (re)starts
+LMS_METRICS_DIR = env.str('LMS_METRICS_DIR', default=None)
+# Seconds between two writes of a process's metrics file
+LMS_METRICS_WRITE_INTERVAL = 5
+# Addresses and networks /metrics answers, e.g. 127.0.0.1,10.0.0.0/8; others get a 403 unless they
+# send LMS_METRICS_TOKEN as an Authorization: Bearer header
+LMS_METRICS_ALLOWED_IPS = env.list('LMS_METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+LMS_METRICS_TOKEN = env.str('LMS_METRICS_TOKEN', default=None)
+if LMS_METRICS:
+    MIDDLEWARE.insert(0, 'LMS_API.middleware.MetricsMiddleware')
+# Seconds the reads of a client that wrote stay on the primary, so it reads its own writes; should
+# exceed the replication lag
+LMS_REPLICA_STICKY_SECONDS = 5
+if LMS_DATABASE_REPLICAS:
+    MIDDLEWARE.append('LMS_API.middleware.ReplicaStickinessMiddleware')
+# Background jobs of LMS_Core.jobs, run by manage.py run_jobs
+# Jobs a worker runs at once, each in a thread of its pool
+LMS_JOB_CONCURRENCY = 4
+# Seconds an idle worker waits before looking for due jobs again
+LMS_JOB_POLL_INTERVAL = 1.0
+# Runs of a failing job before it is marked failed
+LMS_JOB_MAX_ATTEMPTS = 5
+# Seconds before the first retry of a failed job, doubled for every further attempt up to LMS_JOB_MAX_BACKOFF
+LMS_JOB_RETRY_BACKOFF = 10
+LMS_JOB_MAX_BACKOFF = 3600
+# Seconds after which a running job is taken to be lost with its worker, and queued again
+LMS_JOB_TIMEOUT = 900
+# Days succeeded jobs are kept by the lms.purge_jobs task
+LMS_JOB_RETENTION_DAYS = 7
+# Tasks queued at a fixed interval, {name: {'task': ..., 'every': seconds, 'payload': {...}}}
+LMS_PERIODIC_JOBS = {
+    'purge-jobs': {'task': 'lms.purge_jobs', 'every': 86400},
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -219,4 +327,4 @@ LOGGING = {
 
 if not DEBUG:
     LOGGING['loggers']['django']['handlers'] = ['django_log__file']
-    LOGGING['loggers']['bank']['handlers'] = ['lms_log__file']
+    LOGGING['loggers']['lms']['handlers'] = ['lms_log__file']
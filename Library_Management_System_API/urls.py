@@ -18,11 +18,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from LMS_API.views import metricsExposition
 
 urlpatterns = [
     path('@dmin/', admin.site.urls),
     path('api/', include('LMS_API.urls')),
 ]
+if settings.LMS_METRICS:
+    urlpatterns.append(path('metrics', metricsExposition, name='metrics'))
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_ROOT, document_root=settings.STATIC_ROOT)